@@ -1,6 +1,10 @@
 # configs for the model training
 class model_training_configs:
     VALIDATION_ERRORS_DIRECTORY = 'results/validation_errors/'
+    TRIAL_RESULTS_DIRECTORY = 'results/trial_results/'
+    CHECKPOINTS_DIRECTORY = 'results/checkpoints/'
+    # number of epochs between two checkpoints of the trainers and the testers
+    CHECKPOINT_FREQ = 1
     INFO_FREQ = 1
 
 # configs for the model testing
@@ -8,10 +12,69 @@ class model_testing_configs:
     RNN_FORECASTS_DIRECTORY = 'results/rnn_forecasts/'
     RNN_ERRORS_DIRECTORY = 'results/errors'
     PROCESSED_RNN_FORECASTS_DIRECTORY = '/results/processed_rnn_forecasts/'
+    EXPORTED_MODELS_DIRECTORY = 'results/exported_models/'
+    # seeds used to train the final models
+    SEEDS = range(1, 11)
+    # number of seeds trained concurrently
+    NUMBER_OF_TEST_WORKERS = 1
+    # start method of the test workers. With forkserver, the workers are forked from a server process which imports
+    # tensorflow and the tester once. spawn starts every worker from scratch
+    WORKER_START_METHOD = 'forkserver'
+    # number of seeds trained together inside a single graph by each test worker
+    ENSEMBLE_SIZE = 1
+    # number of learning rate cycles of a training run, the forecasts are taken at the end of every cycle
+    SNAPSHOT_ENSEMBLE_SIZE = 1
+
+# configs for the training data pipeline
+class training_data_configs:
+    SHUFFLE_BUFFER_SIZE = 20000
+    # the number of the last input windows (moving window) or points (non moving window) seen by the encoders of the
+    # seq2seq models, 0 for the whole series
+    ENCODER_LOOKBACK = 0
+    # the number of windows of the subsequences sampled across the series into the dense training batches of the moving
+    # window models, 0 to train on the whole series padded to the longest series of the batch
+    WINDOW_SAMPLING_LENGTH = 0
+
+# configs for the temporal convolutional network model
+class tcn_configs:
+    # kernel size of the dilated convolutions, used when it is not tuned by SMAC
+    KERNEL_SIZE = 3
 
 # configs for hyperparameter tuning(SMAC3)
 class hyperparameter_tuning_configs:
     SMAC_RUNCOUNT_LIMIT = 50
 
+# configs for the local forecast server
+class serving_configs:
+    HOST = '127.0.0.1'
+    PORT = 8080
+    # maximum number of series forecasted together in one micro-batch
+    MAX_BATCH_SIZE = 256
+    # maximum time a request waits for other requests to join its micro-batch
+    BATCH_LATENCY_BUDGET_MS = 10
+    ENGINE = 'numpy'
+    # the least recently used models are evicted when the loaded models exceed this budget
+    MODEL_MEMORY_BUDGET_MB = 1024
+    # maximum number of series whose forecasts are cached, the least recently used are evicted first
+    FORECAST_CACHE_SIZE = 100000
+    # stored encoder states of the series forecasted incrementally, one file per model
+    STATE_DIRECTORY = 'results/rnn_states/'
+
 class gpu_configs:
     log_device_placement = False
+
+# configs for the cpu threads and the core pinning of the tensorflow sessions
+class cpu_configs:
+    # number of threads used within an individual op. 0 lets tensorflow decide based on the available cores
+    intra_op_parallelism_threads = 0
+    # number of threads used to run independent ops in parallel. 0 lets tensorflow decide based on the available cores
+    inter_op_parallelism_threads = 0
+    # core pinning policy(none/slot/explicit)
+    # slot: pin to the block of intra_op_parallelism_threads cores at the index core_pinning_slot
+    # explicit: pin to the cores given in pinned_cores
+    core_pinning_policy = "none"
+    core_pinning_slot = 0
+    # comma separated list of cores or core ranges. e.g. 0-3,8
+    pinned_cores = ""
+    # jit compile the training graphs with XLA. Falls back to the regular execution if the build does not support it
+    xla_jit = False
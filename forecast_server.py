@@ -0,0 +1,371 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from utility_scripts.exported_model_loader import load_model, forecast_in_minibatches, \
+    truncate_to_encoder_lookback
+from utility_scripts.forecast_cache import ForecastCache, forecast_cache_key
+from utility_scripts.incremental_forecasting import RNNStateStore, IncrementalForecaster
+from utility_scripts.forecast_postprocessing import extract_level_and_seasonality, denormalize_forecasts
+from utility_scripts.micro_batching import MicroBatcher
+from utility_scripts.model_registry import ModelRegistry
+
+from configs.global_configs import model_testing_configs, serving_configs
+
+# a local HTTP service forecasting with the exported models
+# the models are loaded lazily from the exported models directory by their model identifier, and the least recently
+# used models are evicted when the loaded models exceed the memory budget
+# POST /forecast with the json body {"model": <model identifier>, "series": [{"input": [...], "metadata": [...]}, ...]}
+# the input of a series is its preprocessed test input (the windows of the moving window format, or the sequence of
+# the non moving window format) and the metadata are the values after |# on its last line of the test file
+# POST /update with the same body, where every series also has an "id", advances the stored encoder states of the
+# series over their new inputs only (the inputs added since the last update) and forecasts from the new states. Only
+# the moving window models can be updated
+# the forecasts of a series with an unchanged input are returned from the forecast cache without running the model
+# GET /health lists the loaded models and GET /metrics reports the loads, evictions and hits of the model registry and
+# the forecast cache
+
+HTTP_STATUS_MESSAGES = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error"
+}
+
+
+class ForecastRequestError(Exception):
+
+    def __init__(self, status, message):
+        super(ForecastRequestError, self).__init__(message)
+        self.status = status
+
+
+# an exported model with its own micro-batcher. Every model runs its micro-batches on a single thread of its own
+class ServedModel:
+
+    def __init__(self, model_identifier, export_directory, engine, max_batch_size, latency_budget, loop,
+                 state_file_path=None, forecast_cache=None):
+        self.model = load_model(export_directory, engine)
+        self.__model_identifier = model_identifier
+        self.__forecast_cache = forecast_cache
+        self.model_spec = self.model.model_spec
+        self.memory_size = self.model.memory_size
+        self.__input_format = self.model_spec['input_format']
+        self.__input_size = int(self.model_spec['input_size'])
+        self.__output_size = int(self.model_spec['output_size'])
+
+        self.__executor = ThreadPoolExecutor(max_workers=1)
+        self.__loop = loop
+        self.__micro_batcher = MicroBatcher(self.__forecast, max_batch_size, latency_budget, self.__executor, loop)
+        self.__max_batch_size = max_batch_size
+
+        # the incremental forecasts need the encoder states, which only the numpy engine exposes
+        # the stored states summarize the whole series, so the models with an encoder lookback cannot be updated
+        # the non moving window format normalizes the whole series by its last level, so the states of its earlier
+        # inputs do not match the normalization of the new inputs once the level changes, and it cannot be updated
+        if state_file_path is not None and engine == "numpy" and not self.model_spec.get('encoder_lookback', 0) \
+                and self.__input_format == "moving_window":
+            inference_engine = self.model.inference_engine
+            self.__incremental_forecaster = IncrementalForecaster(
+                inference_engine, RNNStateStore(state_file_path, inference_engine.state_size))
+        else:
+            self.__incremental_forecaster = None
+
+    def __forecast(self, list_of_inputs):
+        return forecast_in_minibatches(self.model, list_of_inputs, self.__max_batch_size)
+
+    # convert the input of a series to the shape of the test inputs, [sequence_length, input_size]
+    def prepare_input(self, series_input):
+        if self.__input_format == "moving_window":
+            return np.asarray(series_input, dtype=np.float32).reshape(-1, self.__input_size)
+        return np.asarray(series_input, dtype=np.float32).reshape(-1, 1)
+
+    def __prepare_series(self, list_of_series):
+        list_of_inputs = []
+        level_values = []
+        seasonal_values = []
+        for series in list_of_series:
+            level_value, series_seasonal_values = extract_level_and_seasonality(
+                series['metadata'], self.__input_format, self.__output_size,
+                self.model_spec['without_stl_decomposition'])
+            list_of_inputs.append(self.prepare_input(series['input']))
+            level_values.append(level_value)
+            seasonal_values.append(series_seasonal_values)
+
+        if not self.model_spec['without_stl_decomposition']:
+            seasonal_values = np.stack(seasonal_values, axis=0)
+
+        return list_of_inputs, level_values, seasonal_values
+
+    # convert the forecasts of all the seeds to the original units
+    # returns the ensembled forecasts (the median over the seeds, as in the ensembling script) and the forecasts of
+    # every seed
+    def __denormalize(self, seed_forecasts, level_values, seasonal_values):
+        def denormalize(forecasts):
+            return denormalize_forecasts(forecasts, level_values, seasonal_values,
+                                         self.model_spec['contain_zero_values'],
+                                         self.model_spec['integer_conversion'],
+                                         self.model_spec['without_stl_decomposition'])
+
+        ensembled_forecasts = denormalize(np.nanmedian(seed_forecasts, axis=0))
+        return ensembled_forecasts, [denormalize(forecasts) for forecasts in seed_forecasts]
+
+    # forecast the series of a request in the original units
+    async def forecast(self, list_of_series):
+        list_of_inputs, level_values, seasonal_values = self.__prepare_series(list_of_series)
+        list_of_inputs = truncate_to_encoder_lookback(self.model_spec, list_of_inputs)
+
+        if self.__forecast_cache is not None:
+            cache_keys = [forecast_cache_key(self.__model_identifier, self.model.version, inputs, self.__output_size)
+                          for inputs in list_of_inputs]
+            list_of_forecasts = [self.__forecast_cache.get(cache_key) for cache_key in cache_keys]
+        else:
+            list_of_forecasts = [None] * len(list_of_inputs)
+
+        # only the series without cached forecasts are forecasted by the model
+        uncached_indices = [index for index, forecasts in enumerate(list_of_forecasts) if forecasts is None]
+        if uncached_indices:
+            new_forecasts = await self.__micro_batcher.submit([list_of_inputs[index] for index in uncached_indices])
+            for position, index in enumerate(uncached_indices):
+                list_of_forecasts[index] = new_forecasts[:, position]
+                if self.__forecast_cache is not None:
+                    self.__forecast_cache.put(cache_keys[index], new_forecasts[:, position])
+
+        seed_forecasts = np.stack(list_of_forecasts, axis=1)
+        return self.__denormalize(seed_forecasts, level_values, seasonal_values)
+
+    def __update(self, series_ids, list_of_new_inputs):
+        seed_forecasts = self.__incremental_forecaster.update(series_ids, list_of_new_inputs)
+        self.__incremental_forecaster.save()
+        return seed_forecasts
+
+    # advance the stored states of the series of a request over their new inputs and forecast in the original units
+    # the updates run on the thread of the micro-batches, so that the stored states are never updated concurrently
+    async def update(self, list_of_series):
+        if self.__incremental_forecaster is None:
+            raise ForecastRequestError(400, "The incremental forecasts require the numpy engine, a state directory "
+                                            "and a moving window model without an encoder lookback")
+
+        series_ids = [str(series['id']) for series in list_of_series]
+        list_of_new_inputs, level_values, seasonal_values = self.__prepare_series(list_of_series)
+        seed_forecasts = await self.__loop.run_in_executor(self.__executor, self.__update, series_ids,
+                                                                        list_of_new_inputs)
+        return self.__denormalize(seed_forecasts, level_values, seasonal_values)
+
+    def close(self):
+        self.__executor.shutdown()
+        self.model.close()
+
+
+class ForecastServer:
+
+    def __init__(self, exported_models_directory, engine, max_batch_size, latency_budget, state_directory,
+                 memory_budget, forecast_cache, loop):
+        self.__exported_models_directory = exported_models_directory
+        self.__engine = engine
+        self.__max_batch_size = max_batch_size
+        self.__latency_budget = latency_budget
+        self.__state_directory = state_directory
+        self.__loop = loop
+
+        self.model_registry = ModelRegistry(self.__load_model, memory_budget)
+        self.forecast_cache = forecast_cache
+
+    # load the model exported by the model tester under the model identifier
+    def __load_model(self, model_identifier):
+        export_directory = os.path.join(self.__exported_models_directory, model_identifier)
+        if os.path.basename(model_identifier) != model_identifier or model_identifier.startswith(".") or \
+                not os.path.isdir(export_directory):
+            raise ForecastRequestError(404, "Unknown model {}".format(model_identifier))
+
+        start_time = time.time()
+        served_model = ServedModel(model_identifier, export_directory, self.__engine, self.__max_batch_size,
+                                   self.__latency_budget, self.__loop,
+                                   os.path.join(self.__state_directory, model_identifier + ".npz"),
+                                   self.forecast_cache)
+        print("Loaded the model {} in {:.2f}s".format(model_identifier, time.time() - start_time))
+        return served_model
+
+    async def __handle_forecast(self, request_body, incremental):
+        try:
+            request = json.loads(request_body.decode("utf-8"))
+            model_identifier = str(request['model'])
+            list_of_series = request['series']
+        except (ValueError, KeyError, TypeError):
+            raise ForecastRequestError(400, "The request body should be a json object with the model and the series")
+
+        # the models are loaded outside the event loop, so that the other requests are served during a load
+        served_model = await self.__loop.run_in_executor(None, self.model_registry.acquire, model_identifier)
+        try:
+            return await self.__forecast(served_model, model_identifier, list_of_series, incremental)
+        finally:
+            self.model_registry.release(model_identifier)
+
+    async def __forecast(self, served_model, model_identifier, list_of_series, incremental):
+        try:
+            if incremental:
+                ensembled_forecasts, seed_forecasts = await served_model.update(list_of_series)
+            else:
+                ensembled_forecasts, seed_forecasts = await served_model.forecast(list_of_series)
+        except (ValueError, KeyError, TypeError, IndexError) as exception:
+            raise ForecastRequestError(400, "Invalid series: {}".format(exception))
+
+        return {
+            'model': model_identifier,
+            'forecasts': ensembled_forecasts.tolist(),
+            'seed_forecasts': {str(seed): forecasts.tolist()
+                               for seed, forecasts in zip(served_model.model_spec['seeds'], seed_forecasts)}
+        }
+
+    async def __route(self, method, path, request_body):
+        if path == "/health":
+            return {'status': "ok", 'models': self.model_registry.metrics()['resident_models']}
+        if path == "/metrics":
+            metrics = {'model_registry': self.model_registry.metrics()}
+            if self.forecast_cache is not None:
+                metrics['forecast_cache'] = self.forecast_cache.metrics()
+            return metrics
+        if path in ("/forecast", "/update"):
+            if method != "POST":
+                raise ForecastRequestError(405, "Use POST to forecast")
+            return await self.__handle_forecast(request_body, incremental=path == "/update")
+        raise ForecastRequestError(404, "Unknown path {}".format(path))
+
+    # a minimal HTTP/1.1 handler, one request per connection
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                header_line = (await reader.readline()).decode("latin-1").strip()
+                if not header_line:
+                    break
+                name, _, value = header_line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            if len(request_line) < 2:
+                raise ForecastRequestError(400, "Malformed request line")
+            method, path = request_line[0], request_line[1]
+
+            content_length = int(headers.get('content-length', 0))
+            request_body = await reader.readexactly(content_length) if content_length > 0 else b""
+
+            status, response = 200, await self.__route(method, path, request_body)
+        except ForecastRequestError as exception:
+            status, response = exception.status, {'error': str(exception)}
+        except (ValueError, asyncio.IncompleteReadError) as exception:
+            status, response = 400, {'error': str(exception)}
+        except Exception as exception:
+            status, response = 500, {'error': str(exception)}
+
+        response_body = json.dumps(response).encode("utf-8")
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n"
+                     .format(status, HTTP_STATUS_MESSAGES[status], len(response_body)).encode("latin-1"))
+        writer.write(response_body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser("Serve forecasts of exported models over HTTP")
+    argument_parser.add_argument('--exported_models_directory', required=False,
+                                 help='The directory of the models exported by the model tester. Every model is served under its model identifier, the name of its directory. Default is results/exported_models')
+    argument_parser.add_argument('--engine', required=False,
+                                 help='The inference engine(tensorflow/numpy). Default is numpy')
+    argument_parser.add_argument('--state_directory', required=False,
+                                 help='The directory of the stored encoder states of the incremental forecasts(numpy engine only). Default is results/rnn_states')
+    argument_parser.add_argument('--model_memory_budget_mb', required=False,
+                                 help='The memory budget in megabytes of the loaded models. Default is 1024')
+    argument_parser.add_argument('--forecast_cache_size', required=False,
+                                 help='The maximum number of series whose forecasts are cached. 0 disables the cache. Default is 100000')
+    argument_parser.add_argument('--forecast_cache_file', required=False,
+                                 help='The file the forecast cache is loaded from at the start and written to at the shutdown. Default is no file')
+    argument_parser.add_argument('--host', required=False,
+                                 help='The address to listen on. Default is 127.0.0.1')
+    argument_parser.add_argument('--port', required=False,
+                                 help='The port to listen on. Default is 8080')
+    argument_parser.add_argument('--max_batch_size', required=False,
+                                 help='The maximum number of series forecasted together in one micro-batch. Default is 256')
+    argument_parser.add_argument('--batch_latency_budget_ms', required=False,
+                                 help='The maximum time in milliseconds a request waits for other requests to join its micro-batch. Default is 10')
+
+    # parse the user arguments
+    args = argument_parser.parse_args()
+
+    if args.engine:
+        engine = args.engine
+    else:
+        engine = serving_configs.ENGINE
+
+    if args.host:
+        host = args.host
+    else:
+        host = serving_configs.HOST
+
+    if args.port:
+        port = int(args.port)
+    else:
+        port = serving_configs.PORT
+
+    if args.max_batch_size:
+        max_batch_size = int(args.max_batch_size)
+    else:
+        max_batch_size = serving_configs.MAX_BATCH_SIZE
+
+    if args.batch_latency_budget_ms:
+        batch_latency_budget_ms = float(args.batch_latency_budget_ms)
+    else:
+        batch_latency_budget_ms = serving_configs.BATCH_LATENCY_BUDGET_MS
+
+    if args.state_directory:
+        state_directory = args.state_directory
+    else:
+        state_directory = serving_configs.STATE_DIRECTORY
+
+    if args.exported_models_directory:
+        exported_models_directory = args.exported_models_directory
+    else:
+        exported_models_directory = model_testing_configs.EXPORTED_MODELS_DIRECTORY
+
+    if args.model_memory_budget_mb:
+        model_memory_budget_mb = float(args.model_memory_budget_mb)
+    else:
+        model_memory_budget_mb = serving_configs.MODEL_MEMORY_BUDGET_MB
+
+    if args.forecast_cache_size:
+        forecast_cache_size = int(args.forecast_cache_size)
+    else:
+        forecast_cache_size = serving_configs.FORECAST_CACHE_SIZE
+
+    if forecast_cache_size > 0:
+        forecast_cache = ForecastCache(forecast_cache_size, args.forecast_cache_file)
+    else:
+        forecast_cache = None
+
+    loop = asyncio.get_event_loop()
+    forecast_server = ForecastServer(exported_models_directory, engine, max_batch_size,
+                                     batch_latency_budget_ms / 1000.0, state_directory,
+                                     model_memory_budget_mb * 1024 * 1024, forecast_cache, loop)
+
+    server = loop.run_until_complete(asyncio.start_server(forecast_server.handle_connection, host, port))
+    print("Serving forecasts on http://{}:{}".format(host, port))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        forecast_server.model_registry.close()
+        if forecast_cache is not None:
+            forecast_cache.save()
+        loop.close()
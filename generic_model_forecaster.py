@@ -0,0 +1,89 @@
+import argparse
+import csv
+import os
+import time
+
+from utility_scripts.test_data_reader import read_txt_test_data, read_tfrecord_test_data
+from utility_scripts.exported_model_loader import load_model, forecast_in_minibatches, \
+    truncate_to_encoder_lookback
+
+from configs.global_configs import model_testing_configs
+
+# tensorflow is imported only by the tensorflow engine, so that the numpy engine starts without it
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser("Forecast with an exported model")
+    argument_parser.add_argument('--exported_model_directory', required=True,
+                                 help='The directory of the model exported by the model tester')
+    argument_parser.add_argument('--binary_test_file', required=False,
+                                 help='The tfrecords file for the test data')
+    argument_parser.add_argument('--txt_test_file', required=False,
+                                 help='The txt file for the test data. Used if the tfrecords file is not given')
+    argument_parser.add_argument('--engine', required=False,
+                                 help='The inference engine(tensorflow/numpy). Default is tensorflow')
+    argument_parser.add_argument('--forecasts_directory', required=False,
+                                 help='The directory to write the forecasts to. Default is the rnn forecasts directory')
+    argument_parser.add_argument('--minibatch_size', required=False,
+                                 help='The number of series forecasted at once. Default is 1000')
+    argument_parser.add_argument('--intra_op_parallelism_threads', required=False,
+                                 help='The number of threads used within an individual tensorflow op. Default is 0(tensorflow decides)')
+    argument_parser.add_argument('--inter_op_parallelism_threads', required=False,
+                                 help='The number of threads used to run independent tensorflow ops in parallel. Default is 0(tensorflow decides)')
+
+    # parse the user arguments
+    args = argument_parser.parse_args()
+
+    if not args.binary_test_file and not args.txt_test_file:
+        argument_parser.error("Either the binary_test_file or the txt_test_file is required")
+
+    if args.engine:
+        engine = args.engine
+    else:
+        engine = "tensorflow"
+
+    if args.forecasts_directory:
+        forecasts_directory = args.forecasts_directory
+    else:
+        forecasts_directory = model_testing_configs.RNN_FORECASTS_DIRECTORY
+
+    if args.minibatch_size:
+        minibatch_size = int(args.minibatch_size)
+    else:
+        minibatch_size = 1000
+
+    start_time = time.time()
+
+    if engine == "tensorflow":
+        from utility_scripts.session_configs import configure_cpu_resources
+
+        configure_cpu_resources(args)
+
+    model = load_model(args.exported_model_directory, engine)
+    model_spec = model.model_spec
+    load_time = time.time() - start_time
+
+    # read the test data. Reading the tfrecords file requires tensorflow, even for the numpy engine
+    if args.binary_test_file:
+        list_of_test_inputs, _ = read_tfrecord_test_data(args.binary_test_file)
+    else:
+        list_of_test_inputs, _ = read_txt_test_data(args.txt_test_file, model_spec['input_format'],
+                                                    int(model_spec['input_size']))
+
+    list_of_test_inputs = truncate_to_encoder_lookback(model_spec, list_of_test_inputs)
+    forecasts = forecast_in_minibatches(model, list_of_test_inputs, minibatch_size)
+    model.close()
+
+    # write the forecasts of every seed to a separate file, named the same way as the forecasts of the model tester
+    if not os.path.exists(forecasts_directory):
+        os.makedirs(forecasts_directory)
+
+    for seed, list_of_forecasts in zip(model_spec['seeds'], forecasts):
+        rnn_forecasts_file_path = os.path.join(forecasts_directory,
+                                               model_spec['model_identifier_prefix'] + "_" + str(seed) + '.txt')
+        with open(rnn_forecasts_file_path, "w") as output:
+            writer = csv.writer(output, lineterminator='\n')
+            writer.writerows(list_of_forecasts)
+
+    print("Forecasted {} series with {} seeds using the {} engine in {:.2f}s (loading the model took {:.2f}s)".format(
+        len(list_of_test_inputs), len(model_spec['seeds']), engine, time.time() - start_time, load_time))
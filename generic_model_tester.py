@@ -1,28 +1,22 @@
 import csv
-import tensorflow as tf
-
-# import the different model types
-
-# stacking model
-from rnn_architectures.stacking_model.stacking_model_tester import \
-    StackingModelTester as StackingModelTester
-
-# seq2seq model with decoder
-from rnn_architectures.seq2seq_model.with_decoder.non_moving_window.unaccumulated_error.seq2seq_model_tester import \
-    Seq2SeqModelTester as Seq2SeqModelTesterWithNonMovingWindowUnaccumulatedError
-
-# seq2seq model with dense layer
-from rnn_architectures.seq2seq_model.with_dense_layer.non_moving_window.unaccumulated_error.seq2seq_model_tester import \
-    Seq2SeqModelTesterWithDenseLayer as Seq2SeqModelTesterWithDenseLayerNonMovingWindowUnaccumulatedError
-from rnn_architectures.seq2seq_model.with_dense_layer.moving_window.unaccumulated_error.seq2seq_model_tester import \
-    Seq2SeqModelTesterWithDenseLayer as Seq2SeqModelTesterWithDenseLayerMovingWindow
-
-
-# import the cocob optimizer
-from external_packages import cocob_optimizer
-from utility_scripts.invoke_r_final_evaluation import invoke_r_script
+import glob
+import os
+import copy
+import multiprocessing
+import time
+
+# tensorflow, the cocob optimizer and the model architectures are imported only when a model is built, so that the
+# selected tester is the only architecture imported
+from utility_scripts.model_type_registry import get_model_tester_class, get_model_tester_module
+from utility_scripts.final_evaluation import evaluate_forecasts
+from utility_scripts.session_configs import print_cpu_configs, configure_cpu_resources, get_available_cores
+from utility_scripts.training_checkpoints import get_checkpoint_directory, remove_checkpoint_directory, \
+    write_file_atomically
 
 from configs.global_configs import model_testing_configs
+from configs.global_configs import training_data_configs
+from configs.global_configs import tcn_configs
+from configs.global_configs import cpu_configs
 
 LSTM_USE_PEEPHOLES = True
 BIAS = False
@@ -31,19 +25,74 @@ learning_rate = 0.0
 
 
 # function to create the optimizer
-def adagrad_optimizer_fn(total_loss):
-    return tf.train.AdagradOptimizer(learning_rate=learning_rate).minimize(total_loss)
+# the learning rate scale is used by the cyclic learning rate schedule of the snapshot ensembles
+def adagrad_optimizer_fn(total_loss, learning_rate_scale=1.0):
+    import tensorflow as tf
+    return tf.train.AdagradOptimizer(learning_rate=learning_rate * learning_rate_scale).minimize(total_loss)
 
 
-def adam_optimizer_fn(total_loss):
-    return tf.train.AdamOptimizer(learning_rate=learning_rate).minimize(total_loss)
+def adam_optimizer_fn(total_loss, learning_rate_scale=1.0):
+    import tensorflow as tf
+    return tf.train.AdamOptimizer(learning_rate=learning_rate * learning_rate_scale).minimize(total_loss)
 
 
-def cocob_optimizer_fn(total_loss):
+# cocob does not have a learning rate, the snapshot ensembles only restart its state at the start of every cycle
+def cocob_optimizer_fn(total_loss, learning_rate_scale=1.0):
+    from external_packages import cocob_optimizer
     return cocob_optimizer.COCOB().minimize(loss=total_loss)
 
 
-def testing(args, config_dictionary):
+# the ensemble members of the seeds with the index of their forecasts among the forecasts of the seeds
+# the snapshots of the seed s are numbered from (s - 1) * snapshot_ensemble_size + 1 to avoid clashes across seeds. The
+# ensembling script takes the median over the ensemble members of the seeds in SEEDS, therefore the snapshots numbered
+# beyond them are dropped, so that the size of the ensemble does not depend on the snapshot ensemble size
+def get_ensemble_members(seeds, snapshot_ensemble_size):
+    if snapshot_ensemble_size == 1:
+        return [(seed, forecasts_index) for forecasts_index, seed in enumerate(seeds)]
+
+    ensemble_members = []
+    for seed_index, seed in enumerate(seeds):
+        for snapshot_index in range(snapshot_ensemble_size):
+            ensemble_member = (seed - 1) * snapshot_ensemble_size + snapshot_index + 1
+            if ensemble_member <= len(model_testing_configs.SEEDS):
+                ensemble_members.append((ensemble_member, seed_index * snapshot_ensemble_size + snapshot_index))
+    return ensemble_members
+
+
+# hidden file next to a forecasts file with the snapshot ensemble size of the run which wrote it
+# the file is hidden, so that the ensembling script does not read it as the forecasts of a seed
+def snapshot_marker_file_path(rnn_forecasts_file_path):
+    directory, file_name = os.path.split(rnn_forecasts_file_path)
+    return os.path.join(directory, "." + file_name + ".snapshots")
+
+
+# the forecasts written before the snapshot ensembles have no marker and were written without snapshots
+def read_snapshot_ensemble_size(rnn_forecasts_file_path):
+    marker_file_path = snapshot_marker_file_path(rnn_forecasts_file_path)
+    if not os.path.exists(marker_file_path):
+        return 1
+    with open(marker_file_path) as marker_file:
+        return int(marker_file.read())
+
+
+# remove the forecasts files of the model which are not members of the current run, e.g. the snapshots of a run with a
+# larger snapshot ensemble size, together with their markers
+def remove_stale_forecasts(model_identifier_prefix, run_ensemble_members):
+    file_path_prefix = model_testing_configs.RNN_FORECASTS_DIRECTORY + model_identifier_prefix + "_"
+    for rnn_forecasts_file_path in glob.glob(glob.escape(file_path_prefix) + "*.txt"):
+        ensemble_member = rnn_forecasts_file_path[len(file_path_prefix):-len(".txt")]
+        if ensemble_member.isdigit() and int(ensemble_member) not in run_ensemble_members:
+            print("Removing the forecasts {} of another run of the model".format(rnn_forecasts_file_path))
+            os.remove(rnn_forecasts_file_path)
+            marker_file_path = snapshot_marker_file_path(rnn_forecasts_file_path)
+            if os.path.exists(marker_file_path):
+                os.remove(marker_file_path)
+
+
+# train the model with the given seed, write the forecasts to a file and return the arguments for the final evaluation
+# if args.ensemble_seeds is set, the models of all these seeds are trained together inside a single graph and the
+# forecasts of every seed are written to a separate file
+def generate_forecasts(args, config_dictionary):
     # to make the random number choices reproducible
 
     global learning_rate
@@ -66,7 +115,13 @@ def testing(args, config_dictionary):
     hyperparameter_tuning = args.hyperparameter_tuning
     model_type = args.model_type
     input_format = args.input_format
-    seed = int(args.seed)
+    ensemble_seeds = getattr(args, "ensemble_seeds", None)
+    if ensemble_seeds:
+        seeds = [int(seed) for seed in ensemble_seeds]
+    else:
+        seeds = [int(args.seed)]
+    # the graph level seed of the shared ops of the ensemble is the first seed, the replicas are seeded from their own seeds
+    seed = seeds[0]
 
     if args.without_stl_decomposition:
         without_stl_decomposition = bool(int(args.without_stl_decomposition))
@@ -83,6 +138,21 @@ def testing(args, config_dictionary):
     else:
         cell_type = "LSTM"
 
+    if args.resume:
+        resume = bool(int(args.resume))
+    else:
+        resume = False
+
+    if args.export_model:
+        export_model = bool(int(args.export_model))
+    else:
+        export_model = False
+
+    if args.snapshot_ensemble_size:
+        snapshot_ensemble_size = int(args.snapshot_ensemble_size)
+    else:
+        snapshot_ensemble_size = model_testing_configs.SNAPSHOT_ENSEMBLE_SIZE
+
     if args.with_accumulated_error:
         with_accumulated_error = bool(int(args.with_accumulated_error))
     else:
@@ -98,6 +168,29 @@ def testing(args, config_dictionary):
     else:
         integer_conversion = False
 
+    if args.encoder_lookback:
+        encoder_lookback = int(args.encoder_lookback)
+    else:
+        encoder_lookback = training_data_configs.ENCODER_LOOKBACK
+
+    # truncated backpropagation is only implemented for the stacking model
+    if with_truncated_backpropagation and model_type != "stacking":
+        print("Truncated backpropagation is not supported for the model type {}. Ignoring it".format(model_type))
+        with_truncated_backpropagation = False
+
+    if args.window_sampling_length:
+        window_sampling_length = int(args.window_sampling_length)
+    else:
+        window_sampling_length = training_data_configs.WINDOW_SAMPLING_LENGTH
+
+    # the window sampling is only implemented for the moving window format
+    if input_format != "moving_window":
+        window_sampling_length = 0
+
+    # the encoder lookback is only implemented for the seq2seq models
+    if not model_type.startswith("seq2seq"):
+        encoder_lookback = 0
+
     if not with_truncated_backpropagation:
         tbptt_identifier = "without_truncated_backpropagation"
     else:
@@ -113,10 +206,16 @@ def testing(args, config_dictionary):
     else:
         accumulated_error_identifier = "without_accumulated_error"
 
-    model_identifier = dataset_name + "_" + model_type + "_" + cell_type + "cell" + "_" + input_format + "_" + stl_decomposition_identifier + "_" + hyperparameter_tuning + "_" + optimizer + "_" + tbptt_identifier + "_" + accumulated_error_identifier + "_" + str(
-        seed)
+    if encoder_lookback > 0:
+        accumulated_error_identifier += "_" + str(encoder_lookback) + "lookback"
+    if window_sampling_length > 0:
+        accumulated_error_identifier += "_" + str(window_sampling_length) + "windowsampling"
+
+    model_identifier_prefix = dataset_name + "_" + model_type + "_" + cell_type + "cell" + "_" + input_format + "_" + stl_decomposition_identifier + "_" + hyperparameter_tuning + "_" + optimizer + "_" + tbptt_identifier + "_" + accumulated_error_identifier
+    model_identifier = model_identifier_prefix + "_" + "_".join(str(seed) for seed in seeds)
     print("Model Testing Started for {}".format(model_identifier))
     print(config_dictionary)
+    print_cpu_configs(model_identifier)
 
     # select the optimizer
     if optimizer == "cocob":
@@ -136,19 +235,21 @@ def testing(args, config_dictionary):
         'binary_test_file_path': binary_test_file_path_test_mode,
         'seed': seed,
         'cell_type': cell_type,
-        'without_stl_decomposition': without_stl_decomposition
+        'input_format': input_format,
+        'without_stl_decomposition': without_stl_decomposition,
+        'with_truncated_backpropagation': with_truncated_backpropagation,
+        'encoder_lookback': encoder_lookback,
+        'window_sampling_length': window_sampling_length,
+        'ensemble_size': len(seeds),
+        'ensemble_seeds': seeds,
+        'snapshot_ensemble_size': snapshot_ensemble_size
     }
 
-    # select the model type
-    if model_type == "stacking":
-        model_tester = StackingModelTester(**model_kwargs)
-    elif model_type == "seq2seq":
-        model_tester = Seq2SeqModelTesterWithNonMovingWindowUnaccumulatedError(**model_kwargs)
-    elif model_type == "seq2seqwithdenselayer":
-        if input_format == "non_moving_window":
-            model_tester = Seq2SeqModelTesterWithDenseLayerNonMovingWindowUnaccumulatedError(**model_kwargs)
-        elif input_format == "moving_window":
-            model_tester = Seq2SeqModelTesterWithDenseLayerMovingWindow(**model_kwargs)
+    # select the model type. The import is almost free in the workers forked from the preloaded fork server
+    import_start_time = time.time()
+    model_tester_class = get_model_tester_class(model_type, input_format)
+    print("Importing the {} tester took {:.3f}s".format(model_type, time.time() - import_start_time))
+    model_tester = model_tester_class(**model_kwargs)
 
     if 'rate_of_learning' in config_dictionary:
         learning_rate = config_dictionary['rate_of_learning']
@@ -160,34 +261,221 @@ def testing(args, config_dictionary):
     minibatch_size = config_dictionary['minibatch_size']
     gaussian_noise_stdev = config_dictionary['gaussian_noise_stdev']
     random_normal_initializer_stdev = config_dictionary['random_normal_initializer_stdev']
+    if 'tbptt_chunk_length' in config_dictionary:
+        tbptt_chunk_length = config_dictionary['tbptt_chunk_length']
+    else:
+        tbptt_chunk_length = 0
+    if 'tcn_kernel_size' in config_dictionary:
+        tcn_kernel_size = config_dictionary['tcn_kernel_size']
+    else:
+        tcn_kernel_size = tcn_configs.KERNEL_SIZE
+
+    # every snapshot is written as a separate seed, so that the ensembling script takes the median over the snapshots
+    ensemble_members = get_ensemble_members(seeds, snapshot_ensemble_size)
+    # the members of all the seeds of the run, of which the seeds of this process are a part
+    run_ensemble_members = get_ensemble_members(getattr(args, "run_seeds", None) or seeds, snapshot_ensemble_size)
+
+    if not ensemble_members:
+        print("Skipping the training of {} since all its snapshots are beyond the {} ensemble members".format(
+            model_identifier, len(model_testing_configs.SEEDS)))
+        return []
+
+    # the forecasts files are written atomically, therefore an existing forecasts file is always complete
+    rnn_forecasts_file_paths = [model_testing_configs.RNN_FORECASTS_DIRECTORY + model_identifier_prefix + "_" + str(
+        ensemble_member) + '.txt' for ensemble_member, _ in ensemble_members]
+
+    # the forecasts files of the other snapshot ensemble sizes share the names of the files of this run, so they are
+    # reused only if they were written with the same snapshot ensemble size
+    if resume and all(os.path.exists(file_path) and read_snapshot_ensemble_size(file_path) == snapshot_ensemble_size
+                      for file_path in rnn_forecasts_file_paths):
+        print("Skipping the training of {} since its forecasts are already complete".format(model_identifier))
+    else:
+        # the checkpoints of an interrupted run of the same seeds and configuration are reused only when resuming
+        checkpoint_directory = get_checkpoint_directory(
+            model_identifier + "_" + str(snapshot_ensemble_size) + "snapshots", config_dictionary)
+        if not resume:
+            remove_checkpoint_directory(checkpoint_directory)
+
+        # the trained models of all the seeds are exported together as a single model
+        if export_model:
+            export_directory = model_testing_configs.EXPORTED_MODELS_DIRECTORY + model_identifier
+        else:
+            export_directory = None
+
+        forecasts = model_tester.test_model(num_hidden_layers=int(round(num_hidden_layers)),
+                                            cell_dimension=int(round(cell_dimension)),
+                                            minibatch_size=int(round(minibatch_size)),
+                                            max_epoch_size=int(round(max_epoch_size)),
+                                            max_num_epochs=int(round(max_num_epochs)),
+                                            l2_regularization=l2_regularization,
+                                            gaussian_noise_stdev=gaussian_noise_stdev,
+                                            random_normal_initializer_stdev=random_normal_initializer_stdev,
+                                            tbptt_chunk_length=int(round(tbptt_chunk_length)),
+                                            tcn_kernel_size=int(round(tcn_kernel_size)),
+                                            optimizer_fn=optimizer_fn,
+                                            checkpoint_directory=checkpoint_directory,
+                                            export_directory=export_directory)
+
+        if export_directory:
+            from utility_scripts.model_export import write_model_spec
+            from utility_scripts.numpy_model_exporter import export_numpy_model, ENCODER_SCOPES
+
+            write_model_spec(export_directory, {
+                'model_identifier_prefix': model_identifier_prefix,
+                'seeds': seeds,
+                'model_type': model_type,
+                'cell_type': cell_type,
+                'input_format': input_format,
+                'input_size': input_size,
+                'output_size': output_size,
+                'without_stl_decomposition': without_stl_decomposition,
+                'contain_zero_values': contain_zero_values,
+                'address_near_zero_instability': address_near_zero_instability,
+                'integer_conversion': integer_conversion,
+                'seasonality_period': seasonality_period,
+                'encoder_lookback': encoder_lookback,
+                # the first input of the decoder of the seq2seq model, which was zero in the models exported before
+                'decoder_start': "last_input"
+            })
+
+            # extract the weights for the numpy inference engine, which only implements the RNN models
+            if model_type in ENCODER_SCOPES:
+                export_numpy_model(export_directory)
+
+        # the tester returns the forecasts of a single model or a list of forecasts per snapshot of every seed
+        if len(seeds) * snapshot_ensemble_size == 1:
+            forecasts = [forecasts]
+
+        # the forecasts of the other runs of the model which are not members of this run are not ensembled with it
+        remove_stale_forecasts(model_identifier_prefix, [ensemble_member for ensemble_member, _ in run_ensemble_members])
+
+        # write the forecasting results to the files, followed by the snapshot ensemble size they were written with
+        for rnn_forecasts_file_path, (_, forecasts_index) in zip(rnn_forecasts_file_paths, ensemble_members):
+            list_of_forecasts = forecasts[forecasts_index]
+            write_file_atomically(rnn_forecasts_file_path,
+                                  lambda output: csv.writer(output, lineterminator='\n').writerows(list_of_forecasts))
+            write_file_atomically(snapshot_marker_file_path(rnn_forecasts_file_path),
+                                  lambda output: output.write(str(snapshot_ensemble_size)))
+
+        remove_checkpoint_directory(checkpoint_directory)
+
+    evaluation_jobs = []
+    for (ensemble_member, _), rnn_forecasts_file_path in zip(ensemble_members, rnn_forecasts_file_paths):
+        # arguments for the final evaluation
+        error_file_name = model_identifier_prefix + "_" + str(ensemble_member) + '.txt'
+
+        evaluation_jobs.append({
+            'rnn_forecasts_file_path': rnn_forecasts_file_path,
+            'errors_file_name': error_file_name,
+            'txt_test_file_path': txt_test_file_path,
+            'actual_results_file_path': actual_results_file_path,
+            'original_data_file_path': original_data_file_path,
+            'input_format': input_format,
+            'input_size': input_size,
+            'output_size': output_size,
+            'contain_zero_values': contain_zero_values,
+            'address_near_zero_instability': address_near_zero_instability,
+            'integer_conversion': integer_conversion,
+            'seasonality_period': seasonality_period,
+            'without_stl_decomposition': without_stl_decomposition
+        })
+
+    return evaluation_jobs
+
+
+def testing(args, config_dictionary):
+    # evaluate the forecasts of every seed
+    for evaluation_kwargs in generate_forecasts(args, config_dictionary):
+        evaluate_forecasts(**evaluation_kwargs)
 
-    list_of_forecasts = model_tester.test_model(num_hidden_layers=int(round(num_hidden_layers)),
-                                                cell_dimension=int(round(cell_dimension)),
-                                                minibatch_size=int(round(minibatch_size)),
-                                                max_epoch_size=int(round(max_epoch_size)),
-                                                max_num_epochs=int(round(max_num_epochs)),
-                                                l2_regularization=l2_regularization,
-                                                gaussian_noise_stdev=gaussian_noise_stdev,
-                                                random_normal_initializer_stdev=random_normal_initializer_stdev,
-                                                optimizer_fn=optimizer_fn)
 
-    # write the forecasting results to a file
-    rnn_forecasts_file_path = model_testing_configs.RNN_FORECASTS_DIRECTORY + model_identifier + '.txt'
+# free core slots of the seed pool, used to pin the concurrent seeds to different cores
+seed_slots = None
 
-    with open(rnn_forecasts_file_path, "w") as output:
-        writer = csv.writer(output, lineterminator='\n')
-        writer.writerows(list_of_forecasts)
 
-    # invoke the final evaluation R script
-    error_file_name = model_identifier + '.txt'
+def initialize_seed_worker(slots):
+    global seed_slots
+    seed_slots = slots
 
-    if input_format == "moving_window":
-            invoke_r_script((rnn_forecasts_file_path, error_file_name, txt_test_file_path,
-                             actual_results_file_path, original_data_file_path, str(input_size), str(output_size),
-                             str(contain_zero_values), str(int(address_near_zero_instability)),
-                             str(int(integer_conversion)), str(int(seasonality_period)), str(int(without_stl_decomposition))), True)
 
+# train and forecast one seed or one ensemble of seeds inside a worker process of the seed pool
+def forecast_seed(seed_job):
+    args, config_dictionary, thread_budget, inter_op_thread_budget = seed_job
+
+    # restrict the seed to its thread budget so that the concurrent seeds do not oversubscribe the node
+    args.intra_op_parallelism_threads = thread_budget
+    if inter_op_thread_budget > 0:
+        args.inter_op_parallelism_threads = inter_op_thread_budget
+
+    slot = None
+    if args.core_pinning_policy == "slot":
+        slot = seed_slots.get()
+        args.core_pinning_slot = slot
+
+    try:
+        configure_cpu_resources(args)
+        return generate_forecasts(args, config_dictionary)
+    finally:
+        if slot is not None:
+            seed_slots.put(slot)
+
+
+# test the model on multiple seeds concurrently
+# the seeds are grouped into ensembles of ensemble_size seeds which are trained together inside a single graph
+# the final evaluation of every seed runs in this process while the remaining seeds are still training
+def testing_multiple_seeds(args, config_dictionary, seeds, number_of_workers, ensemble_size=1):
+    ensemble_size = max(1, int(ensemble_size))
+    seed_groups = [seeds[index:index + ensemble_size] for index in range(0, len(seeds), ensemble_size)]
+    number_of_workers = max(1, min(number_of_workers, len(seed_groups)))
+
+    # divide the threads of the job, or its cores if the threads are not set explicitly, among the concurrent seeds
+    if cpu_configs.intra_op_parallelism_threads > 0:
+        thread_budget = max(1, cpu_configs.intra_op_parallelism_threads // number_of_workers)
+    else:
+        thread_budget = max(1, len(get_available_cores()) // number_of_workers)
+    # the inter op threads are divided only if they are set explicitly, otherwise tensorflow decides
+    if cpu_configs.inter_op_parallelism_threads > 0:
+        inter_op_thread_budget = max(1, cpu_configs.inter_op_parallelism_threads // number_of_workers)
+    else:
+        inter_op_thread_budget = 0
+
+    # the seeds are pinned to disjoint slots of the cores of the job if core pinning is enabled
+    seed_args = copy.copy(args)
+    if cpu_configs.core_pinning_policy != "none":
+        seed_args.core_pinning_policy = "slot"
     else:
-            invoke_r_script((rnn_forecasts_file_path, error_file_name, txt_test_file_path,
-                             actual_results_file_path, original_data_file_path, str(output_size), str(contain_zero_values), str(int(address_near_zero_instability)), str(int(integer_conversion)), str(int(seasonality_period)), str(int(without_stl_decomposition))), False)
+        seed_args.core_pinning_policy = "none"
+
+    seed_jobs = []
+    for seed_group in seed_groups:
+        seed_job_args = copy.copy(seed_args)
+        seed_job_args.seed = seed_group[0]
+        seed_job_args.ensemble_seeds = seed_group
+        seed_job_args.run_seeds = seeds
+        seed_jobs.append((seed_job_args, config_dictionary, thread_budget, inter_op_thread_budget))
+
+    # tensorflow is not fork safe once it has created a session, therefore every seed gets a fresh process
+    # with the fork server, the workers are forked from a server process which has only imported tensorflow and the
+    # tester, so a worker starts in milliseconds instead of importing them again. Every worker builds its own graph
+    start_method = model_testing_configs.WORKER_START_METHOD
+    if start_method not in multiprocessing.get_all_start_methods():
+        start_method = "spawn"
+    context = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+        context.set_forkserver_preload(["tensorflow", "generic_model_tester",
+                                        get_model_tester_module(args.model_type, args.input_format)])
+
+    slots = context.Queue()
+    for slot in range(number_of_workers):
+        slots.put(slot)
+
+    pool = context.Pool(processes=number_of_workers, initializer=initialize_seed_worker, initargs=(slots,),
+                        maxtasksperchild=1)
+    try:
+        for evaluation_jobs in pool.imap_unordered(forecast_seed, seed_jobs):
+            for evaluation_kwargs in evaluation_jobs:
+                evaluate_forecasts(**evaluation_kwargs)
+    finally:
+        pool.close()
+        pool.join()
 
@@ -1,39 +1,29 @@
+import time
+
+# the start of the process, to measure the cold start
+process_start_time = time.time()
+
+import math
 import numpy as np
-import tensorflow as tf
 import argparse
 from utility_scripts.persist_optimized_config_results import persist_results
-from generic_model_tester import testing
+from utility_scripts.persist_trial_results import configuration_key, persist_trial_result, read_trial_results, \
+    clear_trial_results
+from generic_model_tester import testing_multiple_seeds
 from utility_scripts.hyperparameter_scripts.hyperparameter_config_reader import read_initial_hyperparameter_values
+from utility_scripts.session_configs import configure_cpu_resources, print_cpu_configs
+from utility_scripts.training_checkpoints import get_checkpoint_directory, remove_checkpoint_directory
 
-# import the config space and the different types of parameters
-from smac.configspace import ConfigurationSpace
-from ConfigSpace.hyperparameters import UniformFloatHyperparameter, UniformIntegerHyperparameter
-
-# import SMAC utilities
-from smac.scenario.scenario import Scenario
-from smac.facade.smac_facade import SMAC
-
-## import the different model architectures
-
-# stacking model
-from rnn_architectures.stacking_model.stacking_model_trainer import \
-    StackingModelTrainer as StackingModelTrainer
-
-# seq2seq model with decoder
-from rnn_architectures.seq2seq_model.with_decoder.non_moving_window.unaccumulated_error.seq2seq_model_trainer import \
-    Seq2SeqModelTrainer as Seq2SeqModelTrainerWithNonMovingWindowUnaccumulatedError
-
-# seq2seq model with dense layer
-from rnn_architectures.seq2seq_model.with_dense_layer.non_moving_window.unaccumulated_error.seq2seq_model_trainer import \
-    Seq2SeqModelTrainerWithDenseLayer as Seq2SeqModelTrainerWithDenseLayerNonMovingWindowUnaccumulatedError
-from rnn_architectures.seq2seq_model.with_dense_layer.moving_window.unaccumulated_error.seq2seq_model_trainer import \
-    Seq2SeqModelTrainerWithDenseLayer as Seq2SeqModelTrainerWithDenseLayerMovingWindow
-
-# import the cocob optimizer
-from external_packages import cocob_optimizer
+# tensorflow, SMAC and the model architectures are imported only when they are used, so that the argument parsing
+# does not wait for them and a run imports only the selected trainer
+from utility_scripts.model_type_registry import get_model_trainer_class, is_supported_model
+from utility_scripts.mase_scales import calculate_validation_mase_scales
 
 from configs.global_configs import hyperparameter_tuning_configs
 from configs.global_configs import model_training_configs
+from configs.global_configs import model_testing_configs
+from configs.global_configs import training_data_configs
+from configs.global_configs import tcn_configs
 
 import csv
 
@@ -45,20 +35,32 @@ learning_rate = 0.0
 
 # function to create the optimizer
 def adagrad_optimizer_fn(total_loss):
+    import tensorflow as tf
     return tf.train.AdagradOptimizer(learning_rate=learning_rate).minimize(total_loss)
 
 
 def adam_optimizer_fn(total_loss):
+    import tensorflow as tf
     return tf.train.AdamOptimizer(learning_rate=learning_rate).minimize(total_loss)
 
 
 def cocob_optimizer_fn(total_loss):
+    from external_packages import cocob_optimizer
     return cocob_optimizer.COCOB().minimize(loss=total_loss)
 
 
 # Training the time series
 def train_model_smac(configs):
-    error, _ = train_model(configs)
+    # the trials completed before an interruption are not trained again when resuming
+    configuration = configuration_key(configs)
+    if configuration in completed_trial_results:
+        print("Reusing the stored validation errors of the configuration {}".format(configuration))
+        return completed_trial_results[configuration][0]
+
+    error, error_list = train_model(configs)
+
+    # persist the validation errors so that the incumbent does not need to be trained again after tuning
+    persist_trial_result(trial_results_file, configs, error, error_list)
     return error
 
 # final execution with the optimized config
@@ -75,9 +77,22 @@ def train_model(configs):
     l2_regularization = configs["l2_regularization"]
     gaussian_noise_stdev = configs["gaussian_noise_stdev"]
     random_normal_initializer_stdev = configs["random_normal_initializer_stdev"]
+    if "tbptt_chunk_length" in configs.keys():
+        tbptt_chunk_length = configs["tbptt_chunk_length"]
+    else:
+        tbptt_chunk_length = 0
+    if "tcn_kernel_size" in configs.keys():
+        tcn_kernel_size = configs["tcn_kernel_size"]
+    else:
+        tcn_kernel_size = tcn_configs.KERNEL_SIZE
 
     print(configs)
 
+    # the checkpoints of an interrupted training of the same configuration are reused only when resuming
+    checkpoint_directory = get_checkpoint_directory(model_identifier, configs)
+    if not resume:
+        remove_checkpoint_directory(checkpoint_directory)
+
     # select the appropriate type of optimizer
     error, error_list = model_trainer.train_model(num_hidden_layers=num_hidden_layers,
                                       cell_dimension=cell_dimension,
@@ -87,12 +102,28 @@ def train_model(configs):
                                       l2_regularization=l2_regularization,
                                       gaussian_noise_stdev=gaussian_noise_stdev,
                                       random_normal_initializer_stdev=random_normal_initializer_stdev,
-                                      optimizer_fn=optimizer_fn)
+                                      tbptt_chunk_length=tbptt_chunk_length,
+                                      tcn_kernel_size=tcn_kernel_size,
+                                      optimizer_fn=optimizer_fn,
+                                      checkpoint_directory=checkpoint_directory)
+
+    remove_checkpoint_directory(checkpoint_directory)
 
     print(model_identifier)
     return error, error_list
 
 def smac():
+    # import the config space and the different types of parameters
+    from smac.configspace import ConfigurationSpace
+    from ConfigSpace.hyperparameters import UniformFloatHyperparameter, UniformIntegerHyperparameter
+
+    # import SMAC utilities
+    from smac.scenario.scenario import Scenario
+    from smac.facade.smac_facade import SMAC
+
+    smac_import_time = time.time()
+    print("Importing SMAC took {:.2f}s".format(smac_import_time - tuning_start_time))
+
     # Build Configuration Space which defines all parameters and their ranges
     configuration_space = ConfigurationSpace()
 
@@ -147,6 +178,22 @@ def smac():
              max_num_of_epochs, no_hidden_layers,
              l2_regularization, gaussian_noise_stdev, random_normal_initializer_stdev])
 
+    # add the hyperparameter for the chunk length only if using truncated backpropagation
+    if with_truncated_backpropagation:
+        tbptt_chunk_length = UniformIntegerHyperparameter("tbptt_chunk_length",
+                                                          hyperparameter_values_dic['tbptt_chunk_length'][0],
+                                                          hyperparameter_values_dic['tbptt_chunk_length'][1],
+                                                          default_value=hyperparameter_values_dic['tbptt_chunk_length'][0])
+        configuration_space.add_hyperparameter(tbptt_chunk_length)
+
+    # add the hyperparameter for the kernel size only if tuning the temporal convolutional network with a range for it
+    if model_type == "tcn" and 'tcn_kernel_size' in hyperparameter_values_dic:
+        tcn_kernel_size = UniformIntegerHyperparameter("tcn_kernel_size",
+                                                       hyperparameter_values_dic['tcn_kernel_size'][0],
+                                                       hyperparameter_values_dic['tcn_kernel_size'][1],
+                                                       default_value=hyperparameter_values_dic['tcn_kernel_size'][0])
+        configuration_space.add_hyperparameter(tcn_kernel_size)
+
     # creating the scenario object
     scenario = Scenario({
         "run_obj": "quality",
@@ -196,7 +243,7 @@ if __name__ == '__main__':
     argument_parser.add_argument('--hyperparameter_tuning', required=True,
                                  help='The method for hyperparameter tuning(bayesian/smac)')
     argument_parser.add_argument('--model_type', required=True,
-                                 help='The type of the model(stacking/seq2seq/seq2seqwithdenselayer)')
+                                 help='The type of the model(stacking/seq2seq/seq2seqwithdenselayer/tcn)')
     argument_parser.add_argument('--input_format', required=True, help='Input format(moving_window/non_moving_window)')
     argument_parser.add_argument('--without_stl_decomposition', required=False,
                                  help='Whether not to use stl decomposition(0/1). Default is 0')
@@ -205,6 +252,36 @@ if __name__ == '__main__':
     argument_parser.add_argument('--with_accumulated_error', required=False,
                                  help='Whether to accumulate errors over the moving windows. Default is 0')
     argument_parser.add_argument('--seed', required=True, help='Integer seed to use as the random seed')
+    argument_parser.add_argument('--intra_op_parallelism_threads', required=False,
+                                 help='The number of threads used within an individual tensorflow op. Default is 0(tensorflow decides)')
+    argument_parser.add_argument('--inter_op_parallelism_threads', required=False,
+                                 help='The number of threads used to run independent tensorflow ops in parallel. Default is 0(tensorflow decides)')
+    argument_parser.add_argument('--core_pinning_policy', required=False,
+                                 help='The policy for pinning the job to cpu cores(none/slot/explicit). Default is none')
+    argument_parser.add_argument('--core_pinning_slot', required=False,
+                                 help='The index of the block of intra_op_parallelism_threads cores to pin the job to under the slot policy. Default is 0')
+    argument_parser.add_argument('--pinned_cores', required=False,
+                                 help='The cores to pin the job to under the explicit policy(e.g. 0-3,8)')
+    argument_parser.add_argument('--xla_jit', required=False,
+                                 help='Whether to jit compile the training graphs with XLA(0/1). Default is 0')
+    argument_parser.add_argument('--number_of_test_workers', required=False,
+                                 help='The number of seeds of the final model trained concurrently. Default is 1')
+    argument_parser.add_argument('--ensemble_size', required=False,
+                                 help='The number of seeds of the final model trained together inside a single graph. Default is 1')
+    argument_parser.add_argument('--snapshot_ensemble_size', required=False,
+                                 help='The number of snapshots taken from every training run of the final model using a cyclic learning rate. Default is 1')
+    argument_parser.add_argument('--test_seeds', required=False,
+                                 help='The comma separated seeds of the final model(e.g. 1,2,3). Default is the seeds 1 to 10, of which only the first ceil(10 / snapshot_ensemble_size) are trained with snapshot ensembles')
+    argument_parser.add_argument('--export_model', required=False,
+                                 help='Whether to export the trained final models for forecasting without retraining(0/1). Default is 0')
+    argument_parser.add_argument('--encoder_lookback', required=False,
+                                 help='The number of the last input windows(moving_window) or points(non_moving_window) seen by the encoder of the seq2seq models. Default is 0 (the whole series)')
+    argument_parser.add_argument('--window_sampling_length', required=False,
+                                 help='The number of windows of the subsequences sampled across the series for the training of the moving_window models. Default is 0 (the whole series)')
+    argument_parser.add_argument('--in_graph_validation_metrics', required=False,
+                                 help='Whether to calculate the validation errors inside the Tensorflow graph(0/1). Default is 0')
+    argument_parser.add_argument('--resume', required=False,
+                                 help='Whether to resume an interrupted run from its stored trial results, checkpoints and forecasts(0/1). Default is 0')
 
     # parse the user arguments
     args = argument_parser.parse_args()
@@ -225,6 +302,10 @@ if __name__ == '__main__':
     hyperparameter_tuning = args.hyperparameter_tuning
     model_type = args.model_type
     input_format = args.input_format
+
+    # validate the model before anything heavy is imported
+    if not is_supported_model(model_type, input_format):
+        argument_parser.error("The model type {} does not support the input format {}".format(model_type, input_format))
     seed = int(args.seed)
 
     if args.without_stl_decomposition:
@@ -242,6 +323,11 @@ if __name__ == '__main__':
     else:
         cell_type = "LSTM"
 
+    if args.resume:
+        resume = bool(int(args.resume))
+    else:
+        resume = False
+
     if args.with_accumulated_error:
         with_accumulated_error = bool(int(args.with_accumulated_error))
     else:
@@ -257,6 +343,55 @@ if __name__ == '__main__':
     else:
         integer_conversion = False
 
+    if args.encoder_lookback:
+        encoder_lookback = int(args.encoder_lookback)
+    else:
+        encoder_lookback = training_data_configs.ENCODER_LOOKBACK
+
+    # truncated backpropagation is only implemented for the stacking model
+    if with_truncated_backpropagation and model_type != "stacking":
+        print("Truncated backpropagation is not supported for the model type {}. Ignoring it".format(model_type))
+        with_truncated_backpropagation = False
+
+    if args.window_sampling_length:
+        window_sampling_length = int(args.window_sampling_length)
+    else:
+        window_sampling_length = training_data_configs.WINDOW_SAMPLING_LENGTH
+
+    # the series of the non moving window format are not divided into windows
+    if window_sampling_length > 0 and input_format != "moving_window":
+        print("The window sampling is not supported for the input format {}. Ignoring it".format(input_format))
+        window_sampling_length = 0
+
+    if args.snapshot_ensemble_size:
+        snapshot_ensemble_size = int(args.snapshot_ensemble_size)
+    else:
+        snapshot_ensemble_size = model_testing_configs.SNAPSHOT_ENSEMBLE_SIZE
+
+    # the seeds of the final model
+    if args.test_seeds:
+        try:
+            test_seeds = [int(seed) for seed in args.test_seeds.split(",")]
+        except ValueError:
+            argument_parser.error("Invalid test seeds {}. Give comma separated integers(e.g. 1,2,3)".format(
+                args.test_seeds))
+    else:
+        test_seeds = list(model_testing_configs.SEEDS)
+        # every training run gives snapshot_ensemble_size members, so the snapshots of the first seeds replace the
+        # training runs of the remaining seeds
+        if snapshot_ensemble_size > 1:
+            test_seeds = test_seeds[:int(math.ceil(len(test_seeds) / snapshot_ensemble_size))]
+
+    if args.in_graph_validation_metrics:
+        in_graph_validation_metrics = bool(int(args.in_graph_validation_metrics))
+    else:
+        in_graph_validation_metrics = False
+
+    # the stacking and the tcn models are trained on every window of the series, so their inputs are never truncated
+    if encoder_lookback > 0 and not model_type.startswith("seq2seq"):
+        print("The encoder lookback is not supported for the model type {}. Ignoring it".format(model_type))
+        encoder_lookback = 0
+
     if with_truncated_backpropagation:
         tbptt_identifier = "with_truncated_backpropagation"
     else:
@@ -272,10 +407,20 @@ if __name__ == '__main__':
     else:
         accumulated_error_identifier = "without_accumulated_error"
 
+    # the identifier of the models trained on the whole series is left unchanged
+    if encoder_lookback > 0:
+        accumulated_error_identifier += "_" + str(encoder_lookback) + "lookback"
+    if window_sampling_length > 0:
+        accumulated_error_identifier += "_" + str(window_sampling_length) + "windowsampling"
+
     model_identifier = dataset_name + "_" + model_type + "_" + cell_type + "cell" + "_" + input_format + "_" + stl_decomposition_identifier + "_" + hyperparameter_tuning + "_" + optimizer + "_" + tbptt_identifier + "_" + accumulated_error_identifier + "_" + str(
         seed)
     print("Model Training Started for {}".format(model_identifier))
 
+    # set the cpu threads and pin the cores before any tensorflow session is created
+    configure_cpu_resources(args)
+    print_cpu_configs(model_identifier)
+
     # select the optimizer
     if optimizer == "cocob":
         optimizer_fn = cocob_optimizer_fn
@@ -284,6 +429,9 @@ if __name__ == '__main__':
     elif optimizer == "adam":
         optimizer_fn = adam_optimizer_fn
 
+    # the MASE scalings of the training part of the series, to report the validation MASE
+    mase_scales, _ = calculate_validation_mase_scales(args.original_data_file, int(args.seasonality_period), output_size)
+
     # define the key word arguments for the different model types
     model_kwargs = {
         'use_bias': BIAS,
@@ -297,29 +445,52 @@ if __name__ == '__main__':
         'integer_conversion': integer_conversion,
         'seed': seed,
         'cell_type': cell_type,
-        'without_stl_decomposition': without_stl_decomposition
+        'input_format': input_format,
+        'without_stl_decomposition': without_stl_decomposition,
+        'with_truncated_backpropagation': with_truncated_backpropagation,
+        'encoder_lookback': encoder_lookback,
+        'window_sampling_length': window_sampling_length,
+        'in_graph_validation_metrics': in_graph_validation_metrics,
+        'mase_scales': mase_scales
     }
 
-    # select the model type
-    if model_type == "stacking":
-        model_trainer = StackingModelTrainer(**model_kwargs)
-    elif model_type == "seq2seq":
-        model_trainer = Seq2SeqModelTrainerWithNonMovingWindowUnaccumulatedError(**model_kwargs)
-    elif model_type == "seq2seqwithdenselayer":
-        if input_format == "non_moving_window":
-            model_trainer = Seq2SeqModelTrainerWithDenseLayerNonMovingWindowUnaccumulatedError(**model_kwargs)
-        elif input_format == "moving_window":
-            model_trainer = Seq2SeqModelTrainerWithDenseLayerMovingWindow(**model_kwargs)
+    # select the model type. Only the selected trainer is imported
+    model_class_start_time = time.time()
+    model_trainer = get_model_trainer_class(model_type, input_format)(**model_kwargs)
+    print("Cold start took {:.2f}s, of which importing the {} trainer took {:.2f}s".format(
+        time.time() - process_start_time, model_type, time.time() - model_class_start_time))
 
     # read the initial hyperparamter configurations from the file
     hyperparameter_values_dic = read_initial_hyperparameter_values(initial_hyperparameter_values_file)
+
+    # the chunk length of the truncated backpropagation is tuned from its range in the hyperparameter values file
+    if with_truncated_backpropagation:
+        if 'tbptt_chunk_length' not in hyperparameter_values_dic:
+            argument_parser.error("Truncated backpropagation requires a range for tbptt_chunk_length in {}".format(
+                initial_hyperparameter_values_file))
+        if hyperparameter_values_dic['tbptt_chunk_length'][0] < 1:
+            argument_parser.error("The range of tbptt_chunk_length in {} should start from 1 or more".format(
+                initial_hyperparameter_values_file))
+
+    # the validation errors of the trials are stored per configuration during the tuning
+    trial_results_file = model_training_configs.TRIAL_RESULTS_DIRECTORY + model_identifier + '.jsonl'
+    if not resume:
+        clear_trial_results(trial_results_file)
+    completed_trial_results = read_trial_results(trial_results_file)
+
+    tuning_start_time = time.time()
     optimized_configuration = smac()
 
     # persist the optimized configuration to a file
     persist_results(optimized_configuration, optimized_config_directory + '/' + model_identifier + '.txt')
 
-    # get the validation errors for the best hyperparameter configs
-    smape_error, smape_error_list = train_model(optimized_configuration)
+    # get the validation errors for the best hyperparameter configs from the stored trial results
+    trial_results = read_trial_results(trial_results_file)
+    incumbent_key = configuration_key(optimized_configuration)
+    if incumbent_key in trial_results:
+        smape_error, smape_error_list = trial_results[incumbent_key]
+    else:
+        smape_error, smape_error_list = train_model(optimized_configuration)
 
 
     # write the final list of validation errors to a file
@@ -331,7 +502,15 @@ if __name__ == '__main__':
     print("Optimized configuration: {}".format(optimized_configuration))
     print("Optimized Value: {}\n".format(smape_error))
 
+    if args.number_of_test_workers:
+        number_of_test_workers = int(args.number_of_test_workers)
+    else:
+        number_of_test_workers = model_testing_configs.NUMBER_OF_TEST_WORKERS
+
+    if args.ensemble_size:
+        ensemble_size = int(args.ensemble_size)
+    else:
+        ensemble_size = model_testing_configs.ENSEMBLE_SIZE
+
     # test the model
-    for i in range(1, 11):
-        args.seed = i
-        testing(args, optimized_configuration)
\ No newline at end of file
+    testing_multiple_seeds(args, optimized_configuration, test_seeds, number_of_test_workers, ensemble_size)
\ No newline at end of file
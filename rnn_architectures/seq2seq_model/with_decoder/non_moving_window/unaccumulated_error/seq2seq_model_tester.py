@@ -3,7 +3,12 @@ import tensorflow as tf
 from tensorflow.python.layers.core import Dense
 from tfrecords_handler.non_moving_window.tfrecord_reader import TFRecordReader
 from configs.global_configs import training_data_configs
-from configs.global_configs import gpu_configs
+from utility_scripts.session_configs import create_session_config
+from utility_scripts.training_checkpoints import TrainingCheckpoint
+from utility_scripts.model_export import export_model
+from utility_scripts.ensemble_scopes import ensemble_replica_scope, replica_weight_initializer
+from utility_scripts.snapshot_ensembles import snapshot_cycle_length, cyclic_learning_rate_scale, \
+    create_optimizer_reset_op
 
 class Seq2SeqModelTester:
 
@@ -15,47 +20,37 @@ class Seq2SeqModelTester:
         self.__binary_test_file_path = kwargs["binary_test_file_path"]
         self.__seed = kwargs["seed"]
         self.__cell_type = kwargs["cell_type"]
+        # the number of the last input points seen by the encoder, 0 for the whole series
+        self.__encoder_lookback = kwargs.get("encoder_lookback", 0)
+        self.__without_stl_decomposition = kwargs["without_stl_decomposition"]
+        self.__ensemble_size = kwargs.get("ensemble_size", 1)
+        # the seeds of the replicas of the ensemble
+        self.__ensemble_seeds = kwargs.get("ensemble_seeds", [self.__seed])
+        self.__snapshot_ensemble_size = kwargs.get("snapshot_ensemble_size", 1)
+
+        # define the metadata size based on the usage of stl decomposition
+        if self.__without_stl_decomposition:
+            self.__meta_data_size = 1
+        else:
+            self.__meta_data_size = self.__output_size + 1
 
     def __l1_loss(self, z, t):
         loss = tf.reduce_mean(tf.abs(t - z))
         return loss
 
-    # Training the time series
-    def test_model(self, **kwargs):
-
-        # optimized hyperparameters
-        num_hidden_layers = int(kwargs['num_hidden_layers'])
-        max_num_epochs = int(kwargs['max_num_epochs'])
-        max_epoch_size = int(kwargs['max_epoch_size'])
-        cell_dimension = int(kwargs['cell_dimension'])
-        l2_regularization = kwargs['l2_regularization']
-        minibatch_size = int(kwargs['minibatch_size'])
-        gaussian_noise_stdev = kwargs['gaussian_noise_stdev']
-        random_normal_initializer_stdev = kwargs['random_normal_initializer_stdev']
-        optimizer_fn = kwargs['optimizer_fn']
-
-        # reset the tensorflow graph
-        tf.reset_default_graph()
-
-        tf.set_random_seed(self.__seed)
-
-        # declare the input and output placeholders
-
+    # build one replica of the model under the current variable scope
+    def __build_model(self, input, training_target, input_sequence_length, num_hidden_layers, cell_dimension,
+                      l2_regularization, gaussian_noise_stdev, random_normal_initializer_stdev):
         # adding noise to the input
-        input = tf.placeholder(dtype=tf.float32, shape=[None, None, 1])
         noise = tf.random_normal(shape=tf.shape(input), mean=0.0, stddev=gaussian_noise_stdev, dtype=tf.float32)
         training_input = input + noise
 
         testing_input = input
 
-        training_target = tf.placeholder(dtype=tf.float32, shape=[None, self.__output_size, 1])
-        decoder_input = tf.placeholder(dtype=tf.float32, shape=[None, self.__output_size, 1])
-
-        # placeholder for the sequence lengths
-        input_sequence_length = tf.placeholder(dtype=tf.int32, shape=[None])
-        output_sequence_length = tf.placeholder(dtype=tf.int32, shape=[None])
+        weight_initializer = replica_weight_initializer(random_normal_initializer_stdev, self.__ensemble_size)
 
-        weight_initializer = tf.truncated_normal_initializer(stddev=random_normal_initializer_stdev)
+        # the variables created before this replica belong to the other replicas
+        existing_variables = set(tf.trainable_variables())
 
         # create the model architecture
 
@@ -93,49 +88,110 @@ class Seq2SeqModelTester:
         multi_layered_decoder_cell = tf.nn.rnn_cell.MultiRNNCell(
             cells=[cell() for _ in range(int(num_hidden_layers))])
 
+        # the first input of the decoder is the last input of every series, taken before the padding
+        new_index_array = tf.range(start=0, limit=tf.shape(input_sequence_length)[0], delta=1)
+        last_input_indices = tf.stack([new_index_array, input_sequence_length - 1], axis=-1)
+        decoder_go_input = tf.gather_nd(params=testing_input, indices=last_input_indices)
+
         # building the decoder network for training
+        # the decoder is teacher forced, so it runs as a plain rnn over the targets shifted by one step
         with tf.variable_scope('decoder_train_scope') as decoder_train_scope:
-            # create the initial state for the decoder
-            training_helper = tf.contrib.seq2seq.ScheduledOutputTrainingHelper(inputs=decoder_input,
-                                                                               sequence_length=output_sequence_length,
-                                                                               sampling_probability=0.0,
-                                                                               name="training_helper")
-            training_decoder = tf.contrib.seq2seq.BasicDecoder(cell=multi_layered_decoder_cell, helper=training_helper,
-                                                               initial_state=training_encoder_state,
-                                                               output_layer=dense_layer)
-
-            # perform the decoding
-            training_decoder_outputs, _, _ = tf.contrib.seq2seq.dynamic_decode(decoder=training_decoder)
+            training_decoder_input = tf.concat([tf.expand_dims(decoder_go_input, axis=1), training_target[:, :-1, :]],
+                                               axis=1)
+            with tf.variable_scope('decoder') as decoder_scope:
+                training_decoder_outputs, _ = tf.nn.dynamic_rnn(cell=multi_layered_decoder_cell,
+                                                                inputs=training_decoder_input,
+                                                                initial_state=training_encoder_state,
+                                                                scope=decoder_scope)
+                training_prediction_output = dense_layer(training_decoder_outputs)
 
         # building the decoder network for inference
+        # the decoder is unrolled over the forecast horizon and every forecast is the next input
         with tf.variable_scope(decoder_train_scope, reuse=tf.AUTO_REUSE) as decoder_inference_scope:
-            # create the initial state for the decoder
-            inference_helper = tf.contrib.seq2seq.ScheduledOutputTrainingHelper(inputs=decoder_input,
-                                                                                sequence_length=output_sequence_length,
-                                                                                sampling_probability=1.0,
-                                                                                name="inference_helper")
-            inference_decoder = tf.contrib.seq2seq.BasicDecoder(cell=multi_layered_decoder_cell,
-                                                                helper=inference_helper,
-                                                                initial_state=inference_encoder_state,
-                                                                output_layer=dense_layer)
-
-            # perform the decoding
-            inference_decoder_outputs, _, _ = tf.contrib.seq2seq.dynamic_decode(decoder=inference_decoder)
+            with tf.variable_scope('decoder'):
+                inference_decoder_input = decoder_go_input
+                inference_decoder_state = inference_encoder_state
+                inference_predictions = []
+                for _ in range(self.__output_size):
+                    inference_decoder_output, inference_decoder_state = multi_layered_decoder_cell(
+                        inference_decoder_input, inference_decoder_state)
+                    inference_decoder_input = dense_layer(inference_decoder_output)
+                    inference_predictions.append(inference_decoder_input)
+                inference_prediction_output = tf.stack(inference_predictions, axis=1)
 
         # error that should be minimized in the training process
-        error = self.__l1_loss(training_decoder_outputs[0], training_target)
+        error = self.__l1_loss(training_prediction_output, training_target)
 
-        # l2 regularization of the trainable model parameters
+        # l2 regularization of the trainable model parameters of this replica
         l2_loss = 0.0
         for var in tf.trainable_variables():
-            l2_loss += tf.nn.l2_loss(var)
+            if var not in existing_variables:
+                l2_loss += tf.nn.l2_loss(var)
 
         l2_loss = tf.multiply(tf.cast(l2_regularization, dtype=tf.float64), tf.cast(l2_loss, dtype=tf.float64))
 
         total_loss = tf.cast(error, dtype=tf.float64) + l2_loss
 
+        return inference_prediction_output, total_loss
+
+    # Training the time series
+    def test_model(self, **kwargs):
+
+        # optimized hyperparameters
+        num_hidden_layers = int(kwargs['num_hidden_layers'])
+        max_num_epochs = int(kwargs['max_num_epochs'])
+        max_epoch_size = int(kwargs['max_epoch_size'])
+        cell_dimension = int(kwargs['cell_dimension'])
+        l2_regularization = kwargs['l2_regularization']
+        minibatch_size = int(kwargs['minibatch_size'])
+        gaussian_noise_stdev = kwargs['gaussian_noise_stdev']
+        random_normal_initializer_stdev = kwargs['random_normal_initializer_stdev']
+        optimizer_fn = kwargs['optimizer_fn']
+        export_directory = kwargs.get('export_directory')
+
+        # reset the tensorflow graph
+        tf.reset_default_graph()
+
+        tf.set_random_seed(self.__seed)
+
+        # declare the input and output placeholders
+        input = tf.placeholder(dtype=tf.float32, shape=[None, None, 1])
+
+        training_target = tf.placeholder(dtype=tf.float32, shape=[None, self.__output_size, 1])
+
+        # placeholder for the sequence lengths
+        input_sequence_length = tf.placeholder(dtype=tf.int32, shape=[None])
+
+        # build a replica of the model per ensemble seed. The replicas are initialized independently, share the
+        # input pipeline and are trained and applied together in the same session runs
+        inference_decoder_outputs = []
+        total_losses = []
+        for replica_index, replica_seed in enumerate(self.__ensemble_seeds):
+            with ensemble_replica_scope(replica_index, self.__ensemble_size, replica_seed):
+                inference_decoder_output, total_loss = self.__build_model(input, training_target,
+                                                                          input_sequence_length, num_hidden_layers,
+                                                                          cell_dimension, l2_regularization,
+                                                                          gaussian_noise_stdev,
+                                                                          random_normal_initializer_stdev)
+            inference_decoder_outputs.append(inference_decoder_output)
+            total_losses.append(total_loss)
+
+        # the replicas do not share any variables, so the gradient of the sum is the gradient of each replica
+        total_loss = tf.add_n(total_losses)
+
+        # outputs of all the replicas in the format [ensemble_size, batch_size, output_size, 1]
+        inference_prediction_output = tf.stack(inference_decoder_outputs, axis=0)
+
+        # forecasts of the exported model in the format [ensemble_size, batch_size, output_size]
+        export_forecasts = tf.squeeze(inference_prediction_output, axis=3)
+
+        # scale of the learning rate, fed by the cyclic learning rate schedule of the snapshot ensembles
+        learning_rate_scale = tf.placeholder_with_default(1.0, shape=[])
+        model_variables = tf.global_variables()
+
         # create the optimizer
-        optimizer = optimizer_fn(total_loss)
+        optimizer = optimizer_fn(total_loss, learning_rate_scale)
+        optimizer_reset_op = create_optimizer_reset_op(model_variables)
 
         # create the Dataset objects for the training and test data
         training_dataset = tf.data.TFRecordDataset(filenames = [self.__binary_train_file_path], compression_type = "ZLIB")
@@ -151,6 +207,8 @@ class Seq2SeqModelTester:
         #                                                           count=int(max_epoch_size), seed=shuffle_seed))
         training_dataset = training_dataset.repeat(count=int(max_epoch_size))
         training_dataset = training_dataset.map(tfrecord_reader.validation_data_parser)
+        if self.__encoder_lookback > 0:
+            training_dataset = training_dataset.map(tfrecord_reader.lookback_truncator(self.__encoder_lookback))
 
         # create the batches by padding the datasets to make the variable sequence lengths fixed within the individual batches
         padded_training_data_batches = training_dataset.padded_batch(batch_size=int(minibatch_size),
@@ -165,72 +223,116 @@ class Seq2SeqModelTester:
 
         # preparing the test data
         test_dataset = test_dataset.map(tfrecord_reader.test_data_parser)
+        if self.__encoder_lookback > 0:
+            test_dataset = test_dataset.map(tfrecord_reader.lookback_truncator(self.__encoder_lookback))
 
         # create a single batch from all the test time series by padding the datasets to make the variable sequence lengths fixed
         padded_test_input_data = test_dataset.padded_batch(batch_size=int(minibatch_size), padded_shapes=(
         [], [tf.Dimension(None), 1], [self.__meta_data_size, 1]))
 
         # get an iterator to the test input data batch
-        test_input_iterator = padded_test_input_data.make_one_shot_iterator()
+        test_input_iterator = padded_test_input_data.make_initializable_iterator()
 
         # access the test input batch using the iterator
         test_input_data_batch = test_input_iterator.get_next()
 
+        # checkpoint of the training progress to resume an interrupted run
+        checkpoint = TrainingCheckpoint(kwargs.get('checkpoint_directory'))
+
         # setup variable initialization
         init_op = tf.global_variables_initializer()
 
-        # define the GPU options
-        gpu_options = tf.GPUOptions(allow_growth=True)
+        # the training run is divided into one learning rate cycle per snapshot
+        cycle_length = snapshot_cycle_length(max_num_epochs, self.__snapshot_ensemble_size)
 
-        with tf.Session(
-                config=tf.ConfigProto(log_device_placement=gpu_configs.log_device_placement, allow_soft_placement=True,
-                                      gpu_options=gpu_options)) as session:
+        with tf.Session(config=create_session_config()) as session:
             session.run(init_op)
+            first_epoch = checkpoint.restore(session)
 
-            for epoch in range(int(max_num_epochs)):
-                print("Epoch->", epoch)
+            # applying the model to the test data
+            def forecast_test_data():
+                session.run(test_input_iterator.initializer)
 
-                session.run(training_data_batch_iterator.initializer, feed_dict={shuffle_seed:epoch})
+                ensemble_forecasts = [[] for _ in range(self.__ensemble_size)]
                 while True:
                     try:
-                        next_training_batch_value = session.run(next_training_data_batch, feed_dict={shuffle_seed:epoch})
 
-                        decoder_input_value = np.hstack((np.expand_dims(next_training_batch_value[1][:, -1, :], axis=1),
-                                                         next_training_batch_value[2][:, :-1, :]))
+                        # get the batch of test inputs
+                        test_input_batch_value = session.run(test_input_data_batch)
+
+                        # get the output of all the replicas for the test input data batch
+                        test_output = session.run(inference_prediction_output,
+                                                  feed_dict={input: test_input_batch_value[1],
+                                                             input_sequence_length: test_input_batch_value[0]})
+
+                        for replica_index in range(self.__ensemble_size):
+                            ensemble_forecasts[replica_index].extend(test_output[replica_index].tolist())
 
-                        # model training
-                        loss, _ = session.run([total_loss, optimizer],
-                                    feed_dict={input: next_training_batch_value[1],
-                                               training_target: next_training_batch_value[2],
-                                               decoder_input: decoder_input_value,
-                                               input_sequence_length: next_training_batch_value[0],
-                                               output_sequence_length: [self.__output_size] * np.shape(next_training_batch_value[1])[0]})
                     except tf.errors.OutOfRangeError:
                         break
 
-            # applying the model to the test data
+                #the third dimension is squeezed since it is one
+                ensemble_forecasts = [np.squeeze(list_of_forecasts, axis = 2) for list_of_forecasts in ensemble_forecasts]
 
-            list_of_forecasts = []
-            while True:
-                try:
+                return ensemble_forecasts
 
-                    # get the batch of test inputs
-                    test_input_batch_value = session.run(test_input_data_batch)
+            # the forecasts of every snapshot of every replica
+            snapshot_forecasts = [[] for _ in range(self.__ensemble_size)]
+            for forecasts in checkpoint.load_snapshot_forecasts(first_epoch // cycle_length):
+                for replica_index, replica_forecasts in enumerate(forecasts):
+                    snapshot_forecasts[replica_index].append(replica_forecasts)
+            steps_per_epoch = None
+
+            for epoch in range(first_epoch, cycle_length * self.__snapshot_ensemble_size):
+                print("Epoch->", epoch)
 
-                    # shape for the target data
-                    decoder_input_shape = [np.shape(test_input_batch_value[1])[0], self.__output_size, 1]
+                # restart the optimizer at the start of every new learning rate cycle
+                if epoch > 0 and epoch % cycle_length == 0:
+                    session.run(optimizer_reset_op)
 
-                    # get the output of the network for the test input data batch
-                    test_output = session.run(inference_decoder_outputs[0],
-                                              feed_dict={input: test_input_batch_value[1],
-                                                         decoder_input: np.zeros(decoder_input_shape),
-                                                         input_sequence_length: test_input_batch_value[0],
-                                                         output_sequence_length: [self.__output_size] * np.shape(test_input_batch_value[1])[0]})
+                session.run(training_data_batch_iterator.initializer, feed_dict={shuffle_seed:epoch})
+                step = 0
+                while True:
+                    try:
+                        next_training_batch_value = session.run(next_training_data_batch, feed_dict={shuffle_seed:epoch})
 
-                    forecasts = test_output
-                    list_of_forecasts.extend(forecasts.tolist())
+                        if self.__snapshot_ensemble_size > 1:
+                            current_learning_rate_scale = cyclic_learning_rate_scale(epoch, step, steps_per_epoch,
+                                                                                     cycle_length)
+                        else:
+                            current_learning_rate_scale = 1.0
 
-                except tf.errors.OutOfRangeError:
-                    break
+                        # model training
+                        loss, _ = session.run([total_loss, optimizer],
+                                    feed_dict={input: next_training_batch_value[1],
+                                               learning_rate_scale: current_learning_rate_scale,
+                                               training_target: next_training_batch_value[2],
+                                               input_sequence_length: next_training_batch_value[0]})
 
-            return np.squeeze(list_of_forecasts, axis = 2) #the third dimension is squeezed since it is one
\ No newline at end of file
+                        step += 1
+                    except tf.errors.OutOfRangeError:
+                        break
+                steps_per_epoch = step
+
+                # take a snapshot of the forecasts at the end of every learning rate cycle
+                if (epoch + 1) % cycle_length == 0:
+                    forecasts = forecast_test_data()
+                    checkpoint.save_snapshot_forecasts(epoch // cycle_length, forecasts)
+                    for replica_index, replica_forecasts in enumerate(forecasts):
+                        snapshot_forecasts[replica_index].append(replica_forecasts)
+
+                checkpoint.save(session, epoch + 1)
+
+            # export the trained inference subgraph and its weights to forecast without retraining
+            if export_directory:
+                export_model(session, export_directory,
+                             inputs={'input': input, 'sequence_length': input_sequence_length},
+                             outputs={'forecasts': export_forecasts})
+
+            # the forecasts of the single model or a list of forecasts per ensemble member
+            # the members are ordered by the replica and then by the snapshot
+            ensemble_member_forecasts = [forecasts for replica_forecasts in snapshot_forecasts
+                                         for forecasts in replica_forecasts]
+            if len(ensemble_member_forecasts) == 1:
+                return ensemble_member_forecasts[0]
+            return ensemble_member_forecasts
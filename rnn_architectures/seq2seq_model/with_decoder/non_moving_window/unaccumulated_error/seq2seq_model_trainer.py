@@ -4,7 +4,9 @@ from tensorflow.python.layers.core import Dense
 from tfrecords_handler.non_moving_window.tfrecord_reader import TFRecordReader
 from configs.global_configs import model_training_configs
 from configs.global_configs import training_data_configs
-from configs.global_configs import gpu_configs
+from utility_scripts.session_configs import create_session_config, StepTimer
+from utility_scripts.training_checkpoints import TrainingCheckpoint
+from utility_scripts.validation_metrics import ValidationMetricsAccumulator, ValidationErrorGraph
 
 class Seq2SeqModelTrainer:
 
@@ -19,7 +21,19 @@ class Seq2SeqModelTrainer:
         self.__integer_conversion = kwargs["integer_conversion"]
         self.__seed = kwargs["seed"]
         self.__cell_type = kwargs["cell_type"]
+        # the number of the last input points seen by the encoder, 0 for the whole series
+        self.__encoder_lookback = kwargs.get("encoder_lookback", 0)
         self.__without_stl_decomposition = kwargs['without_stl_decomposition']
+        # the MASE scaling of every validation series, to report the validation MASE
+        self.__mase_scales = kwargs.get('mase_scales')
+        # whether to calculate the validation errors inside the graph instead of fetching the forecasts
+        self.__in_graph_validation_metrics = kwargs.get('in_graph_validation_metrics', False)
+
+        # define the metadata size based on the usage of stl decomposition
+        if self.__without_stl_decomposition:
+            self.__meta_data_size = 1
+        else:
+            self.__meta_data_size = self.__output_size + 1
 
     def __l1_loss(self, z, t):
         loss = tf.reduce_mean(tf.abs(t - z))
@@ -50,11 +64,9 @@ class Seq2SeqModelTrainer:
         validation_input = input
 
         training_target = tf.placeholder(dtype=tf.float32, shape=[None, self.__output_size, 1])
-        decoder_input = tf.placeholder(dtype=tf.float32, shape=[None, self.__output_size, 1])
 
         # placeholder for the sequence lengths
         input_sequence_length = tf.placeholder(dtype=tf.int32, shape=[None])
-        output_sequence_length = tf.placeholder(dtype=tf.int32, shape=[None])
 
         weight_initializer = tf.truncated_normal_initializer(stddev=random_normal_initializer_stdev)
 
@@ -81,12 +93,6 @@ class Seq2SeqModelTrainer:
                                                                                  sequence_length=input_sequence_length,
                                                                                  dtype=tf.float32)
 
-        with tf.variable_scope(encoder_train_scope, reuse=tf.AUTO_REUSE) as encoder_inference_scope:
-            inference_encoder_outputs, inference_encoder_states = tf.nn.dynamic_rnn(cell=multi_layered_encoder_cell,
-                                                                                    inputs=validation_input,
-                                                                                    sequence_length=input_sequence_length,
-                                                                                    dtype=tf.float32)
-
         # the final projection layer to convert the output to the desired dimension
         dense_layer = Dense(units=1, use_bias=self.__use_bias, kernel_initializer=weight_initializer)
 
@@ -94,37 +100,56 @@ class Seq2SeqModelTrainer:
         multi_layered_decoder_cell = tf.nn.rnn_cell.MultiRNNCell(
             cells=[cell() for _ in range(int(num_hidden_layers))])
 
+        # the first input of the decoder is the last input of every series, taken before the padding
+        new_index_array = tf.range(start=0, limit=tf.shape(input_sequence_length)[0], delta=1)
+        last_input_indices = tf.stack([new_index_array, input_sequence_length - 1], axis=-1)
+        decoder_go_input = tf.gather_nd(params=validation_input, indices=last_input_indices)
+
         # building the decoder network for training
+        # the decoder is teacher forced, so it runs as a plain rnn over the targets shifted by one step
         with tf.variable_scope('decoder_train_scope') as decoder_train_scope:
-            # create the initial state for the decoder
-            training_helper = tf.contrib.seq2seq.ScheduledOutputTrainingHelper(inputs=decoder_input,
-                                                                               sequence_length=output_sequence_length,
-                                                                               sampling_probability=0.0,
-                                                                               name = "training_helper")
-            training_decoder = tf.contrib.seq2seq.BasicDecoder(cell=multi_layered_decoder_cell, helper=training_helper,
-                                                               initial_state=training_encoder_state,
-                                                               output_layer=dense_layer)
-
-            # perform the decoding
-            training_decoder_outputs, _, _ = tf.contrib.seq2seq.dynamic_decode(decoder=training_decoder)
-
-        # building the decoder network for inference
-        with tf.variable_scope(decoder_train_scope, reuse=tf.AUTO_REUSE) as decoder_inference_scope:
-            # create the initial state for the decoder
-            inference_helper = tf.contrib.seq2seq.ScheduledOutputTrainingHelper(inputs=decoder_input,
-                                                                                sequence_length=output_sequence_length,
-                                                                                sampling_probability=1.0,
-                                                                                name = "inference_helper")
-            inference_decoder = tf.contrib.seq2seq.BasicDecoder(cell=multi_layered_decoder_cell, helper=inference_helper,
-                                                                initial_state=inference_encoder_states,
-                                                                output_layer=dense_layer)
-
-            # perform the decoding
-            inference_decoder_outputs, _, _ = tf.contrib.seq2seq.dynamic_decode(decoder=inference_decoder)
-
+            training_decoder_input = tf.concat([tf.expand_dims(decoder_go_input, axis=1), training_target[:, :-1, :]],
+                                               axis=1)
+            with tf.variable_scope('decoder') as decoder_scope:
+                training_decoder_outputs, _ = tf.nn.dynamic_rnn(cell=multi_layered_decoder_cell,
+                                                                inputs=training_decoder_input,
+                                                                initial_state=training_encoder_state,
+                                                                scope=decoder_scope)
+                training_prediction_output = dense_layer(training_decoder_outputs)
+
+        # the inference network on the given inputs, sharing the variables of the training network
+        def inference(validation_input, input_sequence_length):
+            with tf.variable_scope(encoder_train_scope, reuse=tf.AUTO_REUSE) as encoder_inference_scope:
+                inference_encoder_outputs, inference_encoder_states = tf.nn.dynamic_rnn(
+                    cell=multi_layered_encoder_cell, inputs=validation_input, sequence_length=input_sequence_length,
+                    dtype=tf.float32)
+
+            # the first input of the decoder is the last input of every series, taken before the padding
+            inference_last_input_indices = tf.stack(
+                [tf.range(start=0, limit=tf.shape(input_sequence_length)[0], delta=1), input_sequence_length - 1],
+                axis=-1)
+
+            # building the decoder network for inference
+            # the decoder is unrolled over the forecast horizon and every forecast is the next input
+            with tf.variable_scope(decoder_train_scope, reuse=tf.AUTO_REUSE) as decoder_inference_scope:
+                with tf.variable_scope('decoder'):
+                    inference_decoder_input = tf.gather_nd(params=validation_input,
+                                                           indices=inference_last_input_indices)
+                    inference_decoder_state = inference_encoder_states
+                    inference_predictions = []
+                    for _ in range(self.__output_size):
+                        inference_decoder_output, inference_decoder_state = multi_layered_decoder_cell(
+                            inference_decoder_input, inference_decoder_state)
+                        inference_decoder_input = dense_layer(inference_decoder_output)
+                        inference_predictions.append(inference_decoder_input)
+                    inference_prediction_output = tf.stack(inference_predictions, axis=1)
+
+            return inference_prediction_output
+
+        inference_prediction_output = inference(validation_input, input_sequence_length)
 
         # error that should be minimized in the training process
-        error = self.__l1_loss(training_decoder_outputs[0], training_target)
+        error = self.__l1_loss(training_prediction_output, training_target)
 
 
         # l2 regularization of the trainable model parameters
@@ -156,6 +181,8 @@ class Seq2SeqModelTrainer:
         #                                                           count=int(max_epoch_size), seed=shuffle_seed))
         training_dataset = training_dataset.repeat(count=int(max_epoch_size))
         training_dataset = training_dataset.map(tfrecord_reader.train_data_parser)
+        if self.__encoder_lookback > 0:
+            training_dataset = training_dataset.map(tfrecord_reader.lookback_truncator(self.__encoder_lookback))
 
         padded_training_data_batches = training_dataset.padded_batch(batch_size=int(minibatch_size),
                                                                      padded_shapes=train_padded_shapes)
@@ -165,6 +192,8 @@ class Seq2SeqModelTrainer:
 
         # preparing the validation data
         validation_dataset = validation_dataset.map(tfrecord_reader.validation_data_parser)
+        if self.__encoder_lookback > 0:
+            validation_dataset = validation_dataset.map(tfrecord_reader.lookback_truncator(self.__encoder_lookback))
 
         # create a single batch from all the validation time series by padding the datasets to make the variable sequence lengths fixed
         padded_validation_dataset = validation_dataset.padded_batch(batch_size=int(minibatch_size),
@@ -176,20 +205,35 @@ class Seq2SeqModelTrainer:
         # access the validation data using the iterator
         next_validation_data_batch = validation_data_iterator.get_next()
 
+        # the errors of the validation series calculated inside the graph, with the inference network applied directly
+        # to the validation batches of the iterator
+        if self.__in_graph_validation_metrics:
+            validation_error_graph = ValidationErrorGraph(
+                inference(next_validation_data_batch[1], tf.cast(next_validation_data_batch[0], dtype=tf.int32)),
+                next_validation_data_batch,
+                moving_window=False,
+                contain_zero_values=self.__contain_zero_values,
+                integer_conversion=self.__integer_conversion,
+                without_stl_decomposition=self.__without_stl_decomposition)
+
+        # checkpoint of the training progress to resume an interrupted run
+        checkpoint = TrainingCheckpoint(kwargs.get('checkpoint_directory'))
+
         # setup variable initialization
         init_op = tf.global_variables_initializer()
 
-        # define the GPU options
-        gpu_options = tf.GPUOptions(allow_growth=True)
-
-        with tf.Session(
-                config=tf.ConfigProto(log_device_placement=gpu_configs.log_device_placement, allow_soft_placement=True,
-                                      gpu_options=gpu_options)) as session:
+        with tf.Session(config=create_session_config()) as session:
             session.run(init_op)
+            first_epoch = checkpoint.restore(session)
+            step_timer = StepTimer()
 
             smape_final = 0.0
-            smape_list = []
-            for epoch in range(max_num_epochs):
+            validation_metrics = ValidationMetricsAccumulator(moving_window=False,
+                                                              contain_zero_values=self.__contain_zero_values,
+                                                              integer_conversion=self.__integer_conversion,
+                                                              without_stl_decomposition=self.__without_stl_decomposition,
+                                                              mase_scales=self.__mase_scales)
+            for epoch in range(first_epoch, max_num_epochs):
                 print("Epoch->", epoch)
 
                 session.run(training_data_batch_iterator.initializer, feed_dict={shuffle_seed:epoch})
@@ -197,95 +241,52 @@ class Seq2SeqModelTrainer:
                 while True:
                     try:
                         training_data_batch_value = session.run(next_training_data_batch, feed_dict={shuffle_seed:epoch})
-                        decoder_input_value = np.hstack((np.expand_dims(training_data_batch_value[1][:, -1, :], axis=1), training_data_batch_value[2][:, :-1, :]))
 
+                        step_timer.start()
                         total_loss_value, _ = session.run([total_loss, optimizer],
                                     feed_dict={input: training_data_batch_value[1],
                                                training_target: training_data_batch_value[2],
-                                               decoder_input: decoder_input_value,
-                                               input_sequence_length: training_data_batch_value[0],
-                                               output_sequence_length: [self.__output_size] * np.shape(training_data_batch_value[1])[0]})
+                                               input_sequence_length: training_data_batch_value[0]})
+                        step_timer.stop(np.shape(training_data_batch_value[1]))
 
 
                     except tf.errors.OutOfRangeError:
                         break
 
+                checkpoint.save(session, epoch + 1)
+
+            step_timer.report()
+
             session.run(validation_data_iterator.initializer)
 
             while True:
                 try:
-                    # get the batch of validation inputs
-                    validation_data_batch_value = session.run(next_validation_data_batch)
-
-                    # shape for the target data
-                    decoder_input_shape = [np.shape(validation_data_batch_value[1])[0], self.__output_size, 1]
-
-                    # get the output of the network for the validation input data batch
-                    validation_output = session.run(inference_decoder_outputs[0],
-                        feed_dict={input: validation_data_batch_value[1],
-                                   decoder_input: np.zeros(decoder_input_shape),
-                                   input_sequence_length: validation_data_batch_value[0],
-                                   output_sequence_length: [self.__output_size] *
-                                                           np.shape(validation_data_batch_value[1])[0]
-                                   })
-                    # calculate the smape for the validation data using vectorization
-
-                    # convert the data to remove the preprocessing
-                    true_seasonality_values = validation_data_batch_value[3][:, 1:, 0]
-                    level_values = validation_data_batch_value[3][:, 0, 0]
-
-                    actual_values = validation_data_batch_value[2]
-
-                    if self.__without_stl_decomposition:
-                        converted_validation_output = np.exp(np.squeeze(validation_output, axis=2))
-                        converted_actual_values = np.exp(np.squeeze(actual_values, axis=2))
-
-                    else:
-                        converted_validation_output = np.exp(
-                            true_seasonality_values + level_values[:, np.newaxis] + np.squeeze(validation_output,
-                                                                                               axis=2))
-                        converted_actual_values = np.exp(
-                            true_seasonality_values + level_values[:, np.newaxis] + np.squeeze(actual_values,
-                                                                                           axis=2))
-
-
-                    if (self.__contain_zero_values):  # to compensate for 0 values in data
-                        converted_validation_output = converted_validation_output - 1
-                        converted_actual_values = converted_actual_values - 1
-
-                    if self.__without_stl_decomposition:
-                        converted_validation_output = converted_validation_output * level_values[:, np.newaxis]
-                        converted_actual_values = converted_actual_values * level_values[:, np.newaxis]
-
-                    if self.__integer_conversion:
-                        converted_validation_output = np.round(converted_validation_output)
-                        converted_actual_values = np.round(converted_actual_values)
-
-                    converted_validation_output[converted_validation_output < 0] = 0
-                    converted_actual_values[converted_actual_values < 0] = 0
-
-                    if self.__address_near_zero_instability:
-                        # calculate the smape
-                        epsilon = 0.1
-                        sum = np.maximum(
-                            np.abs(converted_validation_output) + np.abs(converted_actual_values) + epsilon,
-                            0.5 + epsilon)
-                        smape_values = (np.abs(converted_validation_output - converted_actual_values) /
-                                        sum) * 2
-                        smape_values_per_series = np.mean(smape_values, axis=1)
-                        smape_list.extend(smape_values_per_series)
+                    if self.__in_graph_validation_metrics:
+                        # the validation batch is read and evaluated inside the graph, and only the errors of its
+                        # series are fetched
+                        validation_metrics.add_errors(session.run(validation_error_graph.errors))
                     else:
-                        # calculate the smape
-                        smape_values = (np.abs(converted_validation_output - converted_actual_values) /
-                                        (np.abs(converted_validation_output) + np.abs(converted_actual_values))) * 2
-                        smape_values_per_series = np.mean(smape_values, axis=1)
-                        smape_list.extend(smape_values_per_series)
+                        # get the batch of validation inputs
+                        validation_data_batch_value = session.run(next_validation_data_batch)
+
+                        # get the output of the network for the validation input data batch
+                        validation_output = session.run(inference_prediction_output,
+                            feed_dict={input: validation_data_batch_value[1],
+                                       input_sequence_length: validation_data_batch_value[0]
+                                       })
+                        # accumulate the errors of the series of the batch
+                        validation_metrics.add_batch(validation_output, validation_data_batch_value[0],
+                                                     validation_data_batch_value[2], validation_data_batch_value[3])
 
                 except tf.errors.OutOfRangeError:
                     break
 
+            smape_list = validation_metrics.smape(self.__address_near_zero_instability).tolist()
             smape_final = np.mean(smape_list)
             print("SMAPE value: {}".format(smape_final))
+            mase_values = validation_metrics.mase()
+            if mase_values is not None:
+                print("MASE value: {}".format(np.mean(mase_values)))
             session.close()
 
         return float(smape_final), smape_list
\ No newline at end of file
@@ -3,7 +3,9 @@ import tensorflow as tf
 from tfrecords_handler.moving_window.tfrecord_reader import TFRecordReader
 from configs.global_configs import model_training_configs
 from configs.global_configs import training_data_configs
-from configs.global_configs import gpu_configs
+from utility_scripts.session_configs import create_session_config, StepTimer
+from utility_scripts.training_checkpoints import TrainingCheckpoint
+from utility_scripts.validation_metrics import ValidationMetricsAccumulator, ValidationErrorGraph
 
 
 class Seq2SeqModelTrainerWithDenseLayer:
@@ -20,7 +22,15 @@ class Seq2SeqModelTrainerWithDenseLayer:
         self.__integer_conversion = kwargs["integer_conversion"]
         self.__seed = kwargs["seed"]
         self.__cell_type = kwargs["cell_type"]
+        # the number of windows of the subsequences sampled for the training, 0 to train on the whole series
+        self.__window_sampling_length = kwargs.get("window_sampling_length", 0)
+        # the number of the last input windows seen by the encoder, 0 for the whole series
+        self.__encoder_lookback = kwargs.get("encoder_lookback", 0)
         self.__without_stl_decomposition = kwargs['without_stl_decomposition']
+        # the MASE scaling of every validation series, to report the validation MASE
+        self.__mase_scales = kwargs.get('mase_scales')
+        # whether to calculate the validation errors inside the graph instead of fetching the forecasts
+        self.__in_graph_validation_metrics = kwargs.get('in_graph_validation_metrics', False)
 
         # define the metadata size based on the usage of stl decomposition
         if self.__without_stl_decomposition:
@@ -93,12 +103,6 @@ class Seq2SeqModelTrainerWithDenseLayer:
                                                                                  sequence_length=sequence_length,
                                                                                  dtype=tf.float32)
 
-        with tf.variable_scope(encoder_train_scope, reuse=tf.AUTO_REUSE) as encoder_inference_scope:
-            inference_encoder_outputs, inference_encoder_states = tf.nn.dynamic_rnn(cell=multi_layered_encoder_cell,
-                                                                                    inputs=validation_input,
-                                                                                    sequence_length=sequence_length,
-                                                                                    dtype=tf.float32)
-
         # building the decoder network for training
         with tf.variable_scope('dense_layer_train_scope') as dense_layer_train_scope:
             train_final_timestep_predictions = tf.gather_nd(params=training_encoder_outputs,
@@ -111,17 +115,30 @@ class Seq2SeqModelTrainerWithDenseLayer:
                 use_bias=self.__use_bias, kernel_initializer=weight_initializer)
             train_prediction_output = tf.expand_dims(input=train_prediction_output, axis=1)
 
-        # building the decoder network for inference
-        with tf.variable_scope(dense_layer_train_scope, reuse=tf.AUTO_REUSE) as dense_layer_inference_scope:
-            inference_final_timestep_predictions = tf.gather_nd(params=inference_encoder_outputs,
-                                                                indices=output_array_indices)
+        # the inference network on the given inputs, sharing the variables of the training network
+        def inference(validation_input, sequence_length):
+            with tf.variable_scope(encoder_train_scope, reuse=tf.AUTO_REUSE) as encoder_inference_scope:
+                inference_encoder_outputs, inference_encoder_states = tf.nn.dynamic_rnn(
+                    cell=multi_layered_encoder_cell, inputs=validation_input, sequence_length=sequence_length,
+                    dtype=tf.float32)
 
-            # the final projection layer to convert the encoder_outputs to the desired dimension
-            inference_prediction_output = tf.layers.dense(
-                inputs=tf.convert_to_tensor(value=inference_final_timestep_predictions, dtype=tf.float32),
-                units=self.__output_size,
-                use_bias=self.__use_bias, kernel_initializer=weight_initializer)
-            inference_prediction_output = tf.expand_dims(input=inference_prediction_output, axis=1)
+            # building the decoder network for inference
+            with tf.variable_scope(dense_layer_train_scope, reuse=tf.AUTO_REUSE) as dense_layer_inference_scope:
+                inference_output_array_indices = tf.stack(
+                    [tf.range(start=0, limit=tf.shape(sequence_length)[0], delta=1), sequence_length - 1], axis=-1)
+                inference_final_timestep_predictions = tf.gather_nd(params=inference_encoder_outputs,
+                                                                    indices=inference_output_array_indices)
+
+                # the final projection layer to convert the encoder_outputs to the desired dimension
+                inference_prediction_output = tf.layers.dense(
+                    inputs=tf.convert_to_tensor(value=inference_final_timestep_predictions, dtype=tf.float32),
+                    units=self.__output_size,
+                    use_bias=self.__use_bias, kernel_initializer=weight_initializer)
+                inference_prediction_output = tf.expand_dims(input=inference_prediction_output, axis=1)
+
+            return inference_prediction_output
+
+        inference_prediction_output = inference(validation_input, sequence_length)
 
         # error that should be minimized in the training process
         error = self.__l1_loss(train_prediction_output, actual_targets)
@@ -159,15 +176,30 @@ class Seq2SeqModelTrainerWithDenseLayer:
         #                                        count=int(max_epoch_size), seed=shuffle_seed))
         training_dataset = training_dataset.repeat(count=int(max_epoch_size))
         training_dataset = training_dataset.map(tfrecord_reader.train_data_parser)
-
-        padded_training_data_batches = training_dataset.padded_batch(batch_size=int(minibatch_size),
-                                                                     padded_shapes=train_padded_shapes)
+        if self.__encoder_lookback > 0:
+            training_dataset = training_dataset.map(tfrecord_reader.lookback_truncator(self.__encoder_lookback))
+
+        if self.__window_sampling_length > 0:
+            tfrecord_reader.report_window_sampling(self.__binary_train_file_path, self.__window_sampling_length)
+
+            # dense batches of the subsequences sampled across the series, of the same shape in every step
+            training_dataset = training_dataset.flat_map(
+                tfrecord_reader.window_sampler(self.__window_sampling_length))
+            training_dataset = training_dataset.shuffle(buffer_size=training_data_configs.SHUFFLE_BUFFER_SIZE,
+                                                        seed=shuffle_seed)
+            padded_training_data_batches = training_dataset.batch(batch_size=int(minibatch_size),
+                                                                  drop_remainder=True)
+        else:
+            padded_training_data_batches = training_dataset.padded_batch(batch_size=int(minibatch_size),
+                                                                         padded_shapes=train_padded_shapes)
 
         training_data_batch_iterator = padded_training_data_batches.make_initializable_iterator()
         next_training_data_batch = training_data_batch_iterator.get_next()
 
         # preparing the validation data
         validation_dataset = validation_dataset.map(tfrecord_reader.validation_data_parser)
+        if self.__encoder_lookback > 0:
+            validation_dataset = validation_dataset.map(tfrecord_reader.lookback_truncator(self.__encoder_lookback))
 
         # create a single batch from all the validation time series by padding the datasets to make the variable sequence lengths fixed
         padded_validation_dataset = validation_dataset.padded_batch(batch_size=int(minibatch_size),
@@ -178,19 +210,35 @@ class Seq2SeqModelTrainerWithDenseLayer:
         # access the validation data using the iterator
         next_validation_data_batch = validation_data_iterator.get_next()
 
+        # the errors of the validation series calculated inside the graph, with the inference network applied directly
+        # to the validation batches of the iterator
+        if self.__in_graph_validation_metrics:
+            validation_error_graph = ValidationErrorGraph(
+                inference(next_validation_data_batch[1], tf.cast(next_validation_data_batch[0], dtype=tf.int32)),
+                next_validation_data_batch,
+                moving_window=True,
+                contain_zero_values=self.__contain_zero_values,
+                integer_conversion=self.__integer_conversion,
+                without_stl_decomposition=self.__without_stl_decomposition)
+
+        # checkpoint of the training progress to resume an interrupted run
+        checkpoint = TrainingCheckpoint(kwargs.get('checkpoint_directory'))
+
         # setup variable initialization
         init_op = tf.global_variables_initializer()
 
-        # define the GPU options
-        gpu_options = tf.GPUOptions(allow_growth=True)
-        with tf.Session(
-                config=tf.ConfigProto(log_device_placement=gpu_configs.log_device_placement, allow_soft_placement=True,
-                                      gpu_options=gpu_options)) as session:
+        with tf.Session(config=create_session_config()) as session:
             session.run(init_op)
+            first_epoch = checkpoint.restore(session)
+            step_timer = StepTimer()
 
             smape_final = 0.0
-            smape_list = []
-            for epoch in range(max_num_epochs):
+            validation_metrics = ValidationMetricsAccumulator(moving_window=True,
+                                                              contain_zero_values=self.__contain_zero_values,
+                                                              integer_conversion=self.__integer_conversion,
+                                                              without_stl_decomposition=self.__without_stl_decomposition,
+                                                              mase_scales=self.__mase_scales)
+            for epoch in range(first_epoch, max_num_epochs):
                 print("Epoch->", epoch)
 
                 session.run(training_data_batch_iterator.initializer, feed_dict={shuffle_seed: epoch})
@@ -200,87 +248,53 @@ class Seq2SeqModelTrainerWithDenseLayer:
                         training_data_batch_value = session.run(next_training_data_batch,
                                                                 feed_dict={shuffle_seed: epoch})
 
+                        step_timer.start()
                         total_loss_value, _ = session.run([total_loss, optimizer],
                                     feed_dict={input: training_data_batch_value[1],
                                                target: training_data_batch_value[2],
                                                sequence_length: training_data_batch_value[0]
                                                })
+                        step_timer.stop(np.shape(training_data_batch_value[1]))
 
                     except tf.errors.OutOfRangeError:
                         break
 
+                checkpoint.save(session, epoch + 1)
+
+            step_timer.report()
+
             session.run(validation_data_iterator.initializer)
 
             while True:
                 try:
-                    # get the batch of validation inputs
-                    validation_data_batch_value = session.run(next_validation_data_batch)
-
-                    # get the output of the network for the validation input data batch
-                    validation_output = session.run(inference_prediction_output,
-                                                    feed_dict={input: validation_data_batch_value[1],
-                                                               sequence_length:
-                                                                   validation_data_batch_value[0]
-                                                               })
-
-                    # calculate the smape for the validation data using vectorization
-                    last_indices = validation_data_batch_value[0] - 1
-                    array_first_dimension = np.array(range(0, validation_data_batch_value[0].shape[0]))
-
-                    true_seasonality_values = validation_data_batch_value[3][array_first_dimension,
-                                              last_indices, 1:]
-                    level_values = validation_data_batch_value[3][array_first_dimension, last_indices, 0]
-
-                    actual_values = validation_data_batch_value[2][array_first_dimension, last_indices, :]
+                    if self.__in_graph_validation_metrics:
+                        # the validation batch is read and evaluated inside the graph, and only the errors of its
+                        # series are fetched
+                        validation_metrics.add_errors(session.run(validation_error_graph.errors))
+                    else:
+                        # get the batch of validation inputs
+                        validation_data_batch_value = session.run(next_validation_data_batch)
 
-                    if self.__without_stl_decomposition:
-                        converted_actual_values = np.exp(actual_values)
-                        converted_validation_output = np.exp(validation_output)
+                        # get the output of the network for the validation input data batch
+                        validation_output = session.run(inference_prediction_output,
+                                                        feed_dict={input: validation_data_batch_value[1],
+                                                                   sequence_length:
+                                                                       validation_data_batch_value[0]
+                                                                   })
 
-                    else:
-                        converted_actual_values = np.exp(
-                        true_seasonality_values + level_values[:, np.newaxis] + actual_values)
-
-                        converted_validation_output = np.exp(
-                            true_seasonality_values + level_values[:, np.newaxis] + validation_output)
-
-                    if (self.__contain_zero_values):  # to compensate for 0 values in data
-                        converted_validation_output = converted_validation_output - 1
-                        converted_actual_values = converted_actual_values - 1
-
-                    if self.__without_stl_decomposition:
-                        converted_actual_values = converted_actual_values * level_values[:, np.newaxis]
-                        converted_validation_output = converted_validation_output * level_values[:, np.newaxis]
-
-                    if self.__integer_conversion:
-                        converted_validation_output = np.round(converted_validation_output)
-                        converted_actual_values = np.round(converted_actual_values)
-
-                    converted_validation_output[converted_validation_output < 0] = 0
-                    converted_actual_values[converted_actual_values < 0] = 0
-
-                    if self.__address_near_zero_instability:
-                        # calculate the smape
-                        epsilon = 0.1
-                        sum = np.maximum(
-                            np.abs(converted_validation_output) + np.abs(converted_actual_values) + epsilon,
-                            0.5 + epsilon)
-                        smape_values = (np.abs(converted_validation_output - converted_actual_values) /
-                                        sum) * 2
-                        smape_values_per_series = np.mean(smape_values, axis=1)
-                        smape_list.extend(smape_values_per_series)
-                    else:
-                        # calculate the smape
-                        smape_values = (np.abs(converted_validation_output - converted_actual_values) /
-                                        (np.abs(converted_validation_output) + np.abs(converted_actual_values))) * 2
-                        smape_values_per_series = np.mean(smape_values, axis=1)
-                        smape_list.extend(smape_values_per_series)
+                        # accumulate the errors of the series of the batch
+                        validation_metrics.add_batch(validation_output, validation_data_batch_value[0],
+                                                     validation_data_batch_value[2], validation_data_batch_value[3])
 
                 except tf.errors.OutOfRangeError:
                     break
 
+            smape_list = validation_metrics.smape(self.__address_near_zero_instability).tolist()
             smape_final = np.mean(smape_list)
             print("SMAPE value: {}".format(smape_final))
+            mase_values = validation_metrics.mase()
+            if mase_values is not None:
+                print("MASE value: {}".format(np.mean(mase_values)))
             session.close()
 
         return float(smape_final), smape_list
@@ -1,8 +1,14 @@
 import numpy as np
 import tensorflow as tf
+from tensorflow.python.util import nest
 from tfrecords_handler.moving_window.tfrecord_reader import TFRecordReader
 from configs.global_configs import training_data_configs
-from configs.global_configs import gpu_configs
+from utility_scripts.session_configs import create_session_config
+from utility_scripts.training_checkpoints import TrainingCheckpoint
+from utility_scripts.model_export import export_model
+from utility_scripts.ensemble_scopes import ensemble_replica_scope, replica_weight_initializer
+from utility_scripts.snapshot_ensembles import snapshot_cycle_length, cyclic_learning_rate_scale, \
+    create_optimizer_reset_op
 
 
 class StackingModelTester:
@@ -16,7 +22,14 @@ class StackingModelTester:
         self.__binary_test_file_path = kwargs["binary_test_file_path"]
         self.__seed = kwargs["seed"]
         self.__cell_type = kwargs["cell_type"]
+        # the number of windows of the subsequences sampled for the training, 0 to train on the whole series
+        self.__window_sampling_length = kwargs.get("window_sampling_length", 0)
         self.__without_stl_decomposition = kwargs["without_stl_decomposition"]
+        self.__with_truncated_backpropagation = kwargs["with_truncated_backpropagation"]
+        self.__ensemble_size = kwargs.get("ensemble_size", 1)
+        # the seeds of the replicas of the ensemble
+        self.__ensemble_seeds = kwargs.get("ensemble_seeds", [self.__seed])
+        self.__snapshot_ensemble_size = kwargs.get("snapshot_ensemble_size", 1)
 
         # define the metadata size based on the usage of stl decomposition
         if self.__without_stl_decomposition:
@@ -28,41 +41,30 @@ class StackingModelTester:
         loss = tf.reduce_mean(tf.abs(t - z))
         return loss
 
+    # the output of the RNN at the last timestep of every sequence, which is the hidden state of the last layer in the
+    # final state since the dynamic_rnn keeps the state unchanged after the end of a sequence
+    def __last_output(self, rnn_states):
+        last_layer_state = rnn_states[-1]
+        if isinstance(last_layer_state, tf.nn.rnn_cell.LSTMStateTuple):
+            return last_layer_state.h
+        return last_layer_state
+
     def __l2_loss(selfself, z, t):
         loss = tf.losses.mean_squared_error(labels=t, predictions=z)
         return loss
 
-    # Training the time series
-    def test_model(self, **kwargs):
-
-        # extract the parameters from the kwargs
-        num_hidden_layers = kwargs['num_hidden_layers']
-        cell_dimension = kwargs['cell_dimension']
-        minibatch_size = kwargs['minibatch_size']
-        max_epoch_size = kwargs['max_epoch_size']
-        max_num_epochs = kwargs['max_num_epochs']
-        l2_regularization = kwargs['l2_regularization']
-        gaussian_noise_stdev = kwargs['gaussian_noise_stdev']
-        optimizer_fn = kwargs['optimizer_fn']
-        random_normal_initializer_stdev = kwargs['random_normal_initializer_stdev']
-
-        # reset the tensorflow graph
-        tf.reset_default_graph()
-
-        tf.set_random_seed(self.__seed)
-
-        # declare the input and output placeholders
-        input = tf.placeholder(dtype=tf.float32, shape=[None, None, self.__input_size])
+    # build one replica of the model under the current variable scope
+    def __build_model(self, input, true_output, sequence_lengths, num_hidden_layers, cell_dimension, l2_regularization,
+                      gaussian_noise_stdev, random_normal_initializer_stdev):
         noise = tf.random_normal(shape=tf.shape(input), mean=0.0, stddev=gaussian_noise_stdev, dtype=tf.float32)
         training_input = input + noise
 
         testing_input = input
 
-        # output format [batch_size, sequence_length, dimension]
-        true_output = tf.placeholder(dtype=tf.float32, shape=[None, None, self.__output_size])
-        sequence_lengths = tf.placeholder(dtype=tf.int64, shape=[None])
+        weight_initializer = replica_weight_initializer(random_normal_initializer_stdev, self.__ensemble_size)
 
-        weight_initializer = tf.truncated_normal_initializer(stddev=random_normal_initializer_stdev)
+        # the variables created before this replica belong to the other replicas
+        existing_variables = set(tf.trainable_variables())
 
         # RNN with the layer of cells
         def cell():
@@ -77,11 +79,14 @@ class StackingModelTester:
 
         multi_layered_cell = tf.nn.rnn_cell.MultiRNNCell(cells=[cell() for _ in range(int(num_hidden_layers))])
 
+        # initial state of the training RNN. With truncated backpropagation, the final state of the previous chunk is fed here
+        training_initial_state = multi_layered_cell.zero_state(batch_size=tf.shape(training_input)[0], dtype=tf.float32)
+
         with tf.variable_scope('train_scope') as train_scope:
             training_rnn_outputs, training_rnn_states = tf.nn.dynamic_rnn(cell=multi_layered_cell,
                                                                           inputs=training_input,
                                                                           sequence_length=sequence_lengths,
-                                                                          dtype=tf.float32)
+                                                                          initial_state=training_initial_state)
 
             # connect the dense layer to the RNN
             training_prediction_output = tf.layers.dense(
@@ -94,26 +99,90 @@ class StackingModelTester:
                                                                             inputs=testing_input,
                                                                             sequence_length=sequence_lengths,
                                                                             dtype=tf.float32)
-            # connect the dense layer to the RNN
+            # connect the dense layer only to the output at the last timestep of every sequence, since only the
+            # forecast of the last input window is used. Format [batch_size, output_size]
             inference_prediction_output = tf.layers.dense(
-                inputs=tf.convert_to_tensor(value=inference_rnn_outputs, dtype=tf.float32),
+                inputs=self.__last_output(inference_rnn_states),
                 units=self.__output_size,
                 use_bias=self.__use_bias, kernel_initializer=weight_initializer, name='dense_layer', reuse=True)
 
         # error that should be minimized in the training process
         error = self.__l1_loss(training_prediction_output, true_output)
 
-        # l2 regularization of the trainable model parameters
+        # l2 regularization of the trainable model parameters of this replica
         l2_loss = 0.0
         for var in tf.trainable_variables():
-            l2_loss += tf.nn.l2_loss(var)
+            if var not in existing_variables:
+                l2_loss += tf.nn.l2_loss(var)
 
         l2_loss = tf.multiply(tf.cast(l2_regularization, dtype=tf.float64), tf.cast(l2_loss, dtype=tf.float64))
 
         total_loss = tf.cast(error, dtype=tf.float64) + l2_loss
 
+        return training_initial_state, training_rnn_states, inference_prediction_output, total_loss
+
+    # Training the time series
+    def test_model(self, **kwargs):
+
+        # extract the parameters from the kwargs
+        num_hidden_layers = kwargs['num_hidden_layers']
+        cell_dimension = kwargs['cell_dimension']
+        minibatch_size = kwargs['minibatch_size']
+        max_epoch_size = kwargs['max_epoch_size']
+        max_num_epochs = kwargs['max_num_epochs']
+        l2_regularization = kwargs['l2_regularization']
+        gaussian_noise_stdev = kwargs['gaussian_noise_stdev']
+        optimizer_fn = kwargs['optimizer_fn']
+        export_directory = kwargs.get('export_directory')
+        random_normal_initializer_stdev = kwargs['random_normal_initializer_stdev']
+        tbptt_chunk_length = int(kwargs.get('tbptt_chunk_length', 0))
+        if self.__with_truncated_backpropagation and tbptt_chunk_length < 1:
+            raise ValueError("Truncated backpropagation requires a tbptt_chunk_length of 1 or more, got {}".format(
+                tbptt_chunk_length))
+
+        # reset the tensorflow graph
+        tf.reset_default_graph()
+
+        tf.set_random_seed(self.__seed)
+
+        # declare the input and output placeholders
+        input = tf.placeholder(dtype=tf.float32, shape=[None, None, self.__input_size])
+
+        # output format [batch_size, sequence_length, dimension]
+        true_output = tf.placeholder(dtype=tf.float32, shape=[None, None, self.__output_size])
+        sequence_lengths = tf.placeholder(dtype=tf.int64, shape=[None])
+
+        # build a replica of the model per ensemble seed. The replicas are initialized independently, share the
+        # input pipeline and are trained and applied together in the same session runs
+        training_initial_states = []
+        training_rnn_states = []
+        inference_prediction_outputs = []
+        total_losses = []
+        for replica_index, replica_seed in enumerate(self.__ensemble_seeds):
+            with ensemble_replica_scope(replica_index, self.__ensemble_size, replica_seed):
+                training_initial_state, training_rnn_state, inference_prediction_output, total_loss = \
+                    self.__build_model(input, true_output, sequence_lengths, num_hidden_layers, cell_dimension,
+                                       l2_regularization, gaussian_noise_stdev, random_normal_initializer_stdev)
+            training_initial_states.append(training_initial_state)
+            training_rnn_states.append(training_rnn_state)
+            inference_prediction_outputs.append(inference_prediction_output)
+            total_losses.append(total_loss)
+
+        # the replicas do not share any variables, so the gradient of the sum is the gradient of each replica
+        total_loss = tf.add_n(total_losses)
+
+        # forecasts of all the replicas in the format [ensemble_size, batch_size, output_size], also the forecasts of
+        # the exported model
+        inference_prediction_output = tf.stack(inference_prediction_outputs, axis=0)
+        export_forecasts = inference_prediction_output
+
+        # scale of the learning rate, fed by the cyclic learning rate schedule of the snapshot ensembles
+        learning_rate_scale = tf.placeholder_with_default(1.0, shape=[])
+        model_variables = tf.global_variables()
+
         # create the adagrad optimizer
-        optimizer = optimizer_fn(total_loss)
+        optimizer = optimizer_fn(total_loss, learning_rate_scale)
+        optimizer_reset_op = create_optimizer_reset_op(model_variables)
 
         # create the Dataset objects for the training and test data
         training_dataset = tf.data.TFRecordDataset(filenames=[self.__binary_train_file_path], compression_type="ZLIB")
@@ -131,12 +200,23 @@ class StackingModelTester:
         training_dataset = training_dataset.repeat(count=int(max_epoch_size))
         training_dataset = training_dataset.map(tfrecord_reader.validation_data_parser)
 
-        # create the batches by padding the datasets to make the variable sequence lengths fixed within the individual batches
-        padded_training_data_batches = training_dataset.padded_batch(batch_size=int(minibatch_size),
-                                                                     padded_shapes=(
-                                                                         [], [tf.Dimension(None), self.__input_size],
-                                                                         [tf.Dimension(None), self.__output_size],
-                                                                         [tf.Dimension(None), self.__meta_data_size]))
+        if self.__window_sampling_length > 0:
+            tfrecord_reader.report_window_sampling(self.__binary_train_file_path, self.__window_sampling_length)
+
+            # dense batches of the subsequences sampled across the series, of the same shape in every step
+            training_dataset = training_dataset.flat_map(
+                tfrecord_reader.window_sampler(self.__window_sampling_length))
+            training_dataset = training_dataset.shuffle(buffer_size=training_data_configs.SHUFFLE_BUFFER_SIZE,
+                                                        seed=shuffle_seed)
+            padded_training_data_batches = training_dataset.batch(batch_size=int(minibatch_size),
+                                                                  drop_remainder=True)
+        else:
+            # create the batches by padding the datasets to make the variable sequence lengths fixed within the individual batches
+            padded_training_data_batches = training_dataset.padded_batch(batch_size=int(minibatch_size),
+                                                                         padded_shapes=(
+                                                                             [], [tf.Dimension(None), self.__input_size],
+                                                                             [tf.Dimension(None), self.__output_size],
+                                                                             [tf.Dimension(None), self.__meta_data_size]))
 
         # get an iterator to the batches
         training_data_batch_iterator = padded_training_data_batches.make_initializable_iterator()
@@ -153,59 +233,123 @@ class StackingModelTester:
                                                                           [tf.Dimension(None), self.__meta_data_size]))
 
         # get an iterator to the test input data batch
-        test_input_iterator = padded_test_input_data.make_one_shot_iterator()
+        test_input_iterator = padded_test_input_data.make_initializable_iterator()
 
         # access the test input batch using the iterator
         test_input_data_batch = test_input_iterator.get_next()
 
+        # checkpoint of the training progress to resume an interrupted run
+        checkpoint = TrainingCheckpoint(kwargs.get('checkpoint_directory'))
+
         # setup variable initialization
         init_op = tf.global_variables_initializer()
 
-        # define the GPU options
-        gpu_options = tf.GPUOptions(allow_growth=True)
+        # the training run is divided into one learning rate cycle per snapshot
+        cycle_length = snapshot_cycle_length(max_num_epochs, self.__snapshot_ensemble_size)
 
-        with tf.Session(
-                config=tf.ConfigProto(log_device_placement=gpu_configs.log_device_placement, allow_soft_placement=True,
-                                      gpu_options=gpu_options)) as session:
+        with tf.Session(config=create_session_config()) as session:
             session.run(init_op)
+            first_epoch = checkpoint.restore(session)
 
-            for epoch in range(int(max_num_epochs)):
+            # applying the model to the test data
+            def forecast_test_data():
+                session.run(test_input_iterator.initializer)
+
+                ensemble_forecasts = [[] for _ in range(self.__ensemble_size)]
+                while True:
+                    try:
+
+                        # get the batch of test inputs
+                        test_input_batch_value = session.run(test_input_data_batch)
+
+                        # get the forecasts of all the replicas for the test input data batch
+                        forecasts = session.run(inference_prediction_output,
+                                                feed_dict={input: test_input_batch_value[1],
+                                                           sequence_lengths: test_input_batch_value[0]})
+                        for replica_index in range(self.__ensemble_size):
+                            ensemble_forecasts[replica_index].extend(forecasts[replica_index].tolist())
+
+                    except tf.errors.OutOfRangeError:
+                        break
+
+                return ensemble_forecasts
+
+            # the forecasts of every snapshot of every replica
+            snapshot_forecasts = [[] for _ in range(self.__ensemble_size)]
+            for forecasts in checkpoint.load_snapshot_forecasts(first_epoch // cycle_length):
+                for replica_index, replica_forecasts in enumerate(forecasts):
+                    snapshot_forecasts[replica_index].append(replica_forecasts)
+            steps_per_epoch = None
+
+            for epoch in range(first_epoch, cycle_length * self.__snapshot_ensemble_size):
                 print("Epoch->", epoch)
+
+                # restart the optimizer at the start of every new learning rate cycle
+                if epoch > 0 and epoch % cycle_length == 0:
+                    session.run(optimizer_reset_op)
+
                 session.run(training_data_batch_iterator.initializer, feed_dict={shuffle_seed: epoch})
+                step = 0
                 while True:
                     try:
                         training_data_batch_value = session.run(next_training_data_batch,
                                                                 feed_dict={shuffle_seed: epoch})
 
-                        session.run(optimizer,
-                                    feed_dict={input: training_data_batch_value[1],
-                                               true_output: training_data_batch_value[2],
-                                               sequence_lengths: training_data_batch_value[0]})
+                        learning_rate_feed_dict = {}
+                        if self.__snapshot_ensemble_size > 1:
+                            learning_rate_feed_dict[learning_rate_scale] = cyclic_learning_rate_scale(
+                                epoch, step, steps_per_epoch, cycle_length)
+
+                        if self.__with_truncated_backpropagation:
+                            # train on consecutive chunks of the sequences and carry the RNN state across the chunks
+                            training_state_value = None
+                            for chunk_start in range(0, np.shape(training_data_batch_value[1])[1], tbptt_chunk_length):
+                                chunk_end = chunk_start + tbptt_chunk_length
+                                chunk_feed_dict = {input: training_data_batch_value[1][:, chunk_start:chunk_end],
+                                                   true_output: training_data_batch_value[2][:, chunk_start:chunk_end],
+                                                   sequence_lengths: np.clip(training_data_batch_value[0] - chunk_start,
+                                                                             0, tbptt_chunk_length)}
+                                chunk_feed_dict.update(learning_rate_feed_dict)
+                                if training_state_value is not None:
+                                    chunk_feed_dict.update(zip(nest.flatten(training_initial_states),
+                                                               nest.flatten(training_state_value)))
+
+                                _, training_state_value = session.run([optimizer, training_rnn_states],
+                                                                      feed_dict=chunk_feed_dict)
+                        else:
+                            training_feed_dict = {input: training_data_batch_value[1],
+                                                  true_output: training_data_batch_value[2],
+                                                  sequence_lengths: training_data_batch_value[0]}
+                            training_feed_dict.update(learning_rate_feed_dict)
+                            session.run(optimizer, feed_dict=training_feed_dict)
+
+                        step += 1
 
                     except tf.errors.OutOfRangeError:
                         break
+                steps_per_epoch = step
 
-            # applying the model to the test data
+                # take a snapshot of the forecasts at the end of every learning rate cycle
+                if (epoch + 1) % cycle_length == 0:
+                    forecasts = forecast_test_data()
+                    checkpoint.save_snapshot_forecasts(epoch // cycle_length, forecasts)
+                    for replica_index, replica_forecasts in enumerate(forecasts):
+                        snapshot_forecasts[replica_index].append(replica_forecasts)
 
-            list_of_forecasts = []
-            while True:
-                try:
+                checkpoint.save(session, epoch + 1)
 
-                    # get the batch of test inputs
-                    test_input_batch_value = session.run(test_input_data_batch)
-
-                    # get the output of the network for the test input data batch
-                    test_output = session.run(inference_prediction_output,
-                                              feed_dict={input: test_input_batch_value[1],
-                                                         sequence_lengths: test_input_batch_value[0]})
-
-                    last_output_index = test_input_batch_value[0] - 1
-                    array_first_dimension = np.array(range(0, test_input_batch_value[0].shape[0]))
-                    forecasts = test_output[array_first_dimension, last_output_index]
-                    list_of_forecasts.extend(forecasts.tolist())
-
-                except tf.errors.OutOfRangeError:
-                    break
+            # export the trained inference subgraph and its weights to forecast without retraining
+            if export_directory:
+                export_model(session, export_directory,
+                             inputs={'input': input, 'sequence_length': sequence_lengths},
+                             outputs={'forecasts': export_forecasts})
 
             session.close()
-            return list_of_forecasts
+
+            # the forecasts of the single model or a list of forecasts per ensemble member
+            # the members are ordered by the replica and then by the snapshot
+            ensemble_member_forecasts = [forecasts for replica_forecasts in snapshot_forecasts
+                                         for forecasts in replica_forecasts]
+            if len(ensemble_member_forecasts) == 1:
+                return ensemble_member_forecasts[0]
+            return ensemble_member_forecasts
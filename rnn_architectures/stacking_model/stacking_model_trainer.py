@@ -1,9 +1,12 @@
 import numpy as np
 import tensorflow as tf
+from tensorflow.python.util import nest
 from tfrecords_handler.moving_window.tfrecord_reader import TFRecordReader
 from configs.global_configs import model_training_configs
 from configs.global_configs import training_data_configs
-from configs.global_configs import gpu_configs
+from utility_scripts.session_configs import create_session_config, StepTimer
+from utility_scripts.training_checkpoints import TrainingCheckpoint
+from utility_scripts.validation_metrics import ValidationMetricsAccumulator, ValidationErrorGraph
 
 class StackingModelTrainer:
 
@@ -19,7 +22,14 @@ class StackingModelTrainer:
         self.__integer_conversion = kwargs["integer_conversion"]
         self.__seed = kwargs["seed"]
         self.__cell_type = kwargs["cell_type"]
+        # the number of windows of the subsequences sampled for the training, 0 to train on the whole series
+        self.__window_sampling_length = kwargs.get("window_sampling_length", 0)
         self.__without_stl_decomposition = kwargs["without_stl_decomposition"]
+        # the MASE scaling of every validation series, to report the validation MASE
+        self.__mase_scales = kwargs.get("mase_scales")
+        # whether to calculate the validation errors inside the graph instead of fetching the forecasts
+        self.__in_graph_validation_metrics = kwargs.get("in_graph_validation_metrics", False)
+        self.__with_truncated_backpropagation = kwargs["with_truncated_backpropagation"]
 
         # define the metadata size based on the usage of stl decomposition
         if self.__without_stl_decomposition:
@@ -31,6 +41,14 @@ class StackingModelTrainer:
         loss = tf.reduce_mean(tf.abs(t - z))
         return loss
 
+    # the output of the RNN at the last timestep of every sequence, which is the hidden state of the last layer in the
+    # final state since the dynamic_rnn keeps the state unchanged after the end of a sequence
+    def __last_output(self, rnn_states):
+        last_layer_state = rnn_states[-1]
+        if isinstance(last_layer_state, tf.nn.rnn_cell.LSTMStateTuple):
+            return last_layer_state.h
+        return last_layer_state
+
     def __l2_loss(self, z, t):
         loss = tf.losses.mean_squared_error(labels=t, predictions=z)
         return loss
@@ -48,6 +66,10 @@ class StackingModelTrainer:
         gaussian_noise_stdev = kwargs['gaussian_noise_stdev']
         optimizer_fn = kwargs['optimizer_fn']
         random_normal_initializer_stdev = kwargs['random_normal_initializer_stdev']
+        tbptt_chunk_length = int(kwargs.get('tbptt_chunk_length', 0))
+        if self.__with_truncated_backpropagation and tbptt_chunk_length < 1:
+            raise ValueError("Truncated backpropagation requires a tbptt_chunk_length of 1 or more, got {}".format(
+                tbptt_chunk_length))
 
         tf.reset_default_graph()
 
@@ -81,11 +103,14 @@ class StackingModelTrainer:
 
         multi_layered_cell = tf.nn.rnn_cell.MultiRNNCell(cells=[cell() for _ in range(int(num_hidden_layers))])
 
+        # initial state of the training RNN. With truncated backpropagation, the final state of the previous chunk is fed here
+        training_initial_state = multi_layered_cell.zero_state(batch_size=tf.shape(training_input)[0], dtype=tf.float32)
+
         with tf.variable_scope('train_scope') as train_scope:
             training_rnn_outputs, training_rnn_states = tf.nn.dynamic_rnn(cell=multi_layered_cell,
                                                                           inputs=training_input,
                                                                           sequence_length=sequence_lengths,
-                                                                          dtype=tf.float32)
+                                                                          initial_state=training_initial_state)
 
             # connect the dense layer to the RNN
             training_prediction_output = tf.layers.dense(
@@ -93,16 +118,23 @@ class StackingModelTrainer:
                 units=self.__output_size,
                 use_bias=self.__use_bias, kernel_initializer=weight_initializer, name='dense_layer')
 
-        with tf.variable_scope(train_scope, reuse=tf.AUTO_REUSE) as inference_scope:
-            inference_rnn_outputs, inference_rnn_states = tf.nn.dynamic_rnn(cell=multi_layered_cell,
-                                                                            inputs=validation_input,
-                                                                            sequence_length=sequence_lengths,
-                                                                            dtype=tf.float32)
-            # connect the dense layer to the RNN
-            inference_prediction_output = tf.layers.dense(
-                inputs=tf.convert_to_tensor(value=inference_rnn_outputs, dtype=tf.float32),
-                units=self.__output_size,
-                use_bias=self.__use_bias, kernel_initializer=weight_initializer, name='dense_layer', reuse=True)
+        # the inference network on the given inputs, sharing the variables of the training network
+        def inference(validation_input, sequence_lengths):
+            with tf.variable_scope(train_scope, reuse=tf.AUTO_REUSE) as inference_scope:
+                inference_rnn_outputs, inference_rnn_states = tf.nn.dynamic_rnn(cell=multi_layered_cell,
+                                                                                inputs=validation_input,
+                                                                                sequence_length=sequence_lengths,
+                                                                                dtype=tf.float32)
+                # connect the dense layer only to the output at the last timestep of every sequence, since only the
+                # forecast of the last input window is used. Format [batch_size, output_size]
+                inference_prediction_output = tf.layers.dense(
+                    inputs=self.__last_output(inference_rnn_states),
+                    units=self.__output_size,
+                    use_bias=self.__use_bias, kernel_initializer=weight_initializer, name='dense_layer', reuse=True)
+
+            return inference_prediction_output
+
+        inference_prediction_output = inference(validation_input, sequence_lengths)
 
         error = self.__l1_loss(training_prediction_output, true_output)
 
@@ -142,8 +174,19 @@ class StackingModelTrainer:
 
         training_dataset = training_dataset.map(tfrecord_reader.train_data_parser)
 
-        padded_training_data_batches = training_dataset.padded_batch(batch_size=int(minibatch_size),
-                                                                     padded_shapes=train_padded_shapes)
+        if self.__window_sampling_length > 0:
+            tfrecord_reader.report_window_sampling(self.__binary_train_file_path, self.__window_sampling_length)
+
+            # dense batches of the subsequences sampled across the series, of the same shape in every step
+            training_dataset = training_dataset.flat_map(
+                tfrecord_reader.window_sampler(self.__window_sampling_length))
+            training_dataset = training_dataset.shuffle(buffer_size=training_data_configs.SHUFFLE_BUFFER_SIZE,
+                                                        seed=shuffle_seed)
+            padded_training_data_batches = training_dataset.batch(batch_size=int(minibatch_size),
+                                                                  drop_remainder=True)
+        else:
+            padded_training_data_batches = training_dataset.padded_batch(batch_size=int(minibatch_size),
+                                                                         padded_shapes=train_padded_shapes)
 
         training_data_batch_iterator = padded_training_data_batches.make_initializable_iterator()
         next_training_data_batch = training_data_batch_iterator.get_next()
@@ -161,20 +204,34 @@ class StackingModelTrainer:
         # access the validation data using the iterator
         next_validation_data_batch = validation_data_iterator.get_next()
 
+        # the errors of the validation series calculated inside the graph, with the inference network applied directly
+        # to the validation batches of the iterator
+        if self.__in_graph_validation_metrics:
+            validation_error_graph = ValidationErrorGraph(
+                inference(next_validation_data_batch[1], next_validation_data_batch[0]), next_validation_data_batch,
+                moving_window=True,
+                contain_zero_values=self.__contain_zero_values,
+                integer_conversion=self.__integer_conversion,
+                without_stl_decomposition=self.__without_stl_decomposition)
+
+        # checkpoint of the training progress to resume an interrupted run
+        checkpoint = TrainingCheckpoint(kwargs.get('checkpoint_directory'))
+
         # setup variable initialization
         init_op = tf.global_variables_initializer()
 
-        # define the GPU options
-        gpu_options = tf.GPUOptions(allow_growth=True)
-
-        with tf.Session(
-                config=tf.ConfigProto(log_device_placement=gpu_configs.log_device_placement, allow_soft_placement=True,
-                                      gpu_options=gpu_options)) as session:
+        with tf.Session(config=create_session_config()) as session:
             session.run(init_op)
+            first_epoch = checkpoint.restore(session)
+            step_timer = StepTimer()
 
             smape_final = 0.0
-            smape_list = []
-            for epoch in range(int(max_num_epochs)):
+            validation_metrics = ValidationMetricsAccumulator(moving_window=True,
+                                                              contain_zero_values=self.__contain_zero_values,
+                                                              integer_conversion=self.__integer_conversion,
+                                                              without_stl_decomposition=self.__without_stl_decomposition,
+                                                              mase_scales=self.__mase_scales)
+            for epoch in range(first_epoch, int(max_num_epochs)):
                 print("Epoch->", epoch)
 
                 session.run(training_data_batch_iterator.initializer, feed_dict={
@@ -186,87 +243,70 @@ class StackingModelTrainer:
                         training_data_batch_value = session.run(next_training_data_batch,
                                                                 feed_dict={shuffle_seed: epoch})
 
-                        _, total_loss_value = session.run([optimizer, total_loss],
-                                    feed_dict={training_input: training_data_batch_value[1],
-                                               true_output: training_data_batch_value[2],
-                                               sequence_lengths: training_data_batch_value[0]})
+                        if self.__with_truncated_backpropagation:
+                            # train on consecutive chunks of the sequences and carry the RNN state across the chunks
+                            training_state_value = None
+                            for chunk_start in range(0, np.shape(training_data_batch_value[1])[1], tbptt_chunk_length):
+                                chunk_end = chunk_start + tbptt_chunk_length
+                                chunk_feed_dict = {training_input: training_data_batch_value[1][:, chunk_start:chunk_end],
+                                                   true_output: training_data_batch_value[2][:, chunk_start:chunk_end],
+                                                   sequence_lengths: np.clip(training_data_batch_value[0] - chunk_start,
+                                                                             0, tbptt_chunk_length)}
+                                if training_state_value is not None:
+                                    chunk_feed_dict.update(zip(nest.flatten(training_initial_state),
+                                                               nest.flatten(training_state_value)))
+
+                                step_timer.start()
+                                _, total_loss_value, training_state_value = session.run(
+                                    [optimizer, total_loss, training_rnn_states], feed_dict=chunk_feed_dict)
+                                step_timer.stop(np.shape(chunk_feed_dict[training_input]))
+                        else:
+                            step_timer.start()
+                            _, total_loss_value = session.run([optimizer, total_loss],
+                                        feed_dict={training_input: training_data_batch_value[1],
+                                                   true_output: training_data_batch_value[2],
+                                                   sequence_lengths: training_data_batch_value[0]})
+                            step_timer.stop(np.shape(training_data_batch_value[1]))
 
                     except tf.errors.OutOfRangeError:
                         break
 
+                checkpoint.save(session, epoch + 1)
+
+            step_timer.report()
+
             session.run(
                 validation_data_iterator.initializer)  # initialize the iterator to the beginning of the training dataset
 
             while True:
                 try:
 
-                    # get the batch of validation inputs
-                    validation_data_batch_value = session.run(next_validation_data_batch)
-
-                    # get the output of the network for the validation input data batch
-                    validation_output = session.run(inference_prediction_output,
-                                                    feed_dict={input: validation_data_batch_value[1],
-                                                               sequence_lengths: validation_data_batch_value[0]
-                                                               })
-                    # calculate the smape for the validation data using vectorization
-
-                    # convert the data to remove the preprocessing
-                    last_indices = validation_data_batch_value[0] - 1
-                    array_first_dimension = np.array(range(0, validation_data_batch_value[0].shape[0]))
-
-                    true_seasonality_values = validation_data_batch_value[3][array_first_dimension,
-                                              last_indices, 1:]
-
-                    level_values = validation_data_batch_value[3][array_first_dimension, last_indices, 0]
-
-                    lambda_val = -0.7
-                    last_validation_outputs = validation_output[array_first_dimension, last_indices]
-                    actual_values = validation_data_batch_value[2][array_first_dimension, last_indices, :]
-
-                    if self.__without_stl_decomposition:
-                        converted_validation_output = np.exp(last_validation_outputs)
-                        converted_actual_values = np.exp(actual_values)
-
-                    else:
-                        converted_validation_output = np.exp(
-                            true_seasonality_values + level_values[:, np.newaxis] + last_validation_outputs)
-                        converted_actual_values = np.exp(true_seasonality_values + level_values[:, np.newaxis] + actual_values)
-
-                    if self.__contain_zero_values:  # to compensate for 0 values in data
-                        converted_validation_output = converted_validation_output - 1
-                        converted_actual_values = converted_actual_values - 1
-
-                    if self.__without_stl_decomposition:
-                        converted_validation_output = converted_validation_output * level_values[:, np.newaxis]
-                        converted_actual_values = converted_actual_values * level_values[:, np.newaxis]
-
-                    if self.__integer_conversion:
-                        converted_validation_output = np.round(converted_validation_output)
-                        converted_actual_values = np.round(converted_actual_values)
-
-                    converted_validation_output[converted_validation_output < 0] = 0
-                    converted_actual_values[converted_actual_values < 0] = 0
-
-                    if self.__address_near_zero_instability:
-                        # calculate the smape
-                        epsilon = 0.1
-                        sum = np.maximum(np.abs(converted_validation_output) + np.abs(converted_actual_values) + epsilon, 0.5 + epsilon)
-                        smape_values = (np.abs(converted_validation_output - converted_actual_values) /
-                                        sum) * 2
-                        smape_values_per_series = np.mean(smape_values, axis=1)
-                        smape_list.extend(smape_values_per_series)
+                    if self.__in_graph_validation_metrics:
+                        # the validation batch is read and evaluated inside the graph, and only the errors of its
+                        # series are fetched
+                        validation_metrics.add_errors(session.run(validation_error_graph.errors))
                     else:
-                        # calculate the smape
-                        smape_values = (np.abs(converted_validation_output - converted_actual_values) /
-                                        (np.abs(converted_validation_output) + np.abs(converted_actual_values))) * 2
-                        smape_values_per_series = np.mean(smape_values, axis=1)
-                        smape_list.extend(smape_values_per_series)
+                        # get the batch of validation inputs
+                        validation_data_batch_value = session.run(next_validation_data_batch)
+
+                        # get the output of the network for the validation input data batch
+                        validation_output = session.run(inference_prediction_output,
+                                                        feed_dict={input: validation_data_batch_value[1],
+                                                                   sequence_lengths: validation_data_batch_value[0]
+                                                                   })
+                        # accumulate the errors of the series of the batch
+                        validation_metrics.add_batch(validation_output, validation_data_batch_value[0],
+                                                     validation_data_batch_value[2], validation_data_batch_value[3])
 
                 except tf.errors.OutOfRangeError:
                     break
 
+            smape_list = validation_metrics.smape(self.__address_near_zero_instability).tolist()
             smape_final = np.mean(smape_list)
             print("SMAPE value: {}".format(smape_final))
+            mase_values = validation_metrics.mase()
+            if mase_values is not None:
+                print("MASE value: {}".format(np.mean(mase_values)))
             session.close()
 
         return float(smape_final), smape_list
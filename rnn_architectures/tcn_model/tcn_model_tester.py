@@ -0,0 +1,326 @@
+import tensorflow as tf
+from tfrecords_handler.moving_window.tfrecord_reader import TFRecordReader as MovingWindowTFRecordReader
+from tfrecords_handler.non_moving_window.tfrecord_reader import TFRecordReader as NonMovingWindowTFRecordReader
+from configs.global_configs import training_data_configs
+from configs.global_configs import tcn_configs
+from utility_scripts.session_configs import create_session_config
+from utility_scripts.training_checkpoints import TrainingCheckpoint
+from utility_scripts.model_export import export_model
+from utility_scripts.ensemble_scopes import ensemble_replica_scope, replica_weight_initializer
+from utility_scripts.snapshot_ensembles import snapshot_cycle_length, cyclic_learning_rate_scale, \
+    create_optimizer_reset_op
+from rnn_architectures.tcn_model.temporal_convolutional_network import temporal_convolutional_network, \
+    receptive_field, last_timestep_outputs
+
+
+class TCNModelTester:
+
+    def __init__(self, **kwargs):
+        self.__use_bias = kwargs["use_bias"]
+        self.__input_size = kwargs["input_size"]
+        self.__output_size = kwargs["output_size"]
+        self.__binary_train_file_path = kwargs["binary_train_file_path"]
+        self.__binary_test_file_path = kwargs["binary_test_file_path"]
+        self.__seed = kwargs["seed"]
+        self.__moving_window = kwargs["input_format"] == "moving_window"
+        # the number of windows of the subsequences sampled for the training, 0 to train on the whole series
+        self.__window_sampling_length = kwargs.get("window_sampling_length", 0)
+        self.__without_stl_decomposition = kwargs["without_stl_decomposition"]
+        self.__ensemble_size = kwargs.get("ensemble_size", 1)
+        # the seeds of the replicas of the ensemble
+        self.__ensemble_seeds = kwargs.get("ensemble_seeds", [self.__seed])
+        self.__snapshot_ensemble_size = kwargs.get("snapshot_ensemble_size", 1)
+
+        # the series of the non moving window format are not divided into windows
+        if not self.__moving_window:
+            self.__input_size = 1
+
+        # define the metadata size based on the usage of stl decomposition
+        if self.__without_stl_decomposition:
+            self.__meta_data_size = 1
+        else:
+            self.__meta_data_size = self.__output_size + 1
+
+    def __l1_loss(self, z, t):
+        loss = tf.reduce_mean(tf.abs(t - z))
+        return loss
+
+    # build one replica of the model under the current variable scope
+    def __build_model(self, input, true_output, sequence_lengths, num_hidden_layers, cell_dimension, kernel_size,
+                      l2_regularization, gaussian_noise_stdev, random_normal_initializer_stdev):
+        noise = tf.random_normal(shape=tf.shape(input), mean=0.0, stddev=gaussian_noise_stdev, dtype=tf.float32)
+        training_input = input + noise
+
+        testing_input = input
+
+        weight_initializer = replica_weight_initializer(random_normal_initializer_stdev, self.__ensemble_size)
+
+        # the variables created before this replica belong to the other replicas
+        existing_variables = set(tf.trainable_variables())
+
+        with tf.variable_scope('train_scope') as train_scope:
+            training_network_outputs = temporal_convolutional_network(training_input, int(num_hidden_layers),
+                                                                      int(cell_dimension), kernel_size,
+                                                                      weight_initializer)
+            if not self.__moving_window:
+                training_network_outputs = last_timestep_outputs(training_network_outputs, sequence_lengths)
+
+            # connect the dense layer to the network
+            training_prediction_output = tf.layers.dense(
+                inputs=training_network_outputs, units=self.__output_size,
+                use_bias=self.__use_bias, kernel_initializer=weight_initializer, name='dense_layer')
+
+        with tf.variable_scope(train_scope, reuse=tf.AUTO_REUSE):
+            inference_network_outputs = temporal_convolutional_network(testing_input, int(num_hidden_layers),
+                                                                       int(cell_dimension), kernel_size,
+                                                                       weight_initializer)
+
+            # connect the dense layer only to the output at the last timestep of every sequence, since only the
+            # forecast of the last input is used. Format [batch_size, output_size]
+            inference_prediction_output = tf.layers.dense(
+                inputs=last_timestep_outputs(inference_network_outputs, sequence_lengths), units=self.__output_size,
+                use_bias=self.__use_bias, kernel_initializer=weight_initializer, name='dense_layer', reuse=True)
+
+        # error that should be minimized in the training process
+        if self.__moving_window:
+            # unlike the RNN outputs, the outputs of the padded windows are not zero, so they are left out of the error
+            error_mask = tf.expand_dims(tf.sequence_mask(sequence_lengths, maxlen=tf.shape(input)[1],
+                                                         dtype=tf.float32), axis=2)
+            error = tf.reduce_sum(tf.abs(true_output - training_prediction_output) * error_mask) / (
+                    tf.reduce_sum(error_mask) * self.__output_size)
+        else:
+            error = self.__l1_loss(training_prediction_output, tf.squeeze(true_output, axis=2))
+
+        # l2 regularization of the trainable model parameters of this replica
+        l2_loss = 0.0
+        for var in tf.trainable_variables():
+            if var not in existing_variables:
+                l2_loss += tf.nn.l2_loss(var)
+
+        l2_loss = tf.multiply(tf.cast(l2_regularization, dtype=tf.float64), tf.cast(l2_loss, dtype=tf.float64))
+
+        total_loss = tf.cast(error, dtype=tf.float64) + l2_loss
+
+        return inference_prediction_output, total_loss
+
+    # Training the time series
+    def test_model(self, **kwargs):
+
+        # extract the parameters from the kwargs
+        num_hidden_layers = kwargs['num_hidden_layers']
+        cell_dimension = kwargs['cell_dimension']
+        minibatch_size = kwargs['minibatch_size']
+        max_epoch_size = kwargs['max_epoch_size']
+        max_num_epochs = kwargs['max_num_epochs']
+        l2_regularization = kwargs['l2_regularization']
+        gaussian_noise_stdev = kwargs['gaussian_noise_stdev']
+        optimizer_fn = kwargs['optimizer_fn']
+        export_directory = kwargs.get('export_directory')
+        random_normal_initializer_stdev = kwargs['random_normal_initializer_stdev']
+        kernel_size = int(kwargs.get('tcn_kernel_size', tcn_configs.KERNEL_SIZE))
+
+        # reset the tensorflow graph
+        tf.reset_default_graph()
+
+        tf.set_random_seed(self.__seed)
+
+        # declare the input and output placeholders
+        input = tf.placeholder(dtype=tf.float32, shape=[None, None, self.__input_size])
+
+        # output format [batch_size, sequence_length, dimension] for the moving window format and
+        # [batch_size, output_size, 1] for the non moving window format
+        if self.__moving_window:
+            true_output = tf.placeholder(dtype=tf.float32, shape=[None, None, self.__output_size])
+        else:
+            true_output = tf.placeholder(dtype=tf.float32, shape=[None, self.__output_size, 1])
+        sequence_lengths = tf.placeholder(dtype=tf.int64, shape=[None])
+
+        # build a replica of the model per ensemble seed. The replicas are initialized independently, share the
+        # input pipeline and are trained and applied together in the same session runs
+        inference_prediction_outputs = []
+        total_losses = []
+        for replica_index, replica_seed in enumerate(self.__ensemble_seeds):
+            with ensemble_replica_scope(replica_index, self.__ensemble_size, replica_seed):
+                inference_prediction_output, total_loss = \
+                    self.__build_model(input, true_output, sequence_lengths, num_hidden_layers, cell_dimension,
+                                       kernel_size, l2_regularization, gaussian_noise_stdev,
+                                       random_normal_initializer_stdev)
+            inference_prediction_outputs.append(inference_prediction_output)
+            total_losses.append(total_loss)
+
+        # the replicas do not share any variables, so the gradient of the sum is the gradient of each replica
+        total_loss = tf.add_n(total_losses)
+
+        # forecasts of all the replicas in the format [ensemble_size, batch_size, output_size], also the forecasts of
+        # the exported model
+        inference_prediction_output = tf.stack(inference_prediction_outputs, axis=0)
+        export_forecasts = inference_prediction_output
+
+        # scale of the learning rate, fed by the cyclic learning rate schedule of the snapshot ensembles
+        learning_rate_scale = tf.placeholder_with_default(1.0, shape=[])
+        model_variables = tf.global_variables()
+
+        # create the adagrad optimizer
+        optimizer = optimizer_fn(total_loss, learning_rate_scale)
+        optimizer_reset_op = create_optimizer_reset_op(model_variables)
+
+        # create the Dataset objects for the training and test data
+        training_dataset = tf.data.TFRecordDataset(filenames=[self.__binary_train_file_path], compression_type="ZLIB")
+        test_dataset = tf.data.TFRecordDataset([self.__binary_test_file_path], compression_type="ZLIB")
+
+        # parse the records and define the expected shapes of data after padding
+        if self.__moving_window:
+            tfrecord_reader = MovingWindowTFRecordReader(self.__input_size, self.__output_size, self.__meta_data_size)
+            train_padded_shapes = ([], [tf.Dimension(None), self.__input_size],
+                                   [tf.Dimension(None), self.__output_size],
+                                   [tf.Dimension(None), self.__meta_data_size])
+            test_padded_shapes = ([], [tf.Dimension(None), self.__input_size],
+                                  [tf.Dimension(None), self.__meta_data_size])
+        else:
+            tfrecord_reader = NonMovingWindowTFRecordReader()
+            train_padded_shapes = ([], [tf.Dimension(None), 1], [self.__output_size, 1], [self.__meta_data_size, 1])
+            test_padded_shapes = ([], [tf.Dimension(None), 1], [self.__meta_data_size, 1])
+
+        # the output at the last timestep only depends on the timesteps within the receptive field, so the series are
+        # trimmed to the receptive field wherever only the last output is used, which gives the same outputs
+        receptive_field_truncator = tfrecord_reader.lookback_truncator(
+            receptive_field(int(num_hidden_layers), kernel_size))
+
+        # prepare the training data into batches
+        # randomly shuffle the time series within the dataset
+        shuffle_seed = tf.placeholder(dtype=tf.int64, shape=[])
+        training_dataset = training_dataset.repeat(count=int(max_epoch_size))
+        training_dataset = training_dataset.map(tfrecord_reader.validation_data_parser)
+        if not self.__moving_window:
+            training_dataset = training_dataset.map(receptive_field_truncator)
+
+        if self.__moving_window and self.__window_sampling_length > 0:
+            tfrecord_reader.report_window_sampling(self.__binary_train_file_path, self.__window_sampling_length)
+
+            # dense batches of the subsequences sampled across the series, of the same shape in every step
+            training_dataset = training_dataset.flat_map(
+                tfrecord_reader.window_sampler(self.__window_sampling_length))
+            training_dataset = training_dataset.shuffle(buffer_size=training_data_configs.SHUFFLE_BUFFER_SIZE,
+                                                        seed=shuffle_seed)
+            padded_training_data_batches = training_dataset.batch(batch_size=int(minibatch_size),
+                                                                  drop_remainder=True)
+        else:
+            # create the batches by padding the datasets to make the variable sequence lengths fixed within the individual batches
+            padded_training_data_batches = training_dataset.padded_batch(batch_size=int(minibatch_size),
+                                                                         padded_shapes=train_padded_shapes)
+
+        # get an iterator to the batches
+        training_data_batch_iterator = padded_training_data_batches.make_initializable_iterator()
+
+        # access each batch using the iterator
+        next_training_data_batch = training_data_batch_iterator.get_next()
+
+        # preparing the test data
+        test_dataset = test_dataset.map(tfrecord_reader.test_data_parser)
+        test_dataset = test_dataset.map(receptive_field_truncator)
+
+        # create a single batch from all the test time series by padding the datasets to make the variable sequence lengths fixed
+        padded_test_input_data = test_dataset.padded_batch(batch_size=int(minibatch_size),
+                                                           padded_shapes=test_padded_shapes)
+
+        # get an iterator to the test input data batch
+        test_input_iterator = padded_test_input_data.make_initializable_iterator()
+
+        # access the test input batch using the iterator
+        test_input_data_batch = test_input_iterator.get_next()
+
+        # checkpoint of the training progress to resume an interrupted run
+        checkpoint = TrainingCheckpoint(kwargs.get('checkpoint_directory'))
+
+        # setup variable initialization
+        init_op = tf.global_variables_initializer()
+
+        # the training run is divided into one learning rate cycle per snapshot
+        cycle_length = snapshot_cycle_length(max_num_epochs, self.__snapshot_ensemble_size)
+
+        with tf.Session(config=create_session_config()) as session:
+            session.run(init_op)
+            first_epoch = checkpoint.restore(session)
+
+            # applying the model to the test data
+            def forecast_test_data():
+                session.run(test_input_iterator.initializer)
+
+                ensemble_forecasts = [[] for _ in range(self.__ensemble_size)]
+                while True:
+                    try:
+
+                        # get the batch of test inputs
+                        test_input_batch_value = session.run(test_input_data_batch)
+
+                        # get the forecasts of all the replicas for the test input data batch
+                        forecasts = session.run(inference_prediction_output,
+                                                feed_dict={input: test_input_batch_value[1],
+                                                           sequence_lengths: test_input_batch_value[0]})
+                        for replica_index in range(self.__ensemble_size):
+                            ensemble_forecasts[replica_index].extend(forecasts[replica_index].tolist())
+
+                    except tf.errors.OutOfRangeError:
+                        break
+
+                return ensemble_forecasts
+
+            # the forecasts of every snapshot of every replica
+            snapshot_forecasts = [[] for _ in range(self.__ensemble_size)]
+            for forecasts in checkpoint.load_snapshot_forecasts(first_epoch // cycle_length):
+                for replica_index, replica_forecasts in enumerate(forecasts):
+                    snapshot_forecasts[replica_index].append(replica_forecasts)
+            steps_per_epoch = None
+
+            for epoch in range(first_epoch, cycle_length * self.__snapshot_ensemble_size):
+                print("Epoch->", epoch)
+
+                # restart the optimizer at the start of every new learning rate cycle
+                if epoch > 0 and epoch % cycle_length == 0:
+                    session.run(optimizer_reset_op)
+
+                session.run(training_data_batch_iterator.initializer, feed_dict={shuffle_seed: epoch})
+                step = 0
+                while True:
+                    try:
+                        training_data_batch_value = session.run(next_training_data_batch,
+                                                                feed_dict={shuffle_seed: epoch})
+
+                        training_feed_dict = {input: training_data_batch_value[1],
+                                              true_output: training_data_batch_value[2],
+                                              sequence_lengths: training_data_batch_value[0]}
+                        if self.__snapshot_ensemble_size > 1:
+                            training_feed_dict[learning_rate_scale] = cyclic_learning_rate_scale(
+                                epoch, step, steps_per_epoch, cycle_length)
+                        session.run(optimizer, feed_dict=training_feed_dict)
+
+                        step += 1
+
+                    except tf.errors.OutOfRangeError:
+                        break
+                steps_per_epoch = step
+
+                # take a snapshot of the forecasts at the end of every learning rate cycle
+                if (epoch + 1) % cycle_length == 0:
+                    forecasts = forecast_test_data()
+                    checkpoint.save_snapshot_forecasts(epoch // cycle_length, forecasts)
+                    for replica_index, replica_forecasts in enumerate(forecasts):
+                        snapshot_forecasts[replica_index].append(replica_forecasts)
+
+                checkpoint.save(session, epoch + 1)
+
+            # export the trained inference subgraph and its weights to forecast without retraining
+            if export_directory:
+                export_model(session, export_directory,
+                             inputs={'input': input, 'sequence_length': sequence_lengths},
+                             outputs={'forecasts': export_forecasts})
+
+            session.close()
+
+            # the forecasts of the single model or a list of forecasts per ensemble member
+            # the members are ordered by the replica and then by the snapshot
+            ensemble_member_forecasts = [forecasts for replica_forecasts in snapshot_forecasts
+                                         for forecasts in replica_forecasts]
+            if len(ensemble_member_forecasts) == 1:
+                return ensemble_member_forecasts[0]
+            return ensemble_member_forecasts
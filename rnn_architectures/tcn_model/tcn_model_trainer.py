@@ -0,0 +1,286 @@
+import numpy as np
+import tensorflow as tf
+from tfrecords_handler.moving_window.tfrecord_reader import TFRecordReader as MovingWindowTFRecordReader
+from tfrecords_handler.non_moving_window.tfrecord_reader import TFRecordReader as NonMovingWindowTFRecordReader
+from configs.global_configs import training_data_configs
+from configs.global_configs import tcn_configs
+from utility_scripts.session_configs import create_session_config, StepTimer
+from utility_scripts.training_checkpoints import TrainingCheckpoint
+from utility_scripts.validation_metrics import ValidationMetricsAccumulator, ValidationErrorGraph
+from rnn_architectures.tcn_model.temporal_convolutional_network import temporal_convolutional_network, \
+    receptive_field, last_timestep_outputs
+
+
+# temporal convolutional network for both input formats
+# with the moving window format, the network forecasts the output window of every input window like the stacking model
+# with the non moving window format, the output at the last point is projected to the forecast horizon like the
+# seq2seq model with the dense layer
+class TCNModelTrainer:
+
+    def __init__(self, **kwargs):
+        self.__use_bias = kwargs["use_bias"]
+        self.__input_size = kwargs["input_size"]
+        self.__output_size = kwargs["output_size"]
+        self.__binary_train_file_path = kwargs["binary_train_file_path"]
+        self.__binary_validation_file_path = kwargs["binary_validation_file_path"]
+        self.__contain_zero_values = kwargs["contain_zero_values"]
+        self.__address_near_zero_instability = kwargs["address_near_zero_instability"]
+        self.__integer_conversion = kwargs["integer_conversion"]
+        self.__seed = kwargs["seed"]
+        self.__moving_window = kwargs["input_format"] == "moving_window"
+        # the number of windows of the subsequences sampled for the training, 0 to train on the whole series
+        self.__window_sampling_length = kwargs.get("window_sampling_length", 0)
+        self.__without_stl_decomposition = kwargs["without_stl_decomposition"]
+        # the MASE scaling of every validation series, to report the validation MASE
+        self.__mase_scales = kwargs.get("mase_scales")
+        # whether to calculate the validation errors inside the graph instead of fetching the forecasts
+        self.__in_graph_validation_metrics = kwargs.get("in_graph_validation_metrics", False)
+
+        # the series of the non moving window format are not divided into windows
+        if not self.__moving_window:
+            self.__input_size = 1
+
+        # define the metadata size based on the usage of stl decomposition
+        if self.__without_stl_decomposition:
+            self.__meta_data_size = 1
+        else:
+            self.__meta_data_size = self.__output_size + 1
+
+    def __l1_loss(self, z, t):
+        loss = tf.reduce_mean(tf.abs(t - z))
+        return loss
+
+    # Training the time series
+    def train_model(self, **kwargs):
+
+        # extract the parameters from the kwargs
+        num_hidden_layers = int(kwargs['num_hidden_layers'])
+        cell_dimension = int(kwargs['cell_dimension'])
+        minibatch_size = int(kwargs['minibatch_size'])
+        max_epoch_size = int(kwargs['max_epoch_size'])
+        max_num_epochs = int(kwargs['max_num_epochs'])
+        l2_regularization = kwargs['l2_regularization']
+        gaussian_noise_stdev = kwargs['gaussian_noise_stdev']
+        optimizer_fn = kwargs['optimizer_fn']
+        random_normal_initializer_stdev = kwargs['random_normal_initializer_stdev']
+        kernel_size = int(kwargs.get('tcn_kernel_size', tcn_configs.KERNEL_SIZE))
+
+        tf.reset_default_graph()
+
+        tf.set_random_seed(self.__seed)
+
+        # declare the input and output placeholders
+
+        # input format [batch_size, sequence_length, dimension]
+        input = tf.placeholder(dtype=tf.float32, shape=[None, None, self.__input_size])
+        noise = tf.random_normal(shape=tf.shape(input), mean=0.0, stddev=gaussian_noise_stdev, dtype=tf.float32)
+        training_input = input + noise
+
+        validation_input = input
+
+        # output format [batch_size, sequence_length, dimension] for the moving window format and
+        # [batch_size, output_size, 1] for the non moving window format
+        if self.__moving_window:
+            true_output = tf.placeholder(dtype=tf.float32, shape=[None, None, self.__output_size])
+        else:
+            true_output = tf.placeholder(dtype=tf.float32, shape=[None, self.__output_size, 1])
+        sequence_lengths = tf.placeholder(dtype=tf.int32, shape=[None])
+
+        weight_initializer = tf.truncated_normal_initializer(stddev=random_normal_initializer_stdev)
+
+        with tf.variable_scope('train_scope') as train_scope:
+            training_network_outputs = temporal_convolutional_network(training_input, num_hidden_layers,
+                                                                      cell_dimension, kernel_size, weight_initializer)
+            if not self.__moving_window:
+                training_network_outputs = last_timestep_outputs(training_network_outputs, sequence_lengths)
+
+            # connect the dense layer to the network
+            training_prediction_output = tf.layers.dense(
+                inputs=training_network_outputs, units=self.__output_size,
+                use_bias=self.__use_bias, kernel_initializer=weight_initializer, name='dense_layer')
+
+        # the inference network on the given inputs, sharing the variables of the training network
+        def inference(validation_input, sequence_lengths):
+            with tf.variable_scope(train_scope, reuse=tf.AUTO_REUSE):
+                inference_network_outputs = temporal_convolutional_network(validation_input, num_hidden_layers,
+                                                                           cell_dimension, kernel_size,
+                                                                           weight_initializer)
+
+                # connect the dense layer only to the output at the last timestep of every sequence, since only the
+                # forecast of the last input is used. Format [batch_size, output_size]
+                inference_prediction_output = tf.layers.dense(
+                    inputs=last_timestep_outputs(inference_network_outputs, sequence_lengths),
+                    units=self.__output_size, use_bias=self.__use_bias, kernel_initializer=weight_initializer,
+                    name='dense_layer', reuse=True)
+
+            return inference_prediction_output
+
+        inference_prediction_output = inference(validation_input, sequence_lengths)
+
+        if self.__moving_window:
+            # unlike the RNN outputs, the outputs of the padded windows are not zero, so they are left out of the error
+            error_mask = tf.expand_dims(tf.sequence_mask(sequence_lengths, maxlen=tf.shape(input)[1],
+                                                         dtype=tf.float32), axis=2)
+            error = tf.reduce_sum(tf.abs(true_output - training_prediction_output) * error_mask) / (
+                    tf.reduce_sum(error_mask) * self.__output_size)
+        else:
+            error = self.__l1_loss(training_prediction_output, tf.squeeze(true_output, axis=2))
+
+        # l2 regularization of the trainable model parameters
+        l2_loss = 0.0
+        for var in tf.trainable_variables():
+            l2_loss += tf.nn.l2_loss(var)
+
+        l2_loss = tf.multiply(tf.cast(l2_regularization, dtype=tf.float64), tf.cast(l2_loss, dtype=tf.float64))
+
+        total_loss = tf.cast(error, dtype=tf.float64) + l2_loss
+
+        # create the optimizer
+        optimizer = optimizer_fn(total_loss)
+
+        # create the training and validation datasets from the tfrecord files
+        training_dataset = tf.data.TFRecordDataset(filenames=[self.__binary_train_file_path], compression_type="ZLIB")
+        validation_dataset = tf.data.TFRecordDataset(filenames=[self.__binary_validation_file_path],
+                                                     compression_type="ZLIB")
+
+        # parse the records and define the expected shapes of data after padding
+        if self.__moving_window:
+            tfrecord_reader = MovingWindowTFRecordReader(self.__input_size, self.__output_size, self.__meta_data_size)
+            train_padded_shapes = ([], [tf.Dimension(None), self.__input_size],
+                                   [tf.Dimension(None), self.__output_size])
+            validation_padded_shapes = ([], [tf.Dimension(None), self.__input_size],
+                                        [tf.Dimension(None), self.__output_size],
+                                        [tf.Dimension(None), self.__meta_data_size])
+        else:
+            tfrecord_reader = NonMovingWindowTFRecordReader()
+            train_padded_shapes = ([], [tf.Dimension(None), 1], [self.__output_size, 1])
+            validation_padded_shapes = ([], [tf.Dimension(None), 1], [self.__output_size, 1],
+                                        [self.__meta_data_size, 1])
+
+        # the output at the last timestep only depends on the timesteps within the receptive field, so the series are
+        # trimmed to the receptive field wherever only the last output is used, which gives the same outputs
+        receptive_field_truncator = tfrecord_reader.lookback_truncator(receptive_field(num_hidden_layers, kernel_size))
+
+        # preparing the training data
+        shuffle_seed = tf.placeholder(dtype=tf.int64, shape=[])
+        training_dataset = training_dataset.repeat(count=int(max_epoch_size))
+        training_dataset = training_dataset.map(tfrecord_reader.train_data_parser)
+        if not self.__moving_window:
+            training_dataset = training_dataset.map(receptive_field_truncator)
+
+        if self.__moving_window and self.__window_sampling_length > 0:
+            tfrecord_reader.report_window_sampling(self.__binary_train_file_path, self.__window_sampling_length)
+
+            # dense batches of the subsequences sampled across the series, of the same shape in every step
+            training_dataset = training_dataset.flat_map(
+                tfrecord_reader.window_sampler(self.__window_sampling_length))
+            training_dataset = training_dataset.shuffle(buffer_size=training_data_configs.SHUFFLE_BUFFER_SIZE,
+                                                        seed=shuffle_seed)
+            padded_training_data_batches = training_dataset.batch(batch_size=int(minibatch_size),
+                                                                  drop_remainder=True)
+        else:
+            padded_training_data_batches = training_dataset.padded_batch(batch_size=int(minibatch_size),
+                                                                         padded_shapes=train_padded_shapes)
+
+        training_data_batch_iterator = padded_training_data_batches.make_initializable_iterator()
+        next_training_data_batch = training_data_batch_iterator.get_next()
+
+        # preparing the validation data
+        validation_dataset = validation_dataset.map(tfrecord_reader.validation_data_parser)
+        validation_dataset = validation_dataset.map(receptive_field_truncator)
+
+        # create the batches by padding the datasets to make the variable sequence lengths fixed
+        padded_validation_dataset = validation_dataset.padded_batch(batch_size=int(minibatch_size),
+                                                                    padded_shapes=validation_padded_shapes)
+
+        # get an iterator to the validation data
+        validation_data_iterator = padded_validation_dataset.make_initializable_iterator()
+
+        # access the validation data using the iterator
+        next_validation_data_batch = validation_data_iterator.get_next()
+
+        # the errors of the validation series calculated inside the graph, with the inference network applied directly
+        # to the validation batches of the iterator
+        if self.__in_graph_validation_metrics:
+            validation_error_graph = ValidationErrorGraph(
+                inference(next_validation_data_batch[1], tf.cast(next_validation_data_batch[0], dtype=tf.int32)),
+                next_validation_data_batch,
+                moving_window=self.__moving_window,
+                contain_zero_values=self.__contain_zero_values,
+                integer_conversion=self.__integer_conversion,
+                without_stl_decomposition=self.__without_stl_decomposition)
+
+        # checkpoint of the training progress to resume an interrupted run
+        checkpoint = TrainingCheckpoint(kwargs.get('checkpoint_directory'))
+
+        # setup variable initialization
+        init_op = tf.global_variables_initializer()
+
+        with tf.Session(config=create_session_config()) as session:
+            session.run(init_op)
+            first_epoch = checkpoint.restore(session)
+            step_timer = StepTimer()
+
+            smape_final = 0.0
+            validation_metrics = ValidationMetricsAccumulator(moving_window=self.__moving_window,
+                                                              contain_zero_values=self.__contain_zero_values,
+                                                              integer_conversion=self.__integer_conversion,
+                                                              without_stl_decomposition=self.__without_stl_decomposition,
+                                                              mase_scales=self.__mase_scales)
+            for epoch in range(first_epoch, max_num_epochs):
+                print("Epoch->", epoch)
+
+                session.run(training_data_batch_iterator.initializer, feed_dict={shuffle_seed: epoch})
+
+                while True:
+                    try:
+                        training_data_batch_value = session.run(next_training_data_batch,
+                                                                feed_dict={shuffle_seed: epoch})
+
+                        step_timer.start()
+                        _, total_loss_value = session.run([optimizer, total_loss],
+                                                          feed_dict={training_input: training_data_batch_value[1],
+                                                                     true_output: training_data_batch_value[2],
+                                                                     sequence_lengths: training_data_batch_value[0]})
+                        step_timer.stop(np.shape(training_data_batch_value[1]))
+
+                    except tf.errors.OutOfRangeError:
+                        break
+
+                checkpoint.save(session, epoch + 1)
+
+            step_timer.report()
+
+            session.run(validation_data_iterator.initializer)
+
+            while True:
+                try:
+                    if self.__in_graph_validation_metrics:
+                        # the validation batch is read and evaluated inside the graph, and only the errors of its
+                        # series are fetched
+                        validation_metrics.add_errors(session.run(validation_error_graph.errors))
+                    else:
+                        # get the batch of validation inputs
+                        validation_data_batch_value = session.run(next_validation_data_batch)
+
+                        # get the output of the network for the validation input data batch
+                        validation_output = session.run(inference_prediction_output,
+                                                        feed_dict={input: validation_data_batch_value[1],
+                                                                   sequence_lengths: validation_data_batch_value[0]})
+
+                        # accumulate the errors of the series of the batch
+                        validation_metrics.add_batch(validation_output, validation_data_batch_value[0],
+                                                     validation_data_batch_value[2], validation_data_batch_value[3])
+
+                except tf.errors.OutOfRangeError:
+                    break
+
+            smape_list = validation_metrics.smape(self.__address_near_zero_instability).tolist()
+            smape_final = np.mean(smape_list)
+            print("SMAPE value: {}".format(smape_final))
+            mase_values = validation_metrics.mase()
+            if mase_values is not None:
+                print("MASE value: {}".format(np.mean(mase_values)))
+            session.close()
+
+        return float(smape_final), smape_list
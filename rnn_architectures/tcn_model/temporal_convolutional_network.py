@@ -0,0 +1,37 @@
+import tensorflow as tf
+
+
+# the number of the last timesteps seen by the output of the network at a timestep
+def receptive_field(num_layers, kernel_size):
+    return 1 + (kernel_size - 1) * (2 ** num_layers - 1)
+
+
+# a stack of residual blocks of dilated causal convolutions, which processes all the timesteps of a series in parallel
+# the dilation doubles with every layer. The series are padded at their end, so the outputs of the valid timesteps
+# never see the padding
+def temporal_convolutional_network(inputs, num_layers, num_filters, kernel_size, kernel_initializer):
+    outputs = inputs
+    for layer in range(num_layers):
+        dilation_rate = 2 ** layer
+        with tf.variable_scope("layer_{}".format(layer)):
+            # pad only the beginning of the series to keep the convolution causal
+            padded_outputs = tf.pad(outputs, paddings=[[0, 0], [(kernel_size - 1) * dilation_rate, 0], [0, 0]])
+            convolution_outputs = tf.layers.conv1d(inputs=padded_outputs, filters=num_filters,
+                                                   kernel_size=kernel_size, dilation_rate=dilation_rate,
+                                                   padding="valid", activation=tf.nn.relu,
+                                                   kernel_initializer=kernel_initializer, name="dilated_convolution")
+
+            # the residual connection is projected by a 1x1 convolution when the number of channels changes
+            if outputs.get_shape()[-1].value != num_filters:
+                outputs = tf.layers.conv1d(inputs=outputs, filters=num_filters, kernel_size=1, use_bias=False,
+                                           kernel_initializer=kernel_initializer, name="residual_projection")
+            outputs = outputs + convolution_outputs
+
+    return outputs
+
+
+# the outputs at the last valid timestep of every series, in the format [batch_size, num_filters]
+def last_timestep_outputs(outputs, sequence_lengths):
+    last_timestep_indices = tf.stack([tf.range(start=0, limit=tf.shape(sequence_lengths)[0], delta=1),
+                                      tf.cast(sequence_lengths, dtype=tf.int32) - 1], axis=-1)
+    return tf.gather_nd(params=outputs, indices=last_timestep_indices)
@@ -50,4 +50,47 @@ class TFRecordReader:
             })
         )
 
-        return context_parsed["sequence_length"], sequence_parsed["input"], sequence_parsed["metadata"]
\ No newline at end of file
+        return context_parsed["sequence_length"], sequence_parsed["input"], sequence_parsed["metadata"]
+
+    # map function keeping only the last encoder_lookback windows of every series. The outputs and the metadata of
+    # the windows are trimmed together with the inputs
+    def lookback_truncator(self, encoder_lookback):
+        def truncate(sequence_length, *sequences):
+            truncated_sequence_length = tf.minimum(sequence_length, encoder_lookback)
+            start = sequence_length - truncated_sequence_length
+            return (truncated_sequence_length,) + tuple(sequence[start:] for sequence in sequences)
+
+        return truncate
+
+    # flat map function splitting every series into the consecutive subsequences of subsequence_length windows,
+    # aligned to the end of the series. The first windows of a series that do not fill a subsequence are left out, and
+    # so are the series shorter than subsequence_length
+    def window_sampler(self, subsequence_length):
+        def sample(sequence_length, *sequences):
+            number_of_subsequences = sequence_length // subsequence_length
+            start = sequence_length - number_of_subsequences * subsequence_length
+            subsequences = tuple(
+                tf.reshape(sequence[start:sequence_length], [-1, subsequence_length, int(sequence.get_shape()[-1])])
+                for sequence in sequences)
+            subsequence_lengths = tf.fill([number_of_subsequences], tf.constant(subsequence_length, dtype=tf.int64))
+            return tf.data.Dataset.from_tensor_slices((subsequence_lengths,) + subsequences)
+
+        return sample
+
+    # print how much of the training data is left out by the window sampler, counted from the sequence lengths of the
+    # series in the tfrecord file, so that a large subsequence_length does not train on a small part of the dataset
+    # silently
+    def report_window_sampling(self, binary_file_path, subsequence_length):
+        sequence_lengths = []
+        for serialized_example in tf.python_io.tf_record_iterator(binary_file_path, tf.python_io.TFRecordOptions(
+                tf.python_io.TFRecordCompressionType.ZLIB)):
+            sequence_example = tf.train.SequenceExample.FromString(serialized_example)
+            sequence_lengths.append(sequence_example.context.feature["sequence_length"].int64_list.value[0])
+
+        number_of_windows = sum(sequence_lengths)
+        dropped_series = sum(1 for sequence_length in sequence_lengths if sequence_length < subsequence_length)
+        dropped_windows = sum(sequence_length % subsequence_length for sequence_length in sequence_lengths)
+        print("The window sampling of {} windows leaves out {} of {} series shorter than the subsequence length and {} "
+              "of {} windows ({:.1f}%)".format(subsequence_length, dropped_series, len(sequence_lengths),
+                                               dropped_windows, number_of_windows,
+                                               100.0 * dropped_windows / max(number_of_windows, 1)))
@@ -45,4 +45,13 @@ class TFRecordReader:
             })
         )
 
-        return context_parsed["sequence_length"], sequence_parsed["input"], sequence_parsed["metadata"]
\ No newline at end of file
+        return context_parsed["sequence_length"], sequence_parsed["input"], sequence_parsed["metadata"]
+
+    # map function keeping only the last encoder_lookback points of the input of every series. The output and the
+    # metadata are not aligned with the input points and are left as they are
+    def lookback_truncator(self, encoder_lookback):
+        def truncate(sequence_length, input, *other_features):
+            truncated_sequence_length = tf.minimum(sequence_length, encoder_lookback)
+            return (truncated_sequence_length, input[sequence_length - truncated_sequence_length:]) + other_features
+
+        return truncate
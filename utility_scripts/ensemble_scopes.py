@@ -0,0 +1,39 @@
+import contextlib
+import itertools
+import tensorflow as tf
+
+
+# variable scope of a replica of an ensemble trained inside a single graph
+# the random ops of the replica are seeded from the seed of the replica, and the graph level seed of the ensemble is
+# restored afterwards for the shared ops
+# a single model is built directly under the root scope to keep its variable names unchanged
+@contextlib.contextmanager
+def ensemble_replica_scope(replica_index, ensemble_size, replica_seed):
+    ensemble_seed = tf.get_default_graph().seed
+    tf.set_random_seed(replica_seed)
+    try:
+        if ensemble_size == 1:
+            with tf.variable_scope(tf.get_variable_scope()):
+                yield
+        else:
+            with tf.variable_scope('replica_' + str(replica_index)):
+                yield
+    finally:
+        tf.set_random_seed(ensemble_seed)
+
+
+# truncated normal initializer of the weights of a replica
+# the weights of the replicas of an ensemble get their own op level seeds in the order of their creation, so that
+# together with the graph level seed of the replica, a replica is initialized the same way at any position of the
+# ensemble. A single model keeps the initializer of the trainers, so that it is tested under the same initialization as
+# the configuration was tuned with
+def replica_weight_initializer(stddev, ensemble_size):
+    if ensemble_size == 1:
+        return tf.truncated_normal_initializer(stddev=stddev)
+
+    op_seeds = itertools.count(1)
+
+    def initializer(shape, dtype=None, partition_info=None):
+        return tf.truncated_normal(shape, stddev=stddev, dtype=dtype or tf.float32, seed=next(op_seeds))
+
+    return initializer
@@ -0,0 +1,92 @@
+import os
+import numpy as np
+
+from utility_scripts.test_data_reader import pad_test_inputs
+
+# tensorflow is imported only when a model is loaded with the tensorflow engine
+
+
+# an exported model served by a tensorflow session of its own
+class TensorflowExportedModel:
+
+    def __init__(self, export_directory):
+        import tensorflow as tf
+        from utility_scripts.model_export import load_exported_model, read_model_spec
+        from utility_scripts.session_configs import create_session_config
+
+        self.model_spec = read_model_spec(export_directory)
+        self.__output_size = int(self.model_spec['output_size'])
+
+        self.__session = tf.Session(graph=tf.Graph(), config=create_session_config())
+        self.__inputs, self.__outputs = load_exported_model(self.__session, export_directory)
+
+        # the size of the weights, estimated from the variables of the SavedModel
+        variables_directory = os.path.join(export_directory, "variables")
+        self.memory_size = sum(os.path.getsize(os.path.join(variables_directory, file_name))
+                               for file_name in os.listdir(variables_directory))
+        # the version of the model changes when it is exported again
+        self.version = int(os.path.getmtime(os.path.join(export_directory, "saved_model.pb")))
+
+    # forecast a padded minibatch with all the seeds, in the format [number_of_seeds, batch_size, output_size]
+    def forecast(self, padded_inputs, sequence_lengths):
+        feed_dict = {self.__inputs['input']: padded_inputs,
+                     self.__inputs['sequence_length']: sequence_lengths}
+
+        # the decoder of the seq2seq models exported before the decoder started from the last input takes the zero
+        # input and the forecast horizon for every series
+        if 'decoder_input' in self.__inputs:
+            feed_dict[self.__inputs['decoder_input']] = np.zeros(shape=[len(sequence_lengths), self.__output_size, 1])
+            feed_dict[self.__inputs['output_sequence_length']] = [self.__output_size] * len(sequence_lengths)
+
+        return self.__session.run(self.__outputs['forecasts'], feed_dict=feed_dict)
+
+    def close(self):
+        self.__session.close()
+
+
+# an exported model served by the numpy inference engine
+class NumpyExportedModel:
+
+    def __init__(self, export_directory):
+        from utility_scripts.numpy_inference_engine import NumpyInferenceEngine, NUMPY_MODEL_FILE_NAME
+
+        self.inference_engine = NumpyInferenceEngine(export_directory)
+        self.model_spec = self.inference_engine.model_spec
+        self.memory_size = self.inference_engine.memory_size
+        self.version = int(os.path.getmtime(os.path.join(export_directory, NUMPY_MODEL_FILE_NAME)))
+
+    def forecast(self, padded_inputs, sequence_lengths):
+        return self.inference_engine.forecast(padded_inputs, sequence_lengths)
+
+    def close(self):
+        pass
+
+
+# load an exported model with the given inference engine(tensorflow/numpy)
+def load_model(export_directory, engine):
+    if engine == "numpy":
+        return NumpyExportedModel(export_directory)
+    elif engine == "tensorflow":
+        return TensorflowExportedModel(export_directory)
+    raise ValueError("Unknown inference engine {}".format(engine))
+
+
+# keep only the last input timesteps of every series seen by the encoder, as in the training of the model
+# the models exported before the encoder lookback was introduced always see the whole series
+def truncate_to_encoder_lookback(model_spec, list_of_test_inputs):
+    encoder_lookback = int(model_spec.get('encoder_lookback', 0))
+    if encoder_lookback <= 0:
+        return list_of_test_inputs
+    return [test_input[-encoder_lookback:] for test_input in list_of_test_inputs]
+
+
+# forecast a list of input sequences in minibatches
+# returns the forecasts in the format [number_of_seeds, number_of_series, output_size]
+def forecast_in_minibatches(model, list_of_test_inputs, minibatch_size):
+    list_of_forecasts = []
+    for batch_start in range(0, len(list_of_test_inputs), minibatch_size):
+        sequence_lengths, padded_test_inputs = pad_test_inputs(
+            list_of_test_inputs[batch_start:batch_start + minibatch_size])
+        list_of_forecasts.append(model.forecast(padded_test_inputs, sequence_lengths))
+
+    return np.concatenate(list_of_forecasts, axis=1)
@@ -0,0 +1,178 @@
+import argparse
+import csv
+import os
+import warnings
+import numpy as np
+
+from utility_scripts.test_data_reader import read_txt_test_data
+from utility_scripts.forecast_postprocessing import extract_level_and_seasonality, denormalize_forecasts
+from utility_scripts.training_checkpoints import write_file_atomically
+from utility_scripts.mase_scales import load_mase_scales
+from configs.global_configs import model_testing_configs
+
+
+# the final evaluation of the forecasts of a model in the process of the model tester
+# it writes the same files as the final evaluation R scripts in error_calculator (the processed forecasts, the SMAPE
+# and the MASE of every series and their mean, median and standard deviation), but evaluates all the series together
+# as whole matrices instead of looping over the series
+
+
+# the paths of the R scripts are relative to the project root, even with a leading slash
+def project_path(path):
+    return path.lstrip("/")
+
+
+# read the actual results, one series per line with the name of the series in the first column
+# like the R scripts, the series with missing values are left out
+def read_actual_results(actual_results_file_path):
+    with open(actual_results_file_path) as actual_results_file:
+        rows = [row[1:] for row in csv.reader(actual_results_file, delimiter=";") if row]
+
+    actual_results = np.full(shape=[len(rows), max(len(row) for row in rows)], fill_value=np.nan)
+    for index, row in enumerate(rows):
+        actual_results[index, :len(row)] = [float(value) if value.strip() not in ("", "NA") else np.nan
+                                            for value in row]
+
+    return actual_results[~np.any(np.isnan(actual_results), axis=1)]
+
+
+# the level and the seasonal values of every series from the metadata of its last line in the text test file
+def read_denormalization_values(txt_test_file_path, input_format, input_size, output_size,
+                                without_stl_decomposition):
+    _, list_of_test_metadata = read_txt_test_data(txt_test_file_path, input_format, input_size)
+    if input_format == "moving_window":
+        list_of_test_metadata = [test_metadata[-1] for test_metadata in list_of_test_metadata]
+
+    level_values, seasonal_values = zip(*[
+        extract_level_and_seasonality(test_metadata, input_format, output_size, without_stl_decomposition)
+        for test_metadata in list_of_test_metadata])
+
+    if without_stl_decomposition:
+        return np.array(level_values), None
+    return np.array(level_values), np.stack(seasonal_values, axis=0)
+
+
+# the SMAPE of every series, ignoring the points where both the forecast and the actual value are zero
+def calculate_smape(forecasts, actual_results, address_near_zero_instability):
+    if address_near_zero_instability:
+        # define the custom smape function
+        epsilon = 0.1
+        sum = np.maximum(np.abs(forecasts) + np.abs(actual_results) + epsilon, 0.5 + epsilon)
+        smape_values = 2 * np.abs(forecasts - actual_results) / sum
+    else:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            smape_values = 2 * np.abs(forecasts - actual_results) / (np.abs(forecasts) + np.abs(actual_results))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanmean(smape_values, axis=1)
+
+
+# the MASE of every series
+def calculate_mase(forecasts, actual_results, mase_scales):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.mean(np.abs(forecasts - actual_results), axis=1) / mase_scales
+
+
+# format the numbers the same way as the R scripts, with 15 significant digits and NA for the missing values
+def format_error(value):
+    if np.isnan(value):
+        return "NA"
+    return "{:.15g}".format(value)
+
+
+# the mean, the median and the sample standard deviation, which are missing if any of the errors is missing
+def summarize_errors(errors, error_name):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return ["mean_{}:{}".format(error_name, format_error(np.mean(errors))),
+                "median_{}:{}".format(error_name, format_error(np.median(errors))),
+                "std_{}:{}".format(error_name, format_error(np.std(errors, ddof=1)))]
+
+
+def write_errors(file_path, errors):
+    write_file_atomically(file_path, lambda output: output.writelines(
+        format_error(error) + "\n" for error in errors))
+
+
+def evaluate_forecasts(rnn_forecasts_file_path, errors_file_name, txt_test_file_path, actual_results_file_path,
+                       original_data_file_path, input_format, input_size, output_size, contain_zero_values,
+                       address_near_zero_instability, integer_conversion, seasonality_period,
+                       without_stl_decomposition, errors_directory=model_testing_configs.RNN_ERRORS_DIRECTORY,
+                       processed_forecasts_directory=model_testing_configs.PROCESSED_RNN_FORECASTS_DIRECTORY):
+    forecasts = np.loadtxt(project_path(rnn_forecasts_file_path), delimiter=",", ndmin=2)
+    actual_results = read_actual_results(project_path(actual_results_file_path))
+    mase_scales, _ = load_mase_scales(project_path(original_data_file_path), seasonality_period)
+
+    # convert the forecasts to the original units
+    level_values, seasonal_values = read_denormalization_values(project_path(txt_test_file_path), input_format,
+                                                                input_size, output_size, without_stl_decomposition)
+    converted_forecasts = denormalize_forecasts(forecasts, level_values, seasonal_values, contain_zero_values,
+                                                integer_conversion, without_stl_decomposition)
+
+    smape_per_series = calculate_smape(converted_forecasts, actual_results, address_near_zero_instability)
+    mase_per_series = calculate_mase(converted_forecasts, actual_results, mase_scales[:len(converted_forecasts)])
+
+    smape_summary = summarize_errors(smape_per_series, "SMAPE")
+    mase_summary = summarize_errors(mase_per_series, "MASE")
+    for summary_line in smape_summary + mase_summary:
+        print(summary_line)
+
+    # persisting the converted forecasts
+    processed_forecasts_directory = project_path(processed_forecasts_directory)
+    errors_directory = project_path(errors_directory)
+    for directory in (processed_forecasts_directory, errors_directory):
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    write_file_atomically(processed_forecasts_directory + errors_file_name,
+                          lambda output: csv.writer(output, lineterminator='\n').writerows(converted_forecasts.tolist()))
+
+    # writing the SMAPE and the MASE results to the files
+    write_file_atomically(os.path.join(errors_directory, "mean_median_" + errors_file_name),
+                          lambda output: output.write("\n".join(smape_summary + ["\n"] + mase_summary + ["\n"]) + "\n"))
+    write_errors(os.path.join(errors_directory, "all_smape_errors_" + errors_file_name), smape_per_series)
+    write_errors(os.path.join(errors_directory, "all_mase_errors_" + errors_file_name), mase_per_series)
+
+    return smape_per_series, mase_per_series
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser("Evaluate the forecasts of a model")
+    argument_parser.add_argument('--forecasts_file', required=True, help='The file of the forecasts of the model')
+    argument_parser.add_argument('--errors_directory', required=False,
+                                 help='The directory to write the errors to. Default is results/errors')
+    argument_parser.add_argument('--processed_forecasts_directory', required=False,
+                                 help='The directory to write the processed forecasts to. Default is results/processed_rnn_forecasts/')
+    argument_parser.add_argument('--errors_file_name', required=True, help='The name of the errors files')
+    argument_parser.add_argument('--txt_test_file', required=True, help='The text file for test dataset')
+    argument_parser.add_argument('--actual_results_file', required=True, help='The text file of the actual results')
+    argument_parser.add_argument('--original_data_file', required=True,
+                                 help='The text file of the original dataset with all the given data points')
+    argument_parser.add_argument('--input_format', required=True, help='Input format(moving_window/non_moving_window)')
+    argument_parser.add_argument('--input_size', required=False,
+                                 help='The input size of the moving window. Default is 0 in the case of non moving window format')
+    argument_parser.add_argument('--forecast_horizon', required=True, help='The forecast horizon of the dataset')
+    argument_parser.add_argument('--contain_zero_values', required=True,
+                                 help='Whether the dataset contains zero values(0/1)')
+    argument_parser.add_argument('--address_near_zero_instability', required=False,
+                                 help='Whether to use a custom SMAPE function to address near zero instability(0/1). Default is 0')
+    argument_parser.add_argument('--integer_conversion', required=False,
+                                 help='Whether to convert the final forecasts to integers(0/1). Default is 0')
+    argument_parser.add_argument('--seasonality_period', required=True, help='The seasonality period of the time series')
+    argument_parser.add_argument('--without_stl_decomposition', required=False,
+                                 help='Whether not to use stl decomposition(0/1). Default is 0')
+
+    # parse the user arguments
+    args = argument_parser.parse_args()
+
+    evaluate_forecasts(args.forecasts_file, args.errors_file_name, args.txt_test_file, args.actual_results_file,
+                       args.original_data_file, args.input_format,
+                       int(args.input_size) if args.input_size else 0, int(args.forecast_horizon),
+                       bool(int(args.contain_zero_values)),
+                       bool(int(args.address_near_zero_instability)) if args.address_near_zero_instability else False,
+                       bool(int(args.integer_conversion)) if args.integer_conversion else False,
+                       int(args.seasonality_period),
+                       bool(int(args.without_stl_decomposition)) if args.without_stl_decomposition else False,
+                       args.errors_directory or model_testing_configs.RNN_ERRORS_DIRECTORY,
+                       args.processed_forecasts_directory or model_testing_configs.PROCESSED_RNN_FORECASTS_DIRECTORY)
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+# the cache key of the forecasts of a series, from the model identifier, the version of the model (so that a model
+# exported again under the same identifier does not return the stale forecasts), the hash of the normalized input of
+# the series and the forecast horizon
+def forecast_cache_key(model_identifier, model_version, test_input, horizon):
+    test_input = np.ascontiguousarray(test_input, dtype=np.float32)
+    input_hash = hashlib.sha1(str(test_input.shape).encode("utf-8") + test_input.tobytes()).hexdigest()
+    return "{}|{}|{}|{}".format(model_identifier, model_version, input_hash, horizon)
+
+
+# cache of the forecasts of the series (the forecasts of all the seeds, before the conversion to the original units)
+# bounded by the number of entries, the least recently used entries are evicted first
+# with a cache file, the cache is loaded from it at the start and written to it by save
+class ForecastCache:
+
+    def __init__(self, max_entries, cache_file_path=None):
+        self.__max_entries = max_entries
+        self.__cache_file_path = cache_file_path
+
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+        if cache_file_path and os.path.exists(cache_file_path):
+            with np.load(cache_file_path) as cache_file:
+                values = np.split(cache_file['values'], np.cumsum(np.prod(cache_file['shapes'], axis=1))[:-1])
+                for key, value, shape in zip(cache_file['keys'], values, cache_file['shapes']):
+                    self.__entries[str(key)] = value.reshape(shape)
+            self.__evict_entries()
+
+    def get(self, key):
+        with self.__lock:
+            value = self.__entries.get(key)
+            if value is None:
+                self.__misses += 1
+            else:
+                self.__hits += 1
+                self.__entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.__lock:
+            self.__entries[key] = np.asarray(value, dtype=np.float32)
+            self.__entries.move_to_end(key)
+            self.__evict_entries()
+
+    def __evict_entries(self):
+        while len(self.__entries) > self.__max_entries:
+            self.__entries.popitem(last=False)
+            self.__evictions += 1
+
+    def metrics(self):
+        with self.__lock:
+            return {
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'evictions': self.__evictions,
+                'hit_rate': self.__hits / (self.__hits + self.__misses) if self.__hits + self.__misses > 0 else 0.0,
+                'entries': len(self.__entries),
+                'max_entries': self.__max_entries
+            }
+
+    # write the cache to a temporary file first, so that an interrupted save does not corrupt the cache file
+    def save(self):
+        if not self.__cache_file_path:
+            return
+
+        cache_directory = os.path.dirname(self.__cache_file_path)
+        if cache_directory and not os.path.exists(cache_directory):
+            os.makedirs(cache_directory)
+
+        with self.__lock:
+            keys = list(self.__entries.keys())
+            values = list(self.__entries.values())
+
+        temporary_file_path = self.__cache_file_path + ".tmp"
+        with open(temporary_file_path, "wb") as cache_file:
+            np.savez(cache_file, keys=np.array(keys, dtype=str),
+                     shapes=np.array([value.shape for value in values], dtype=np.int64).reshape(-1, 2),
+                     values=np.concatenate([value.reshape(-1) for value in values]) if values else
+                     np.zeros(shape=[0], dtype=np.float32))
+        os.replace(temporary_file_path, self.__cache_file_path)
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+# the level and the seasonal values of a series from the metadata of its last test line (the values after |#),
+# at the same positions as the final evaluation R scripts read them
+# the seasonal values are None without the stl decomposition
+def extract_level_and_seasonality(metadata, input_format, output_size, without_stl_decomposition):
+    metadata = np.asarray(metadata, dtype=np.float64).reshape(-1)
+
+    if input_format == "moving_window":
+        level_value = metadata[0]
+        seasonal_values = None if without_stl_decomposition else metadata[1: 1 + output_size]
+    else:
+        if without_stl_decomposition:
+            level_value = metadata[-1]
+            seasonal_values = None
+        else:
+            level_value = metadata[len(metadata) - output_size - 1]
+            seasonal_values = metadata[len(metadata) - output_size:]
+
+    return level_value, seasonal_values
+
+
+# convert the forecasts of the networks back to the original units, the same way as the final evaluation R scripts
+# forecasts are in the format [number_of_series, output_size], level_values [number_of_series] and
+# seasonal_values [number_of_series, output_size] (ignored without the stl decomposition)
+def denormalize_forecasts(forecasts, level_values, seasonal_values, contain_zero_values, integer_conversion,
+                          without_stl_decomposition):
+    forecasts = np.asarray(forecasts, dtype=np.float64)
+    level_values = np.asarray(level_values, dtype=np.float64).reshape(-1, 1)
+
+    if without_stl_decomposition:
+        converted_forecasts = np.exp(forecasts)
+    else:
+        converted_forecasts = np.exp(forecasts + level_values + np.asarray(seasonal_values, dtype=np.float64))
+
+    if contain_zero_values:
+        converted_forecasts = converted_forecasts - 1
+
+    # without the stl decomposition the series are normalized by dividing by the level
+    if without_stl_decomposition:
+        converted_forecasts = converted_forecasts * level_values
+
+    # round half to even like the round function of R
+    if integer_conversion:
+        converted_forecasts = np.round(converted_forecasts)
+
+    # to make all forecasts positive
+    converted_forecasts[converted_forecasts < 0] = 0
+
+    return converted_forecasts
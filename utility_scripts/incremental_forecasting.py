@@ -0,0 +1,104 @@
+import os
+import numpy as np
+
+from utility_scripts.test_data_reader import pad_test_inputs
+
+
+# persistent store of the final encoder states of the series of a model
+# the states of all the seeds of a series are packed into one row, next to the number of timesteps encoded into them
+class RNNStateStore:
+
+    def __init__(self, state_file_path, state_size):
+        self.__state_file_path = state_file_path
+        self.__state_size = state_size
+
+        self.__series_indices = {}
+        self.__states = np.zeros(shape=[0, state_size], dtype=np.float32)
+        self.__encoded_lengths = np.zeros(shape=[0], dtype=np.int64)
+
+        if os.path.exists(state_file_path):
+            with np.load(state_file_path) as state_file:
+                if state_file['states'].shape[1] != state_size:
+                    raise ValueError("The states in {} do not belong to this model".format(state_file_path))
+                self.__series_indices = {series_id: index for index, series_id in enumerate(state_file['series_ids'])}
+                self.__states = state_file['states']
+                self.__encoded_lengths = state_file['encoded_lengths']
+
+    def series_ids(self):
+        return list(self.__series_indices.keys())
+
+    def __contains__(self, series_id):
+        return series_id in self.__series_indices
+
+    # the packed states of the series and the number of timesteps encoded into them. The series not in the store
+    # start from the zero state
+    def get(self, series_ids):
+        states = np.zeros(shape=[len(series_ids), self.__state_size], dtype=np.float32)
+        encoded_lengths = np.zeros(shape=[len(series_ids)], dtype=np.int64)
+        for row, series_id in enumerate(series_ids):
+            index = self.__series_indices.get(series_id)
+            if index is not None:
+                states[row] = self.__states[index]
+                encoded_lengths[row] = self.__encoded_lengths[index]
+        return states, encoded_lengths
+
+    def put(self, series_ids, states, encoded_lengths):
+        new_series_ids = [series_id for series_id in dict.fromkeys(series_ids) if series_id not in self.__series_indices]
+        if new_series_ids:
+            for series_id in new_series_ids:
+                self.__series_indices[series_id] = len(self.__series_indices)
+            self.__states = np.concatenate(
+                [self.__states, np.zeros(shape=[len(new_series_ids), self.__state_size], dtype=np.float32)])
+            self.__encoded_lengths = np.concatenate(
+                [self.__encoded_lengths, np.zeros(shape=[len(new_series_ids)], dtype=np.int64)])
+
+        indices = [self.__series_indices[series_id] for series_id in series_ids]
+        self.__states[indices] = states
+        self.__encoded_lengths[indices] = encoded_lengths
+
+    # write the store to a temporary file first, so that an interrupted save does not corrupt the stored states
+    def save(self):
+        state_directory = os.path.dirname(self.__state_file_path)
+        if state_directory and not os.path.exists(state_directory):
+            os.makedirs(state_directory)
+
+        series_ids = sorted(self.__series_indices, key=self.__series_indices.get)
+        temporary_file_path = self.__state_file_path + ".tmp"
+        with open(temporary_file_path, "wb") as state_file:
+            np.savez(state_file, series_ids=np.array(series_ids, dtype=str), states=self.__states,
+                     encoded_lengths=self.__encoded_lengths)
+        os.replace(temporary_file_path, self.__state_file_path)
+
+
+# forecasts the series by advancing their stored encoder states over their new inputs only, instead of encoding their
+# whole history again. The inference engine needs the encode and forecast_from_states steps of the numpy engine
+# for the moving window format, advancing a state over the new windows gives the same state as encoding the whole
+# history, since every window is normalized independently. The non moving window format normalizes the whole series by
+# its last level, so its stored states would not match a full encoding, and it is not forecasted incrementally
+class IncrementalForecaster:
+
+    def __init__(self, inference_engine, state_store):
+        self.__inference_engine = inference_engine
+        self.__state_store = state_store
+
+    # advance the states of the series over their new inputs in the format [number_of_new_timesteps, input_size] and
+    # forecast from the new states
+    # returns the forecasts in the format [number_of_seeds, number_of_series, output_size]
+    def update(self, series_ids, list_of_new_inputs):
+        packed_states, encoded_lengths = self.__state_store.get(series_ids)
+        sequence_lengths, padded_new_inputs = pad_test_inputs(list_of_new_inputs)
+
+        states = self.__inference_engine.encode(padded_new_inputs, sequence_lengths,
+                                                self.__inference_engine.unpack_states(packed_states))
+        self.__state_store.put(series_ids, self.__inference_engine.pack_states(states),
+                               encoded_lengths + sequence_lengths)
+
+        return self.__inference_engine.forecast_from_states(states)
+
+    # forecast from the stored states without new inputs
+    def forecast(self, series_ids):
+        packed_states, _ = self.__state_store.get(series_ids)
+        return self.__inference_engine.forecast_from_states(self.__inference_engine.unpack_states(packed_states))
+
+    def save(self):
+        self.__state_store.save()
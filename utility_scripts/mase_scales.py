@@ -0,0 +1,105 @@
+import argparse
+import csv
+import os
+import numpy as np
+
+from utility_scripts.training_checkpoints import write_file_atomically
+
+
+# the MASE scaling of a series, the mean absolute seasonal difference of its original data, is the same for every
+# seed, model and cell of a dataset. It is precomputed once per original data file and seasonality period into a
+# sidecar csv file next to the original data, holding the length and the scaling of every series in the order of the
+# original data, which the final evaluation scripts read instead of the original data
+
+
+# the sidecar file of the MASE scalings of the original data file, also used by the R scripts in error_calculator
+def mase_scales_file_path(original_data_file_path, seasonality_period):
+    return original_data_file_path + "_mase_scales_" + str(int(seasonality_period)) + ".csv"
+
+
+# read the original series, one series per line
+def read_original_data(original_data_file_path):
+    with open(original_data_file_path) as original_data_file:
+        return [np.array(line.split(",") if line else [], dtype=np.float64)
+                for line in original_data_file.read().splitlines()]
+
+
+# the MASE scaling of every series
+# the differences of all the series are taken together over the concatenated series and the differences across the
+# boundaries of two series are left out. The series without a seasonal difference have no scaling(nan)
+def calculate_mase_scales(original_data, seasonality_period):
+    series_lengths = np.array([len(series) for series in original_data], dtype=np.int64)
+    values = np.concatenate(original_data) if original_data else np.zeros(shape=[0])
+
+    seasonal_differences = np.abs(values[seasonality_period:] - values[:len(values) - seasonality_period])
+    series_indices = np.repeat(np.arange(len(original_data)), series_lengths)[:len(seasonal_differences)]
+    series_ends = np.cumsum(series_lengths)
+    within_series = np.arange(len(seasonal_differences)) + seasonality_period < series_ends[series_indices]
+
+    sums_of_differences = np.bincount(series_indices[within_series], weights=seasonal_differences[within_series],
+                                      minlength=len(original_data))
+    numbers_of_differences = np.maximum(series_lengths - seasonality_period, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return sums_of_differences / numbers_of_differences, series_lengths
+
+
+def write_mase_scales(file_path, mase_scales, series_lengths):
+    def write_rows(output):
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(["series_length", "mase_scale"])
+        writer.writerows([series_length, "NA" if np.isnan(mase_scale) else repr(float(mase_scale))]
+                         for series_length, mase_scale in zip(series_lengths.tolist(), mase_scales))
+
+    write_file_atomically(file_path, write_rows)
+
+
+def read_mase_scales(file_path):
+    with open(file_path) as mase_scales_file:
+        rows = list(csv.reader(mase_scales_file))[1:]
+
+    series_lengths = np.array([int(row[0]) for row in rows], dtype=np.int64)
+    mase_scales = np.array([np.nan if row[1] == "NA" else float(row[1]) for row in rows], dtype=np.float64)
+    return mase_scales, series_lengths
+
+
+# the MASE scalings of the original data file from its sidecar file
+# the sidecar file is created on the first use and recreated whenever the original data file is newer than it. If the
+# sidecar file cannot be written (e.g. a read only data directory), the scalings are only calculated in memory
+def load_mase_scales(original_data_file_path, seasonality_period):
+    file_path = mase_scales_file_path(original_data_file_path, seasonality_period)
+    if os.path.exists(file_path) and os.path.getmtime(file_path) >= os.path.getmtime(original_data_file_path):
+        return read_mase_scales(file_path)
+
+    mase_scales, series_lengths = calculate_mase_scales(read_original_data(original_data_file_path),
+                                                        int(seasonality_period))
+    try:
+        write_mase_scales(file_path, mase_scales, series_lengths)
+    except OSError as error:
+        print("Could not write the MASE scalings to {}: {}. Using them without the sidecar file".format(file_path,
+                                                                                                         error))
+    return mase_scales, series_lengths
+
+
+# the MASE scalings of the training part of the series, which the validation errors of the trainers are scaled by
+# the last output_size points of every series are the validation horizon of the trainers, so they are left out as the
+# final evaluation leaves out the test horizon. They are only calculated in memory, without a sidecar file
+def calculate_validation_mase_scales(original_data_file_path, seasonality_period, output_size):
+    original_data = [series[:max(len(series) - output_size, 0)]
+                     for series in read_original_data(original_data_file_path)]
+    return calculate_mase_scales(original_data, int(seasonality_period))
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser("Precompute the MASE scalings of a dataset")
+    argument_parser.add_argument('--original_data_file', required=True,
+                                 help='The text file of the original dataset with all the given data points')
+    argument_parser.add_argument('--seasonality_period', required=True, help='The seasonality period of the time series')
+
+    # parse the user arguments
+    args = argument_parser.parse_args()
+
+    mase_scales, series_lengths = calculate_mase_scales(read_original_data(args.original_data_file),
+                                                        int(args.seasonality_period))
+    file_path = mase_scales_file_path(args.original_data_file, args.seasonality_period)
+    write_mase_scales(file_path, mase_scales, series_lengths)
+    print("Wrote the MASE scalings of {} series to {}".format(len(series_lengths), file_path))
@@ -0,0 +1,64 @@
+import asyncio
+import numpy as np
+
+
+# coalesces the concurrent forecast requests of a model into micro-batches
+# a micro-batch is run as soon as it holds max_batch_size series, or when the oldest request in it has waited for the
+# latency budget. The forecast function runs in the executor, so that the event loop keeps accepting requests
+class MicroBatcher:
+
+    def __init__(self, forecast_function, max_batch_size, latency_budget, executor, loop=None):
+        self.__forecast_function = forecast_function
+        self.__max_batch_size = max_batch_size
+        self.__latency_budget = latency_budget
+        self.__executor = executor
+        self.__loop = loop if loop is not None else asyncio.get_event_loop()
+
+        self.__pending_requests = []
+        self.__pending_series = 0
+        self.__flush_handle = None
+
+    # submit the input sequences of a request. Returns a future of the forecasts of the request in the format
+    # [number_of_seeds, number_of_series, output_size]
+    def submit(self, list_of_inputs):
+        future = self.__loop.create_future()
+        self.__pending_requests.append((list_of_inputs, future))
+        self.__pending_series += len(list_of_inputs)
+
+        if self.__pending_series >= self.__max_batch_size:
+            self.__flush()
+        elif self.__flush_handle is None:
+            self.__flush_handle = self.__loop.call_later(self.__latency_budget, self.__flush)
+
+        return future
+
+    def __flush(self):
+        if self.__flush_handle is not None:
+            self.__flush_handle.cancel()
+            self.__flush_handle = None
+
+        batch = self.__pending_requests
+        self.__pending_requests = []
+        self.__pending_series = 0
+
+        if batch:
+            asyncio.ensure_future(self.__run_batch(batch), loop=self.__loop)
+
+    async def __run_batch(self, batch):
+        list_of_inputs = [inputs for request_inputs, _ in batch for inputs in request_inputs]
+
+        try:
+            forecasts = await self.__loop.run_in_executor(self.__executor, self.__forecast_function, list_of_inputs)
+        except Exception as exception:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exception)
+            return
+
+        # split the forecasts of the micro-batch back to the requests
+        batch_start = 0
+        for request_inputs, future in batch:
+            batch_end = batch_start + len(request_inputs)
+            if not future.done():
+                future.set_result(np.asarray(forecasts)[:, batch_start:batch_end])
+            batch_start = batch_end
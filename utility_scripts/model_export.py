@@ -0,0 +1,41 @@
+import json
+import os
+import shutil
+import tensorflow as tf
+
+MODEL_SPEC_FILE_NAME = "model_spec.json"
+
+
+# export the inference subgraph of a trained model and its weights as a SavedModel
+# the inputs and outputs are dictionaries of the tensors of the serving signature
+def export_model(session, export_directory, inputs, outputs):
+    # a SavedModel can only be written to a new directory
+    if os.path.exists(export_directory):
+        shutil.rmtree(export_directory)
+
+    tf.saved_model.simple_save(session, export_directory, inputs=inputs, outputs=outputs)
+    print("Exported the model to {}".format(export_directory))
+
+
+# the description of the exported model needed to prepare its inputs and to name its forecasts
+def write_model_spec(export_directory, model_spec):
+    with open(os.path.join(export_directory, MODEL_SPEC_FILE_NAME), "w") as model_spec_file:
+        json.dump(model_spec, model_spec_file, indent=4, sort_keys=True)
+
+
+def read_model_spec(export_directory):
+    with open(os.path.join(export_directory, MODEL_SPEC_FILE_NAME)) as model_spec_file:
+        return json.load(model_spec_file)
+
+
+# load an exported model into the session and return the input and output tensors of its serving signature
+def load_exported_model(session, export_directory):
+    meta_graph_def = tf.saved_model.loader.load(session, [tf.saved_model.tag_constants.SERVING], export_directory)
+    signature_def = meta_graph_def.signature_def[tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY]
+
+    inputs = {name: session.graph.get_tensor_by_name(tensor_info.name)
+              for name, tensor_info in signature_def.inputs.items()}
+    outputs = {name: session.graph.get_tensor_by_name(tensor_info.name)
+               for name, tensor_info in signature_def.outputs.items()}
+
+    return inputs, outputs
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# a load of a model in progress, which the concurrent requests of the same model wait for
+class ModelLoading:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.model = None
+        self.error = None
+        # the requests waiting for the load, which become users of the model as soon as it is loaded
+        self.number_of_waiting_users = 0
+
+
+# registry of the models loaded lazily by their model identifier, bounded by a memory budget
+# the least recently used models are evicted when the budget is exceeded. A model is never evicted while it is in use
+# (between its acquire and release), so the budget may be exceeded temporarily when all the loaded models are in use
+# the loaded models need the memory_size attribute (in bytes) and the close method
+class ModelRegistry:
+
+    def __init__(self, load_model_function, memory_budget):
+        self.__load_model_function = load_model_function
+        self.__memory_budget = memory_budget
+
+        # model identifier -> [model, number of users]. The least recently used model is the first
+        self.__models = OrderedDict()
+        # model identifier -> the load of the model in progress
+        self.__model_loadings = {}
+        self.__resident_memory = 0
+        self.__lock = threading.Lock()
+
+        self.__hits = 0
+        self.__loads = 0
+        self.__evictions = 0
+        self.__load_time = 0.0
+
+    # the model of the identifier, loaded if it is not resident. Every acquire must be followed by a release
+    # the model is loaded outside the lock, so that a cold load does not block the requests of the resident models. The
+    # concurrent requests of a model being loaded wait for that load instead of loading the model again
+    def acquire(self, model_identifier):
+        with self.__lock:
+            if model_identifier in self.__models:
+                self.__hits += 1
+                self.__models.move_to_end(model_identifier)
+                registry_entry = self.__models[model_identifier]
+                registry_entry[1] += 1
+                return registry_entry[0]
+
+            model_loading = self.__model_loadings.get(model_identifier)
+            waiting_request = model_loading is not None
+            if waiting_request:
+                self.__hits += 1
+                model_loading.number_of_waiting_users += 1
+            else:
+                model_loading = ModelLoading()
+                self.__model_loadings[model_identifier] = model_loading
+
+        if waiting_request:
+            return self.__wait_for_model(model_loading)
+        return self.__load_model(model_identifier, model_loading)
+
+    def __wait_for_model(self, model_loading):
+        model_loading.done.wait()
+        if model_loading.error is not None:
+            raise model_loading.error
+        return model_loading.model
+
+    def __load_model(self, model_identifier, model_loading):
+        start_time = time.time()
+        try:
+            model = self.__load_model_function(model_identifier)
+        except Exception as error:
+            with self.__lock:
+                del self.__model_loadings[model_identifier]
+            model_loading.error = error
+            model_loading.done.set()
+            raise
+
+        with self.__lock:
+            self.__load_time += time.time() - start_time
+            self.__loads += 1
+            del self.__model_loadings[model_identifier]
+
+            # the waiting requests are users of the model from now on, so that it is not evicted before they get it
+            self.__models[model_identifier] = [model, 1 + model_loading.number_of_waiting_users]
+            self.__resident_memory += model.memory_size
+            self.__evict_models()
+
+        model_loading.model = model
+        model_loading.done.set()
+        return model
+
+    def release(self, model_identifier):
+        with self.__lock:
+            self.__models[model_identifier][1] -= 1
+            self.__evict_models()
+
+    def __evict_models(self):
+        for model_identifier in list(self.__models.keys()):
+            if self.__resident_memory <= self.__memory_budget:
+                break
+
+            model, number_of_users = self.__models[model_identifier]
+            if number_of_users == 0:
+                del self.__models[model_identifier]
+                self.__resident_memory -= model.memory_size
+                self.__evictions += 1
+                model.close()
+                print("Evicted the model {}".format(model_identifier))
+
+    def metrics(self):
+        with self.__lock:
+            return {
+                'hits': self.__hits,
+                'loads': self.__loads,
+                'evictions': self.__evictions,
+                'hit_rate': self.__hits / (self.__hits + self.__loads) if self.__hits + self.__loads > 0 else 0.0,
+                'load_time': self.__load_time,
+                'resident_models': list(self.__models.keys()),
+                'loading_models': list(self.__model_loadings.keys()),
+                'resident_memory': self.__resident_memory,
+                'memory_budget': self.__memory_budget
+            }
+
+    def close(self):
+        with self.__lock:
+            for model, _ in self.__models.values():
+                model.close()
+            self.__models.clear()
+            self.__resident_memory = 0
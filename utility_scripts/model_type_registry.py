@@ -0,0 +1,73 @@
+import importlib
+
+# the modules and the class names of the trainers and the testers of every model type and input format
+# the model classes are imported only when they are selected, so that a run imports only the architecture it uses
+# an input format of None is used for all the input formats of the model type
+MODEL_TRAINERS = {
+    ("stacking", None): (
+        "rnn_architectures.stacking_model.stacking_model_trainer", "StackingModelTrainer"),
+    ("seq2seq", None): (
+        "rnn_architectures.seq2seq_model.with_decoder.non_moving_window.unaccumulated_error.seq2seq_model_trainer",
+        "Seq2SeqModelTrainer"),
+    ("seq2seqwithdenselayer", "non_moving_window"): (
+        "rnn_architectures.seq2seq_model.with_dense_layer.non_moving_window.unaccumulated_error.seq2seq_model_trainer",
+        "Seq2SeqModelTrainerWithDenseLayer"),
+    ("seq2seqwithdenselayer", "moving_window"): (
+        "rnn_architectures.seq2seq_model.with_dense_layer.moving_window.unaccumulated_error.seq2seq_model_trainer",
+        "Seq2SeqModelTrainerWithDenseLayer"),
+    ("tcn", None): (
+        "rnn_architectures.tcn_model.tcn_model_trainer", "TCNModelTrainer")
+}
+
+MODEL_TESTERS = {
+    ("stacking", None): (
+        "rnn_architectures.stacking_model.stacking_model_tester", "StackingModelTester"),
+    ("seq2seq", None): (
+        "rnn_architectures.seq2seq_model.with_decoder.non_moving_window.unaccumulated_error.seq2seq_model_tester",
+        "Seq2SeqModelTester"),
+    ("seq2seqwithdenselayer", "non_moving_window"): (
+        "rnn_architectures.seq2seq_model.with_dense_layer.non_moving_window.unaccumulated_error.seq2seq_model_tester",
+        "Seq2SeqModelTesterWithDenseLayer"),
+    ("seq2seqwithdenselayer", "moving_window"): (
+        "rnn_architectures.seq2seq_model.with_dense_layer.moving_window.unaccumulated_error.seq2seq_model_tester",
+        "Seq2SeqModelTesterWithDenseLayer"),
+    ("tcn", None): (
+        "rnn_architectures.tcn_model.tcn_model_tester", "TCNModelTester")
+}
+
+
+def _find_model_class(model_classes, model_type, input_format):
+    if (model_type, input_format) in model_classes:
+        return model_classes[(model_type, input_format)]
+    return model_classes.get((model_type, None))
+
+
+# whether the model type supports the input format, checked without importing the model classes
+def is_supported_model(model_type, input_format):
+    return _find_model_class(MODEL_TRAINERS, model_type, input_format) is not None and \
+           input_format in ("moving_window", "non_moving_window")
+
+
+def _get_model_class_name(model_classes, model_type, input_format):
+    model_class = _find_model_class(model_classes, model_type, input_format)
+    if model_class is None:
+        raise ValueError("The model type {} does not support the input format {}".format(model_type, input_format))
+    return model_class
+
+
+def _import_model_class(model_classes, model_type, input_format):
+    module_name, class_name = _get_model_class_name(model_classes, model_type, input_format)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def get_model_trainer_class(model_type, input_format):
+    return _import_model_class(MODEL_TRAINERS, model_type, input_format)
+
+
+def get_model_tester_class(model_type, input_format):
+    return _import_model_class(MODEL_TESTERS, model_type, input_format)
+
+
+# the module of the tester, to import it ahead of time without importing it in the current process
+def get_model_tester_module(model_type, input_format):
+    return _get_model_class_name(MODEL_TESTERS, model_type, input_format)[0]
@@ -0,0 +1,283 @@
+import json
+import os
+import numpy as np
+
+# this module depends only on numpy, so that the forecasting jobs do not need to import tensorflow
+
+NUMPY_MODEL_FILE_NAME = "numpy_model.npz"
+NUMPY_MODEL_SPEC_FILE_NAME = "numpy_model_spec.json"
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+# the cells follow the semantics of the tf.nn.rnn_cell cells of tensorflow 1.12 with their default arguments
+# LSTM cell with the optional peephole connections. The state is the tuple (c, h) as in the LSTMStateTuple
+class LSTMCell:
+
+    def __init__(self, weights, prefix):
+        self.__kernel = weights[prefix + "kernel"]
+        self.__bias = weights[prefix + "bias"]
+        self.__use_peepholes = prefix + "w_f_diag" in weights
+        if self.__use_peepholes:
+            self.__w_f_diag = weights[prefix + "w_f_diag"]
+            self.__w_i_diag = weights[prefix + "w_i_diag"]
+            self.__w_o_diag = weights[prefix + "w_o_diag"]
+        self.__num_units = self.__bias.shape[0] // 4
+        self.__forget_bias = 1.0
+
+    def zero_state(self, batch_size):
+        return (np.zeros(shape=[batch_size, self.__num_units], dtype=np.float32),
+                np.zeros(shape=[batch_size, self.__num_units], dtype=np.float32))
+
+    def __call__(self, inputs, state):
+        c_prev, h_prev = state
+        lstm_matrix = np.matmul(np.concatenate([inputs, h_prev], axis=1), self.__kernel) + self.__bias
+        i, j, f, o = np.split(lstm_matrix, 4, axis=1)
+
+        if self.__use_peepholes:
+            c = sigmoid(f + self.__forget_bias + self.__w_f_diag * c_prev) * c_prev + \
+                sigmoid(i + self.__w_i_diag * c_prev) * np.tanh(j)
+            h = sigmoid(o + self.__w_o_diag * c) * np.tanh(c)
+        else:
+            c = sigmoid(f + self.__forget_bias) * c_prev + sigmoid(i) * np.tanh(j)
+            h = sigmoid(o) * np.tanh(c)
+
+        return h, (c, h)
+
+
+# GRU cell with the reset and update gates followed by the candidate activation
+class GRUCell:
+
+    def __init__(self, weights, prefix):
+        self.__gates_kernel = weights[prefix + "gates/kernel"]
+        self.__gates_bias = weights[prefix + "gates/bias"]
+        self.__candidate_kernel = weights[prefix + "candidate/kernel"]
+        self.__candidate_bias = weights[prefix + "candidate/bias"]
+        self.__num_units = self.__candidate_bias.shape[0]
+
+    def zero_state(self, batch_size):
+        return (np.zeros(shape=[batch_size, self.__num_units], dtype=np.float32),)
+
+    def __call__(self, inputs, state):
+        h_prev, = state
+        gate_values = sigmoid(
+            np.matmul(np.concatenate([inputs, h_prev], axis=1), self.__gates_kernel) + self.__gates_bias)
+        r, u = np.split(gate_values, 2, axis=1)
+
+        candidate = np.tanh(
+            np.matmul(np.concatenate([inputs, r * h_prev], axis=1), self.__candidate_kernel) + self.__candidate_bias)
+        h = u * h_prev + (1 - u) * candidate
+
+        return h, (h,)
+
+
+# basic RNN cell with the tanh activation
+class BasicRNNCell:
+
+    def __init__(self, weights, prefix):
+        self.__kernel = weights[prefix + "kernel"]
+        self.__bias = weights[prefix + "bias"]
+        self.__num_units = self.__bias.shape[0]
+
+    def zero_state(self, batch_size):
+        return (np.zeros(shape=[batch_size, self.__num_units], dtype=np.float32),)
+
+    def __call__(self, inputs, state):
+        h_prev, = state
+        h = np.tanh(np.matmul(np.concatenate([inputs, h_prev], axis=1), self.__kernel) + self.__bias)
+        return h, (h,)
+
+
+CELL_TYPES = {
+    "LSTM": LSTMCell,
+    "GRU": GRUCell,
+    "RNN": BasicRNNCell
+}
+
+
+# a stack of cells as in the MultiRNNCell
+class MultiLayeredCell:
+
+    def __init__(self, weights, prefix, cell_type, num_hidden_layers):
+        self.__cells = [CELL_TYPES[cell_type](weights, prefix + "cell_{}/".format(layer))
+                        for layer in range(num_hidden_layers)]
+
+    def zero_state(self, batch_size):
+        return [cell.zero_state(batch_size) for cell in self.__cells]
+
+    def __call__(self, inputs, states):
+        new_states = []
+        for cell, state in zip(self.__cells, states):
+            inputs, new_state = cell(inputs, state)
+            new_states.append(new_state)
+        return inputs, new_states
+
+    # run the cells over the padded sequences like the dynamic_rnn, starting from the given states (the zero states if
+    # None)
+    # returns the output at the last timestep of every sequence and the final states, which stay unchanged after the
+    # end of a sequence
+    def run(self, inputs, sequence_lengths, initial_states=None):
+        batch_size = inputs.shape[0]
+        states = self.zero_state(batch_size) if initial_states is None else initial_states
+        last_outputs = None
+
+        for timestep in range(inputs.shape[1]):
+            outputs, new_states = self(inputs[:, timestep], states)
+
+            active_sequences = (timestep < sequence_lengths)[:, np.newaxis]
+            states = [tuple(np.where(active_sequences, new_state_part, state_part)
+                            for new_state_part, state_part in zip(new_state, state))
+                      for new_state, state in zip(new_states, states)]
+
+            if last_outputs is None:
+                last_outputs = np.zeros_like(outputs)
+            last_timestep_sequences = (timestep == sequence_lengths - 1)[:, np.newaxis]
+            last_outputs = np.where(last_timestep_sequences, outputs, last_outputs)
+
+        return last_outputs, states
+
+
+# the dense projection layer
+class DenseLayer:
+
+    def __init__(self, weights, prefix):
+        self.__kernel = weights[prefix + "kernel"]
+        self.__bias = weights.get(prefix + "bias")
+
+    def __call__(self, inputs):
+        outputs = np.matmul(inputs, self.__kernel)
+        if self.__bias is not None:
+            outputs = outputs + self.__bias
+        return outputs
+
+
+# one trained model (the model of one seed)
+class NumpyForecastingModel:
+
+    def __init__(self, weights, prefix, model_spec):
+        self.__model_type = model_spec["model_type"]
+        self.__output_size = int(model_spec["output_size"])
+
+        self.__encoder = MultiLayeredCell(weights, prefix + "encoder/", model_spec["cell_type"],
+                                          int(model_spec["num_hidden_layers"]))
+        self.__dense_layer = DenseLayer(weights, prefix + "dense/")
+        if self.__model_type == "seq2seq":
+            self.__decoder = MultiLayeredCell(weights, prefix + "decoder/", model_spec["cell_type"],
+                                              int(model_spec["num_hidden_layers"]))
+            # the models exported before the decoder started from the last input were trained with a zero first input
+            self.__decoder_starts_from_last_input = model_spec.get("decoder_start", "zero") == "last_input"
+
+    # the decoder of the seq2seq model starts from the last input of the series, so the last input is carried as an
+    # extra part of the states, after the states of the encoder
+    def zero_state(self, batch_size):
+        zero_state = self.__encoder.zero_state(batch_size)
+        if self.__model_type == "seq2seq":
+            zero_state.append((np.zeros(shape=[batch_size, 1], dtype=np.float32),))
+        return zero_state
+
+    # run the encoder over a padded minibatch of inputs in the format [batch_size, sequence_length, input_size],
+    # starting from the given states (the zero states if None). Returns the final states of the encoder
+    def encode(self, padded_inputs, sequence_lengths, initial_states=None):
+        padded_inputs = np.asarray(padded_inputs, dtype=np.float32)
+        sequence_lengths = np.asarray(sequence_lengths)
+
+        if self.__model_type != "seq2seq":
+            _, encoder_states = self.__encoder.run(padded_inputs, sequence_lengths, initial_states)
+            return encoder_states
+
+        if initial_states is None:
+            initial_states = self.zero_state(padded_inputs.shape[0])
+        _, encoder_states = self.__encoder.run(padded_inputs, sequence_lengths, initial_states[:-1])
+
+        # the series without new inputs keep their last input
+        last_inputs, = initial_states[-1]
+        if padded_inputs.shape[1] > 0:
+            last_inputs = np.where((sequence_lengths > 0)[:, np.newaxis],
+                                   padded_inputs[np.arange(padded_inputs.shape[0]),
+                                                 np.maximum(sequence_lengths - 1, 0)], last_inputs)
+        return encoder_states + [(last_inputs,)]
+
+    # forecast from the final states of the encoder
+    # returns the forecasts in the format [batch_size, output_size]
+    def forecast_from_states(self, encoder_states):
+        # the stacking model and the seq2seq model with the dense layer project the last output to the forecast horizon.
+        # The last output is the hidden state of the last layer, which is the last part of its state
+        if self.__model_type != "seq2seq":
+            return self.__dense_layer(encoder_states[-1][-1])
+
+        # the decoder starts from the final state of the encoder and the last input, every forecast is the next input
+        decoder_inputs, = encoder_states[-1]
+        if not self.__decoder_starts_from_last_input:
+            decoder_inputs = np.zeros_like(decoder_inputs)
+        decoder_states = encoder_states[:-1]
+        forecasts = []
+        for _ in range(self.__output_size):
+            decoder_outputs, decoder_states = self.__decoder(decoder_inputs, decoder_states)
+            decoder_inputs = self.__dense_layer(decoder_outputs)
+            forecasts.append(decoder_inputs)
+
+        return np.concatenate(forecasts, axis=1)
+
+    # forecast a padded minibatch of inputs in the format [batch_size, sequence_length, input_size]
+    # returns the forecasts in the format [batch_size, output_size]
+    def forecast(self, padded_inputs, sequence_lengths):
+        return self.forecast_from_states(self.encode(padded_inputs, sequence_lengths))
+
+
+# the models of all the seeds of an exported model
+class NumpyInferenceEngine:
+
+    def __init__(self, export_directory):
+        with open(os.path.join(export_directory, NUMPY_MODEL_SPEC_FILE_NAME)) as model_spec_file:
+            self.model_spec = json.load(model_spec_file)
+
+        with np.load(os.path.join(export_directory, NUMPY_MODEL_FILE_NAME)) as weights_file:
+            weights = {name: weights_file[name].astype(np.float32) for name in weights_file.files}
+        self.memory_size = sum(weight.nbytes for weight in weights.values())
+
+        self.__models = [NumpyForecastingModel(weights, "seed_{}/".format(seed), self.model_spec)
+                         for seed in self.model_spec["seeds"]]
+
+        # the sizes of the parts of the states of all the seeds, in the order they are packed
+        self.__state_part_sizes = [state_part.shape[1] for states in self.zero_states(1)
+                                   for layer_state in states for state_part in layer_state]
+        self.state_size = sum(self.__state_part_sizes)
+
+    # forecast a padded minibatch with all the seeds, in the format [number_of_seeds, batch_size, output_size]
+    def forecast(self, padded_inputs, sequence_lengths):
+        return np.stack([model.forecast(padded_inputs, sequence_lengths) for model in self.__models], axis=0)
+
+    def zero_states(self, batch_size):
+        return [model.zero_state(batch_size) for model in self.__models]
+
+    # run the encoders of all the seeds over a padded minibatch, starting from the given states of the seeds (the zero
+    # states if None). Returns the final states of the encoders of the seeds
+    def encode(self, padded_inputs, sequence_lengths, initial_states=None):
+        if initial_states is None:
+            initial_states = [None] * len(self.__models)
+        return [model.encode(padded_inputs, sequence_lengths, states)
+                for model, states in zip(self.__models, initial_states)]
+
+    # forecast with all the seeds from the final states of their encoders
+    def forecast_from_states(self, states):
+        return np.stack([model.forecast_from_states(model_states)
+                         for model, model_states in zip(self.__models, states)], axis=0)
+
+    # pack the states of all the seeds into a single matrix of the format [batch_size, state_size]
+    def pack_states(self, states):
+        return np.concatenate([state_part for model_states in states for layer_state in model_states
+                               for state_part in layer_state], axis=1)
+
+    def unpack_states(self, packed_states):
+        state_parts = np.split(np.asarray(packed_states, dtype=np.float32),
+                               np.cumsum(self.__state_part_sizes)[:-1], axis=1)
+
+        states = []
+        for model_states in self.zero_states(1):
+            unpacked_model_states = []
+            for layer_state in model_states:
+                unpacked_model_states.append(tuple(state_parts.pop(0) for _ in layer_state))
+            states.append(unpacked_model_states)
+        return states
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import re
+import numpy as np
+import tensorflow as tf
+
+from utility_scripts.model_export import read_model_spec
+from utility_scripts.numpy_inference_engine import NUMPY_MODEL_FILE_NAME, NUMPY_MODEL_SPEC_FILE_NAME
+
+# variable scopes of the parts of the models in the tester graphs
+ENCODER_SCOPES = {
+    "stacking": "train_scope/rnn/multi_rnn_cell/",
+    "seq2seqwithdenselayer": "train_encoder_scope/rnn/multi_rnn_cell/",
+    "seq2seq": "train_encoder_scope/rnn/multi_rnn_cell/"
+}
+DECODER_SCOPES = {
+    "seq2seq": "decoder_train_scope/decoder/multi_rnn_cell/"
+}
+DENSE_LAYER_SCOPES = {
+    "stacking": "train_scope/dense_layer/",
+    "seq2seqwithdenselayer": "dense_layer_train_scope/dense/",
+    "seq2seq": "decoder_train_scope/decoder/dense/"
+}
+
+# variable scopes of the cells inside the MultiRNNCell
+CELL_SCOPES = {
+    "LSTM": "lstm_cell/",
+    "GRU": "gru_cell/",
+    "RNN": "basic_rnn_cell/"
+}
+
+
+# copy the variables of a part of the model (a stack of cells or the dense layer) under a new name
+def copy_variables(weights, variables, scope, new_scope):
+    copied_variables = 0
+    for name, value in variables.items():
+        if name.startswith(scope):
+            weights[new_scope + name[len(scope):]] = value
+            copied_variables += 1
+
+    if copied_variables == 0:
+        raise ValueError("No variables found in the scope {} of the exported model".format(scope))
+
+
+# extract the weights of an exported model of a model tester into a numpy archive for the numpy inference engine
+def export_numpy_model(export_directory):
+    model_spec = read_model_spec(export_directory)
+    model_type = model_spec["model_type"]
+    cell_type = model_spec["cell_type"]
+    seeds = model_spec["seeds"]
+
+    # read the trained values of all the variables from the SavedModel
+    checkpoint_reader = tf.train.load_checkpoint(os.path.join(export_directory, "variables", "variables"))
+    variables = {name: checkpoint_reader.get_tensor(name)
+                 for name in checkpoint_reader.get_variable_to_shape_map().keys()}
+
+    weights = {}
+    for replica_index, seed in enumerate(seeds):
+        # the models of an ensemble are built under a separate scope per seed
+        if len(seeds) > 1:
+            replica_scope = "replica_{}/".format(replica_index)
+        else:
+            replica_scope = ""
+        seed_scope = "seed_{}/".format(seed)
+
+        copy_variables(weights, variables, replica_scope + ENCODER_SCOPES[model_type], seed_scope + "encoder/")
+        if model_type in DECODER_SCOPES:
+            copy_variables(weights, variables, replica_scope + DECODER_SCOPES[model_type], seed_scope + "decoder/")
+        copy_variables(weights, variables, replica_scope + DENSE_LAYER_SCOPES[model_type], seed_scope + "dense/")
+
+    # the names of the cell variables inside the numpy archive are cell_<layer>/<variable>, without the cell scope
+    cell_scope = CELL_SCOPES[cell_type]
+    weights = {name.replace("/" + cell_scope, "/"): value for name, value in weights.items()
+               if "/Adagrad" not in name and "/Adam" not in name and "/COCOB" not in name}
+
+    num_hidden_layers = len({re.search(r"cell_(\d+)/", name).group(1) for name in weights
+                             if name.startswith("seed_{}/encoder/".format(seeds[0]))})
+
+    # the numpy model spec extends the spec of the exported model, which also describes how to convert the forecasts
+    # back to the original units
+    numpy_model_spec = dict(model_spec)
+    numpy_model_spec["num_hidden_layers"] = num_hidden_layers
+
+    np.savez(os.path.join(export_directory, NUMPY_MODEL_FILE_NAME), **weights)
+    with open(os.path.join(export_directory, NUMPY_MODEL_SPEC_FILE_NAME), "w") as numpy_model_spec_file:
+        json.dump(numpy_model_spec, numpy_model_spec_file, indent=4, sort_keys=True)
+
+    print("Exported the weights of {} for the numpy inference engine".format(export_directory))
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser("Export a model for the numpy inference engine")
+    argument_parser.add_argument('--exported_model_directory', required=True,
+                                 help='The directory of the model exported by the model tester')
+
+    # parse the user arguments
+    args = argument_parser.parse_args()
+
+    export_numpy_model(args.exported_model_directory)
@@ -0,0 +1,49 @@
+import json
+import os
+
+
+# unique key of a hyperparameter configuration
+def configuration_key(configs):
+    return json.dumps({str(k): configs[k] for k in configs.keys()}, sort_keys=True, default=float)
+
+
+# append the validation errors of a trial to the trial results file
+def persist_trial_result(file, configs, error, error_list):
+    directory = os.path.dirname(file)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    trial_result = {
+        'configuration': configuration_key(configs),
+        'error': float(error),
+        'error_list': [float(series_error) for series_error in error_list]
+    }
+
+    with open(file, mode='a') as file_object:
+        file_object.write(json.dumps(trial_result) + '\n')
+
+
+# read the validation errors of all the trials keyed by the configuration
+def read_trial_results(file):
+    trial_results = {}
+
+    if not os.path.exists(file):
+        return trial_results
+
+    with open(file) as file_object:
+        for line in file_object:
+            if line.strip():
+                try:
+                    trial_result = json.loads(line)
+                except ValueError:
+                    # the last line is incomplete if the run was interrupted while writing it
+                    continue
+                trial_results[trial_result['configuration']] = (trial_result['error'], trial_result['error_list'])
+
+    return trial_results
+
+
+# remove the trial results of a previous tuning run
+def clear_trial_results(file):
+    if os.path.exists(file):
+        os.remove(file)
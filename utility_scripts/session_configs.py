@@ -0,0 +1,218 @@
+import os
+import time
+from configs.global_configs import cpu_configs
+from configs.global_configs import gpu_configs
+
+# tensorflow is imported only when a session is configured, so that the cpu resources are set before it is loaded
+
+
+# parse a core list of the form 0-3,8 into a sorted list of core ids
+def parse_core_list(core_list):
+    cores = set()
+    for part in core_list.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cores.update(range(int(start), int(end) + 1))
+        else:
+            cores.add(int(part))
+    return sorted(cores)
+
+
+def get_available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+# find the cores for the current process according to the core pinning policy
+def select_cores():
+    available_cores = get_available_cores()
+
+    if cpu_configs.core_pinning_policy == "explicit":
+        cores = parse_core_list(cpu_configs.pinned_cores)
+        if not cores:
+            raise ValueError("The explicit core pinning policy requires the cores to pin to in pinned_cores(e.g. 0-3,8)")
+        return cores
+    elif cpu_configs.core_pinning_policy == "slot":
+        # the slot width is the number of intra op threads so that the jobs sharing the node do not overlap
+        slot_width = cpu_configs.intra_op_parallelism_threads
+        if slot_width <= 0 or slot_width > len(available_cores):
+            slot_width = len(available_cores)
+        number_of_slots = len(available_cores) // slot_width
+        # a wrapped slot would share its cores with another slot and oversubscribe them
+        if cpu_configs.core_pinning_slot >= number_of_slots:
+            raise ValueError("The core pinning slot {} does not fit the {} cores, which have {} slots of {} cores".format(
+                cpu_configs.core_pinning_slot, len(available_cores), number_of_slots, slot_width))
+        start = cpu_configs.core_pinning_slot * slot_width
+        return available_cores[start:start + slot_width]
+
+    return available_cores
+
+
+# the core pinning policies
+CORE_PINNING_POLICIES = ("none", "slot", "explicit")
+
+
+# pin the current process (and all the threads created later on) to the selected cores
+def pin_cores():
+    if cpu_configs.core_pinning_policy not in CORE_PINNING_POLICIES:
+        raise ValueError("Unknown core pinning policy {}. Use one of {}".format(
+            cpu_configs.core_pinning_policy, "/".join(CORE_PINNING_POLICIES)))
+
+    if cpu_configs.core_pinning_policy == "none":
+        return
+
+    if not hasattr(os, "sched_setaffinity"):
+        print("Core pinning is not supported on this platform. Ignoring the core pinning policy {}".format(
+            cpu_configs.core_pinning_policy))
+        return
+
+    os.sched_setaffinity(0, select_cores())
+
+
+# override the cpu configs using the user arguments and apply the core pinning
+def configure_cpu_resources(args):
+    if getattr(args, "intra_op_parallelism_threads", None):
+        cpu_configs.intra_op_parallelism_threads = int(args.intra_op_parallelism_threads)
+    if getattr(args, "inter_op_parallelism_threads", None):
+        cpu_configs.inter_op_parallelism_threads = int(args.inter_op_parallelism_threads)
+    if getattr(args, "core_pinning_policy", None):
+        cpu_configs.core_pinning_policy = args.core_pinning_policy
+    if getattr(args, "core_pinning_slot", None):
+        cpu_configs.core_pinning_slot = int(args.core_pinning_slot)
+    if getattr(args, "pinned_cores", None):
+        cpu_configs.pinned_cores = args.pinned_cores
+    if getattr(args, "xla_jit", None):
+        cpu_configs.xla_jit = bool(int(args.xla_jit))
+
+    pin_cores()
+
+    if cpu_configs.xla_jit:
+        enable_xla_jit()
+
+
+# the result of probing the xla support, the probe runs once per process
+xla_jit_supported = None
+
+
+# check whether this tensorflow build can jit compile a small graph on the cpu
+def probe_xla_jit():
+    global xla_jit_supported
+    if xla_jit_supported is not None:
+        return xla_jit_supported
+
+    import tensorflow as tf
+    from tensorflow.python.client import device_lib
+
+    xla_jit_supported = False
+    try:
+        if not any(device.device_type == "XLA_CPU" for device in device_lib.list_local_devices()):
+            print("This tensorflow build does not include the XLA CPU device")
+            return xla_jit_supported
+
+        probe_graph = tf.Graph()
+        with probe_graph.as_default():
+            matrix = tf.random_normal(shape=[8, 8])
+            probe_output = tf.reduce_sum(tf.tanh(tf.matmul(matrix, matrix)))
+
+        with tf.Session(graph=probe_graph, config=create_session_config(xla_jit=True)) as session:
+            session.run(probe_output)
+        xla_jit_supported = True
+    except (tf.errors.OpError, ValueError) as error:
+        print("XLA jit compilation failed: {}".format(error))
+
+    return xla_jit_supported
+
+
+# turn on the global jit compilation of the cpu clusters, or fall back to the regular execution if it is not supported
+def enable_xla_jit():
+    # the global jit level applies only to the gpu unless the cpu clusters are enabled explicitly
+    xla_flags = os.environ.get("TF_XLA_FLAGS", "")
+    if "--tf_xla_cpu_global_jit" not in xla_flags:
+        os.environ["TF_XLA_FLAGS"] = (xla_flags + " --tf_xla_cpu_global_jit").strip()
+
+    if not probe_xla_jit():
+        print("Falling back to the execution without XLA jit compilation")
+        cpu_configs.xla_jit = False
+
+
+# log the effective cpu settings of the current run
+def print_cpu_configs(run_identifier):
+    available_cores = get_available_cores()
+
+    intra_op_threads = cpu_configs.intra_op_parallelism_threads
+    if intra_op_threads == 0:
+        intra_op_threads = "tensorflow default({} cores)".format(len(available_cores))
+
+    inter_op_threads = cpu_configs.inter_op_parallelism_threads
+    if inter_op_threads == 0:
+        inter_op_threads = "tensorflow default({} cores)".format(len(available_cores))
+
+    print("CPU configs for {}: intra_op_parallelism_threads: {}, inter_op_parallelism_threads: {}, "
+          "core_pinning_policy: {}, cores: {}, xla_jit: {}".format(run_identifier, intra_op_threads, inter_op_threads,
+                                                                   cpu_configs.core_pinning_policy, available_cores,
+                                                                   cpu_configs.xla_jit))
+
+
+# create the config of the tensorflow sessions
+def create_session_config(xla_jit=None):
+    import tensorflow as tf
+
+    if xla_jit is None:
+        xla_jit = cpu_configs.xla_jit
+
+    # define the GPU options
+    gpu_options = tf.GPUOptions(allow_growth=True)
+
+    session_config = tf.ConfigProto(log_device_placement=gpu_configs.log_device_placement, allow_soft_placement=True,
+                                    gpu_options=gpu_options,
+                                    intra_op_parallelism_threads=cpu_configs.intra_op_parallelism_threads,
+                                    inter_op_parallelism_threads=cpu_configs.inter_op_parallelism_threads)
+
+    # compile the clusters of the graph (forward pass, loss and optimizer update) into fused kernels
+    if xla_jit:
+        session_config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+
+    return session_config
+
+
+# measures the time of the training steps
+# under the jit mode, the first step of every new input shape includes the compilation of the graph for that shape,
+# so these steps are reported separately from the steady state steps
+class StepTimer:
+
+    def __init__(self):
+        self.__seen_shapes = set()
+        self.__compile_step_times = []
+        self.__steady_state_step_times = []
+        self.__start_time = None
+
+    def start(self):
+        self.__start_time = time.time()
+
+    def stop(self, input_shape):
+        step_time = time.time() - self.__start_time
+        input_shape = tuple(input_shape)
+        if input_shape in self.__seen_shapes:
+            self.__steady_state_step_times.append(step_time)
+        else:
+            self.__seen_shapes.add(input_shape)
+            self.__compile_step_times.append(step_time)
+
+    def report(self):
+        if cpu_configs.xla_jit:
+            first_step_name = "compilation steps"
+        else:
+            first_step_name = "first steps of the input shapes"
+
+        if self.__steady_state_step_times:
+            steady_state_step_time = 1000 * sum(self.__steady_state_step_times) / len(self.__steady_state_step_times)
+        else:
+            steady_state_step_time = 0.0
+
+        print("Training step times: {} {} taking {:.3f}s in total, steady state {:.3f}ms per step over {} steps".format(
+            len(self.__compile_step_times), first_step_name, sum(self.__compile_step_times), steady_state_step_time,
+            len(self.__steady_state_step_times)))
@@ -0,0 +1,25 @@
+import math
+import tensorflow as tf
+
+
+# number of epochs in each learning rate cycle of a snapshot ensemble
+# without snapshot ensembling the whole training run is a single cycle
+def snapshot_cycle_length(max_num_epochs, snapshot_ensemble_size):
+    return max(1, int(max_num_epochs) // int(snapshot_ensemble_size))
+
+
+# cosine annealing of the learning rate from the full learning rate at the start of a cycle to zero at its end
+# the number of steps of an epoch is only known after the first epoch, until then the scale changes once per epoch
+def cyclic_learning_rate_scale(epoch, step, steps_per_epoch, cycle_length):
+    cycle_position = epoch % cycle_length
+    if steps_per_epoch:
+        cycle_position += min(step, steps_per_epoch) / float(steps_per_epoch)
+    return 0.5 * (1.0 + math.cos(math.pi * cycle_position / cycle_length))
+
+
+# op to reset the state of the optimizer (the slot variables and the step counters) at the start of a new cycle
+# the model variables are the global variables that existed before the optimizer was created
+def create_optimizer_reset_op(model_variables):
+    model_variables = set(model_variables)
+    optimizer_variables = [var for var in tf.global_variables() if var not in model_variables]
+    return tf.variables_initializer(optimizer_variables)
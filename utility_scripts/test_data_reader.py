@@ -0,0 +1,70 @@
+import csv
+import numpy as np
+from collections import OrderedDict
+
+
+# read the inputs and the metadata of the test time series from the preprocessed text test file
+# the result holds a [sequence_length, input_size] input array and a [sequence_length, metadata_size] metadata array
+# per series, in the order of the series in the file
+def read_txt_test_data(txt_test_file_path, input_format, input_size):
+    list_of_test_inputs = []
+    list_of_test_metadata = []
+
+    with open(txt_test_file_path) as test_file:
+        test_data_list = [series for series in csv.reader(test_file, delimiter=" ") if series]
+
+    if input_format == "moving_window":
+        # every line is a window of a series, the windows of the same series share the series id in the first column
+        windows_of_series = OrderedDict()
+        for window in test_data_list:
+            windows_of_series.setdefault(window[0], []).append(window)
+
+        for windows in windows_of_series.values():
+            list_of_test_inputs.append(
+                np.ascontiguousarray([window[1: input_size + 1] for window in windows], dtype=np.float32))
+            list_of_test_metadata.append(
+                np.ascontiguousarray([window[input_size + 2:] for window in windows], dtype=np.float32))
+    else:
+        # every line is a series
+        for series in test_data_list:
+            meta_data_index = series.index("|#")
+            list_of_test_inputs.append(
+                np.ascontiguousarray(series[1: meta_data_index], dtype=np.float32).reshape(-1, 1))
+            list_of_test_metadata.append(
+                np.ascontiguousarray(series[meta_data_index + 1:], dtype=np.float32).reshape(-1, 1))
+
+    return list_of_test_inputs, list_of_test_metadata
+
+
+# read the inputs and the metadata of the test time series from the binary tfrecord test file
+def read_tfrecord_test_data(binary_test_file_path):
+    # tensorflow is only needed to decode the binary files
+    import tensorflow as tf
+
+    list_of_test_inputs = []
+    list_of_test_metadata = []
+
+    options = tf.python_io.TFRecordOptions(tf.python_io.TFRecordCompressionType.ZLIB)
+    for serialized_example in tf.python_io.tf_record_iterator(binary_test_file_path, options=options):
+        sequence_example = tf.train.SequenceExample.FromString(serialized_example)
+        feature_lists = sequence_example.feature_lists.feature_list
+        list_of_test_inputs.append(np.ascontiguousarray(
+            [feature.float_list.value for feature in feature_lists["input"].feature], dtype=np.float32))
+        list_of_test_metadata.append(np.ascontiguousarray(
+            [feature.float_list.value for feature in feature_lists["metadata"].feature], dtype=np.float32))
+
+    return list_of_test_inputs, list_of_test_metadata
+
+
+# pad a minibatch of input sequences to the length of the longest sequence, the same way as the padded batches of the
+# tf.data pipelines of the testers
+def pad_test_inputs(list_of_test_inputs):
+    sequence_lengths = np.array([len(test_input) for test_input in list_of_test_inputs], dtype=np.int64)
+    input_dimension = np.shape(list_of_test_inputs[0])[1]
+
+    padded_test_inputs = np.zeros(shape=[len(list_of_test_inputs), np.max(sequence_lengths), input_dimension],
+                                  dtype=np.float32)
+    for index, test_input in enumerate(list_of_test_inputs):
+        padded_test_inputs[index, :len(test_input)] = test_input
+
+    return sequence_lengths, padded_test_inputs
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import shutil
+import numpy as np
+from configs.global_configs import model_training_configs
+from utility_scripts.persist_trial_results import configuration_key
+
+# tensorflow is imported only by the TrainingCheckpoint, so that the generic scripts can use the other functions
+# without loading it
+
+
+# directory of the checkpoints of a run, keyed by the run identifier and the hyperparameter configuration
+def get_checkpoint_directory(run_identifier, configs):
+    configuration_hash = hashlib.md5(configuration_key(configs).encode("utf-8")).hexdigest()[:12]
+    return model_training_configs.CHECKPOINTS_DIRECTORY + run_identifier + "_" + configuration_hash
+
+
+# remove the checkpoints of a run once its results are persisted
+def remove_checkpoint_directory(checkpoint_directory):
+    if checkpoint_directory and os.path.exists(checkpoint_directory):
+        shutil.rmtree(checkpoint_directory, ignore_errors=True)
+
+
+# write a file atomically, so that an interrupted run never leaves a partially written file behind
+def write_file_atomically(file_path, write_fn):
+    temporary_file_path = file_path + ".tmp"
+    with open(temporary_file_path, "w") as output:
+        write_fn(output)
+    os.replace(temporary_file_path, file_path)
+
+
+# periodic checkpoints of the model and the optimizer of a training run
+# the checkpoint has to be created after all the variables of the graph since it saves all of them
+# without a checkpoint directory the checkpointing is disabled and the training always starts from scratch
+class TrainingCheckpoint:
+
+    def __init__(self, checkpoint_directory):
+        import tensorflow as tf
+
+        self.__checkpoint_directory = checkpoint_directory
+
+        if not self.__checkpoint_directory:
+            return
+
+        # number of epochs trained before the checkpoint was saved
+        self.__completed_epochs = tf.Variable(0, dtype=tf.int64, trainable=False, name="completed_epochs")
+        self.__completed_epochs_value = tf.placeholder(dtype=tf.int64, shape=[])
+        self.__completed_epochs_assign_op = tf.assign(self.__completed_epochs, self.__completed_epochs_value)
+
+        self.__saver = tf.train.Saver(max_to_keep=1)
+
+    # restore the latest checkpoint if there is one and return the epoch to continue the training from
+    def restore(self, session):
+        import tensorflow as tf
+
+        if not self.__checkpoint_directory:
+            return 0
+
+        latest_checkpoint = tf.train.latest_checkpoint(self.__checkpoint_directory)
+        if latest_checkpoint is None:
+            return 0
+
+        self.__saver.restore(session, latest_checkpoint)
+        completed_epochs = int(session.run(self.__completed_epochs))
+        print("Resuming from the checkpoint {} after epoch {}".format(latest_checkpoint, completed_epochs))
+        return completed_epochs
+
+    # save a checkpoint every CHECKPOINT_FREQ epochs
+    def save(self, session, completed_epochs):
+        if not self.__checkpoint_directory or completed_epochs % model_training_configs.CHECKPOINT_FREQ != 0:
+            return
+
+        if not os.path.exists(self.__checkpoint_directory):
+            os.makedirs(self.__checkpoint_directory)
+
+        session.run(self.__completed_epochs_assign_op, feed_dict={self.__completed_epochs_value: completed_epochs})
+        self.__saver.save(session, os.path.join(self.__checkpoint_directory, "model"))
+
+    # forecasts taken in the middle of a training run (the snapshot ensembles) are stored next to the checkpoint
+    def save_snapshot_forecasts(self, snapshot_index, forecasts):
+        if not self.__checkpoint_directory:
+            return
+
+        if not os.path.exists(self.__checkpoint_directory):
+            os.makedirs(self.__checkpoint_directory)
+
+        snapshot_file_path = os.path.join(self.__checkpoint_directory, "snapshot_{}.npy".format(snapshot_index))
+        temporary_file_path = snapshot_file_path + ".tmp.npy"
+        np.save(temporary_file_path, np.array(forecasts))
+        os.replace(temporary_file_path, snapshot_file_path)
+
+    # load the forecasts of the first number_of_snapshots snapshots, which were taken before the restored checkpoint
+    def load_snapshot_forecasts(self, number_of_snapshots):
+        if not self.__checkpoint_directory:
+            return []
+
+        snapshot_forecasts = []
+        for snapshot_index in range(number_of_snapshots):
+            snapshot_file_path = os.path.join(self.__checkpoint_directory, "snapshot_{}.npy".format(snapshot_index))
+            snapshot_forecasts.append(np.load(snapshot_file_path))
+        return snapshot_forecasts
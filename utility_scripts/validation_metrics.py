@@ -0,0 +1,175 @@
+import numpy as np
+
+from utility_scripts.forecast_postprocessing import denormalize_forecasts
+
+
+# the rows of the accumulated errors
+SMAPE_INDEX = 0
+STABLE_SMAPE_INDEX = 1
+MEAN_ABSOLUTE_ERROR_INDEX = 2
+
+
+# the validation errors of the trainers, accumulated over the minibatches of the validation data
+# every batch is converted to the original units and evaluated as a whole, and the errors of its series are written
+# into preallocated arrays, whose capacity is doubled whenever the series do not fit anymore
+class ValidationMetricsAccumulator:
+
+    def __init__(self, **kwargs):
+        self.__moving_window = kwargs["moving_window"]
+        self.__contain_zero_values = kwargs["contain_zero_values"]
+        self.__integer_conversion = kwargs["integer_conversion"]
+        self.__without_stl_decomposition = kwargs["without_stl_decomposition"]
+        # the MASE scaling of the training part of every validation series, without the validation horizon, in the
+        # order of the validation data. Without them, the MASE is not calculated
+        self.__mase_scales = kwargs.get("mase_scales")
+
+        self.__number_of_series = 0
+        # the errors of every series in the format [number_of_metrics, capacity]
+        self.__errors = np.empty(shape=[3, kwargs.get("initial_capacity", 1024)], dtype=np.float64)
+
+    # the actual values and the level and the seasonal values of the last input of every series of a batch
+    # the moving window format has them for every input window in the format [batch_size, sequence_length, dimension]
+    # and the non moving window format once per series in the format [batch_size, dimension, 1]
+    def __last_values(self, sequence_lengths, actual_values, metadata):
+        if self.__moving_window:
+            array_first_dimension = np.arange(len(sequence_lengths))
+            last_indices = np.asarray(sequence_lengths) - 1
+            actual_values = actual_values[array_first_dimension, last_indices, :]
+            metadata = metadata[array_first_dimension, last_indices, :]
+        else:
+            actual_values = actual_values[:, :, 0]
+            metadata = metadata[:, :, 0]
+
+        return actual_values, metadata[:, 0], metadata[:, 1:]
+
+    def __reserve(self, number_of_series):
+        capacity = self.__errors.shape[1]
+        if number_of_series <= capacity:
+            return
+
+        while capacity < number_of_series:
+            capacity *= 2
+        errors = np.empty(shape=[self.__errors.shape[0], capacity], dtype=np.float64)
+        errors[:, :self.__number_of_series] = self.__errors[:, :self.__number_of_series]
+        self.__errors = errors
+
+    # add the forecasts of a batch of validation series in the format [batch_size, output_size] or
+    # [batch_size, output_size, 1]
+    def add_batch(self, forecasts, sequence_lengths, actual_values, metadata):
+        actual_values, level_values, seasonal_values = self.__last_values(sequence_lengths, actual_values, metadata)
+        forecasts = np.reshape(forecasts, np.shape(actual_values))
+
+        # convert the data to remove the preprocessing
+        converted_forecasts = denormalize_forecasts(forecasts, level_values, seasonal_values,
+                                                    self.__contain_zero_values, self.__integer_conversion,
+                                                    self.__without_stl_decomposition)
+        converted_actual_values = denormalize_forecasts(actual_values, level_values, seasonal_values,
+                                                        self.__contain_zero_values, self.__integer_conversion,
+                                                        self.__without_stl_decomposition)
+
+        absolute_errors = np.abs(converted_forecasts - converted_actual_values)
+        absolute_sums = np.abs(converted_forecasts) + np.abs(converted_actual_values)
+
+        batch_start = self.__number_of_series
+        batch_end = batch_start + len(absolute_errors)
+        self.__reserve(batch_end)
+
+        # the smape, and the smape which addresses the near zero instability
+        epsilon = 0.1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.__errors[SMAPE_INDEX, batch_start:batch_end] = np.mean(2 * absolute_errors / absolute_sums, axis=1)
+        self.__errors[STABLE_SMAPE_INDEX, batch_start:batch_end] = np.mean(
+            2 * absolute_errors / np.maximum(absolute_sums + epsilon, 0.5 + epsilon), axis=1)
+        self.__errors[MEAN_ABSOLUTE_ERROR_INDEX, batch_start:batch_end] = np.mean(absolute_errors, axis=1)
+
+        self.__number_of_series = batch_end
+
+    # the smape of every series
+    def smape(self, address_near_zero_instability):
+        if address_near_zero_instability:
+            return self.__errors[STABLE_SMAPE_INDEX, :self.__number_of_series]
+        return self.__errors[SMAPE_INDEX, :self.__number_of_series]
+
+    # the MASE of every series, None without the MASE scalings of all the series
+    def mase(self):
+        if self.__mase_scales is None or len(self.__mase_scales) != self.__number_of_series:
+            return None
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.__errors[MEAN_ABSOLUTE_ERROR_INDEX, :self.__number_of_series] / self.__mase_scales
+
+    # add the errors of a batch of validation series computed by the validation error graph, in the format
+    # [number_of_metrics, batch_size]
+    def add_errors(self, errors):
+        batch_start = self.__number_of_series
+        batch_end = batch_start + np.shape(errors)[1]
+        self.__reserve(batch_end)
+
+        self.__errors[:, batch_start:batch_end] = errors
+        self.__number_of_series = batch_end
+
+
+# the errors of every series of a validation batch computed inside the graph of a trainer, in the same rows as the
+# accumulator. The forecasts are built on the validation batches of the iterator of the trainer and converted to the
+# original units with the same steps as denormalize_forecasts, so only the errors of the series leave the session
+class ValidationErrorGraph:
+
+    # the validation batch is the next element of the iterator of the padded validation batches, in the format
+    # (sequence_lengths, inputs, actual_values, metadata)
+    def __init__(self, forecasts, validation_data_batch, **kwargs):
+        import tensorflow as tf
+
+        contain_zero_values = kwargs["contain_zero_values"]
+        integer_conversion = kwargs["integer_conversion"]
+        without_stl_decomposition = kwargs["without_stl_decomposition"]
+        sequence_lengths, _, actual_values, metadata = validation_data_batch
+
+        if kwargs["moving_window"]:
+            # the values of the last input window of every series
+            last_indices = tf.stack([tf.range(start=0, limit=tf.shape(sequence_lengths)[0], delta=1),
+                                     tf.cast(sequence_lengths, dtype=tf.int32) - 1], axis=-1)
+            actual_values = tf.gather_nd(params=actual_values, indices=last_indices)
+            metadata = tf.gather_nd(params=metadata, indices=last_indices)
+        else:
+            actual_values = actual_values[:, :, 0]
+            metadata = metadata[:, :, 0]
+
+        forecasts = tf.cast(tf.reshape(forecasts, shape=tf.shape(actual_values)), dtype=tf.float64)
+        actual_values = tf.cast(actual_values, dtype=tf.float64)
+        level_values = tf.cast(metadata[:, 0:1], dtype=tf.float64)
+        seasonal_values = tf.cast(metadata[:, 1:], dtype=tf.float64)
+
+        def denormalize(values):
+            if without_stl_decomposition:
+                converted_values = tf.exp(values)
+            else:
+                converted_values = tf.exp(values + level_values + seasonal_values)
+
+            if contain_zero_values:
+                converted_values = converted_values - 1
+
+            # without the stl decomposition the series are normalized by dividing by the level
+            if without_stl_decomposition:
+                converted_values = converted_values * level_values
+
+            # round half to even like the round function of R
+            if integer_conversion:
+                converted_values = tf.round(converted_values)
+
+            # to make all forecasts positive
+            return tf.maximum(converted_values, 0.0)
+
+        converted_forecasts = denormalize(forecasts)
+        converted_actual_values = denormalize(actual_values)
+
+        absolute_errors = tf.abs(converted_forecasts - converted_actual_values)
+        absolute_sums = tf.abs(converted_forecasts) + tf.abs(converted_actual_values)
+
+        # the smape, and the smape which addresses the near zero instability
+        epsilon = 0.1
+        smape_values = tf.reduce_mean(2 * absolute_errors / absolute_sums, axis=1)
+        stable_smape_values = tf.reduce_mean(
+            2 * absolute_errors / tf.maximum(absolute_sums + epsilon, 0.5 + epsilon), axis=1)
+        mean_absolute_errors = tf.reduce_mean(absolute_errors, axis=1)
+
+        # format [number_of_metrics, batch_size]
+        self.errors = tf.stack([smape_values, stable_smape_values, mean_absolute_errors], axis=0)